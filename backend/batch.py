@@ -0,0 +1,52 @@
+import zipfile
+import time
+
+from config import RESPONSE_CHUNK_BYTES
+
+
+class ZipStream:
+    """
+    Zip archive written on the fly to an in-memory sink. After each member,
+    take() hands out the bytes produced so far, so the archive can be sent
+    while later members are still being built. Members are stored, not
+    deflated again: xlsx files are zip archives already.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._zip = zipfile.ZipFile(self, mode="w", compression=zipfile.ZIP_STORED)
+
+    # file-like sink for ZipFile; without tell/seek it writes data descriptors
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+    def _info(self, name: str):
+        return zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+
+    def add_bytes(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(self._info(name), data)
+        return self.take()
+
+    def add_file(self, path: str, name: str):
+        """Copies a file into the archive, yielding the output chunk by chunk."""
+        with open(path, "rb") as src, self._zip.open(self._info(name), mode="w") as dest:
+            while True:
+                chunk = src.read(RESPONSE_CHUNK_BYTES)
+                if not chunk:
+                    break
+                dest.write(chunk)
+                yield self.take()
+        yield self.take()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self.take()
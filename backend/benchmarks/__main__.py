@@ -0,0 +1,168 @@
+"""
+Times each sheet builder on a synthetic tree and writes the results as JSON.
+
+    cd backend
+    python -m benchmarks --depth 6 --fanout 4 --roles 10 30 --out bench.json
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import openpyxl
+from openpyxl import Workbook
+
+from config import LEFT_HEADERS, PERM_HEADERS, DATA_START_ROW, ROLES_COUNT
+from builder import build_workbook
+from utils import flatten_tree, tree_max_depth, autosize_columns, ColumnWidths
+from synthetic import synthetic_tree
+from worksheets import create_sheet, write_rows, add_second_sheet, add_third_sheet
+
+
+def measure(setup, run, repeat: int, memory: bool):
+    """Best of `repeat` timed runs, plus one traced run for the peak allocation."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        state = setup()
+        t0 = time.perf_counter()
+        result = run(state)
+        times.append(time.perf_counter() - t0)
+
+    out = {"seconds": min(times), "runs": times}
+    if memory:
+        state = setup()
+        tracemalloc.start()
+        run(state)
+        out["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return out, result
+
+
+def empty_workbook():
+    wb = Workbook()
+    wb.remove(wb.active)
+    return wb
+
+
+def ge_sheet(table):
+    max_depth = max(0, tree_max_depth(table))
+    widths = ColumnWidths()
+    wb, ws, cols = create_sheet(
+        max_depth + 1,
+        perm1_cols=len(LEFT_HEADERS),
+        perm2_cols=len(PERM_HEADERS),
+        max_depth=max_depth,
+        widths=widths,
+    )
+    write_rows(ws, table, DATA_START_ROW, cols, widths)
+    widths.apply(ws, cols["tree_end"], min_w=8, max_w=60)
+    return wb
+
+
+def save(wb):
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.tell()
+
+
+def run_benchmarks(tree, roles_counts, repeat: int, memory: bool):
+    table = flatten_tree(tree)
+    results = {}
+
+    results["flatten_tree"], _ = measure(lambda: None, lambda _: flatten_tree(tree), repeat, memory)
+    results["ge"], wb = measure(lambda: None, lambda _: ge_sheet(table), repeat, memory)
+    results["autosize_columns"], _ = measure(
+        lambda: ge_sheet(table), lambda w: autosize_columns(w.active, 8, 60), repeat, memory
+    )
+    results["ablage"], _ = measure(empty_workbook, lambda w: add_second_sheet(w, table), repeat, memory)
+    for n in roles_counts:
+        results[f"roles[{n}]"], _ = measure(
+            empty_workbook, lambda w, n=n: add_third_sheet(w, table, n), repeat, memory
+        )
+
+    def full_workbook():
+        wb = ge_sheet(table)
+        add_second_sheet(wb, table)
+        add_third_sheet(wb, table, ROLES_COUNT)
+        return wb
+
+    results["save"], size = measure(full_workbook, save, repeat, memory)
+    results["save"]["file_bytes"] = size
+
+    sheets = ["GE", "Ablage", "Roles"]
+    results["stream"], size = measure(
+        lambda: None,
+        lambda _: save(build_workbook(table, sheets, ROLES_COUNT, True)),
+        repeat,
+        memory,
+    )
+    results["stream"]["file_bytes"] = size
+    results["fast"], size = measure(
+        lambda: None,
+        lambda _: save(build_workbook(table, sheets, ROLES_COUNT, True, engine="fast")),
+        repeat,
+        memory,
+    )
+    results["fast"]["file_bytes"] = size
+    results["fast_sparse"], size = measure(
+        lambda: None,
+        lambda _: save(build_workbook(table, sheets, ROLES_COUNT, True, engine="fast", fillers="sparse")),
+        repeat,
+        memory,
+    )
+    results["fast_sparse"]["file_bytes"] = size
+    return table, results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.splitlines()[1])
+    p.add_argument("--depth", type=int, default=6)
+    p.add_argument("--fanout", type=int, default=4)
+    p.add_argument("--disabled", type=float, default=0.1)
+    p.add_argument("--ab", type=float, default=0.15)
+    p.add_argument("--pe", type=float, default=0.1)
+    p.add_argument("--poeing", type=float, default=0.05)
+    p.add_argument("--desc-len", type=int, default=40)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--roles", type=int, nargs="+", default=[ROLES_COUNT, 30])
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    p.add_argument("--out", help="write JSON here instead of stdout")
+    args = p.parse_args(argv)
+
+    params = {
+        "depth": args.depth, "fanout": args.fanout, "disabled": args.disabled,
+        "ab": args.ab, "pe": args.pe, "poeing": args.poeing,
+        "desc_len": args.desc_len, "seed": args.seed,
+    }
+    tree = synthetic_tree(**params)
+    table, results = run_benchmarks(tree, args.roles, args.repeat, not args.no_memory)
+
+    report = {
+        "params": params,
+        "nodes": len(table),
+        "max_depth": tree_max_depth(table),
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "openpyxl": openpyxl.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+    for name, r in results.items():
+        peak = f"  peak {r['peak_bytes'] / 2**20:7.1f} MiB" if "peak_bytes" in r else ""
+        print(f"{name:18} {r['seconds']:8.3f}s{peak}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import shutil
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+
+from openpyxl import Workbook
+
+from config import (
+    LEFT_HEADERS,
+    PERM_HEADERS,
+    DATA_START_ROW,
+    STREAM_NODE_THRESHOLD,
+    SPOOL_MAX_BYTES,
+    XLSX_COMPRESSION,
+    GE_FILLERS,
+)
+from metrics import StageTimer
+from parts import SPLICE_UNSUPPORTED, sheet_part, splice, write_package
+from sheetml import SheetMLBook
+from utils import tree_max_depth, ColumnWidths
+from worksheets import (
+    create_sheet,
+    write_rows,
+    stream_sheet,
+    add_second_sheet,
+    stream_second_sheet,
+    add_third_sheet,
+    stream_third_sheet,
+)
+
+
+def build_ge_sheet(table, max_depth: int, progress=None, sparse=False):
+    widths = ColumnWidths()
+    wb, ws, cols = create_sheet(
+        max_depth + 1,
+        perm1_cols=len(LEFT_HEADERS),
+        perm2_cols=len(PERM_HEADERS),
+        max_depth=max_depth,
+        widths=widths,
+    )
+    write_rows(ws, table, DATA_START_ROW, cols, widths, progress, sparse)
+    widths.apply(ws, cols["tree_end"], min_w=8, max_w=60)
+    return wb, ws
+
+
+def build_workbook(table, sheets, roles_count: int, stream: bool, timer=None, progress=None,
+                   engine: str = "openpyxl", fillers: str = GE_FILLERS):
+    """
+    Builds the selected sheets; with a StageTimer each sheet is timed as
+    ge/ablage/roles, with a progress (see jobs.JobProgress) their rows are counted.
+    The "fast" engine streams the same rows into a sheetml.SheetMLBook.
+    fillers="sparse" leaves the GE filler and spacer cells out.
+
+    The Roles sheet is written by the fast engine whatever the engine (see
+    roles_book), so the workbook comes back as a SheetMLBook once it holds
+    that sheet; both kinds are saved with save().
+    """
+    timer = timer or StageTimer()
+    max_depth = max(0, tree_max_depth(table))
+    sparse = fillers == "sparse"
+
+    if stream or engine == "fast":
+        wb = SheetMLBook() if engine == "fast" else Workbook(write_only=True)
+        if "GE" in sheets:
+            with timer("ge"):
+                stream_sheet(wb, table, max_depth, progress, sparse)
+        if "Ablage" in sheets:
+            with timer("ablage"):
+                stream_second_sheet(wb, table, progress)
+        if "Roles" in sheets:
+            with timer("roles"):
+                wb = roles_book(wb)
+                stream_third_sheet(wb, table, roles_count, progress)
+    else:
+        if "GE" in sheets:
+            with timer("ge"):
+                wb, _ = build_ge_sheet(table, max_depth, progress, sparse)
+        else:
+            wb = Workbook()
+            wb.remove(wb.active)
+
+        if "Ablage" in sheets:
+            with timer("ablage"):
+                add_second_sheet(wb, table, progress)
+
+        if "Roles" in sheets:
+            with timer("roles"):
+                wb = roles_book(wb)
+                if isinstance(wb, SheetMLBook):
+                    stream_third_sheet(wb, table, roles_count, progress)
+                else:
+                    add_third_sheet(wb, table, roles_count, progress)
+
+    return wb
+
+
+def roles_book(wb):
+    """
+    Where the Roles sheet goes. Its role grid is 3 + 3*rolesCount columns
+    wide, and openpyxl writes each of those cells on every row, while the
+    fast engine writes the grid of a row from one cached CellRun fragment.
+    So the sheet is written by a SheetMLBook sharing wb, except where the
+    package can't be spliced (parts.SPLICE_UNSUPPORTED) and openpyxl writes it.
+    """
+    if isinstance(wb, SheetMLBook) or SPLICE_UNSUPPORTED:
+        return wb
+    return SheetMLBook(wb)
+
+
+def build_part(table, sheet: str, roles_count: int, progress=None, fillers: str = GE_FILLERS):
+    """One sheet built in a workbook of its own and serialised as a SheetPart."""
+    if sheet == "GE":
+        wb, ws = build_ge_sheet(table, max(0, tree_max_depth(table)), progress, fillers == "sparse")
+        return sheet_part(wb, ws)
+    if sheet == "Roles":
+        # written by the fast engine, see roles_book
+        book = SheetMLBook()
+        return book.part(stream_third_sheet(book, table, roles_count, progress))
+    wb = Workbook()
+    wb.remove(wb.active)
+    return sheet_part(wb, add_second_sheet(wb, table, progress))
+
+
+def render_workbook(table, sheets, roles_count: int, stream: bool, parts=None, progress=None,
+                    engine: str = "openpyxl", compression: str = XLSX_COMPRESSION,
+                    fillers: str = GE_FILLERS):
+    """
+    Builds and saves the workbook into a SpooledTemporaryFile. Up to
+    SPOOL_MAX_BYTES the xlsx is returned as bytes; larger files have already
+    rolled over to disk and are moved to a named temp file whose path is
+    returned instead (the caller deletes it). The second value holds the
+    stage durations in seconds.
+
+    Outside streaming mode every sheet is a SheetPart: those passed in
+    `parts` (keyed by sheet name) are reused, the others are built, and the
+    package is spliced from them. The third value holds the newly built
+    parts for the caller to cache. Streamed workbooks are written directly
+    and never produce parts, so large trees are not held as XML in memory.
+
+    A progress object is told about every row written, reused part and the save.
+    The "fast" engine writes the sheet XML itself and, like streaming, uses
+    no parts. When openpyxl can't be spliced (parts.SPLICE_UNSUPPORTED) the
+    workbook is built whole and saved as is, and no parts are used either.
+
+    The package is zipped at the named compression level; the fourth value
+    holds its stats (see parts.write_package), and the time spent in the
+    compressor, which is part of "save", is also reported as stage "compress".
+    `fillers` is passed on to build_workbook.
+    """
+    timer = StageTimer()
+    stream = stream or len(table) > STREAM_NODE_THRESHOLD
+    parts = parts or {}
+    built = {}
+
+    with SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        if stream or engine == "fast" or SPLICE_UNSUPPORTED:
+            wb = build_workbook(table, sheets, roles_count, stream, timer, progress, engine, fillers)
+            if progress is not None:
+                progress.saving()
+            with timer("save"):
+                if isinstance(wb, SheetMLBook):
+                    packing = wb.save(spool, compression)
+                else:
+                    packing = write_package(wb, {}, spool, compression)
+            del wb
+        else:
+            ordered = []
+            for sheet, stage in (("GE", "ge"), ("Ablage", "ablage"), ("Roles", "roles")):
+                if sheet not in sheets:
+                    continue
+                part = parts.get(sheet)
+                if part is None:
+                    with timer(stage):
+                        part = built[sheet] = build_part(table, sheet, roles_count, progress, fillers)
+                elif progress is not None:
+                    progress.reused(sheet)
+                ordered.append(part)
+            if progress is not None:
+                progress.saving()
+            with timer("save"):
+                packing = splice(ordered, spool, compression)
+        timer.stages["compress"] = packing["seconds"]
+
+        size = spool.tell()
+        spool.seek(0)
+        if size <= SPOOL_MAX_BYTES:
+            return spool.read(), timer.stages, built, packing
+        with NamedTemporaryFile(suffix=".xlsx", delete=False) as out:
+            shutil.copyfileobj(spool, out)
+            return out.name, timer.stages, built, packing
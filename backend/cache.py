@@ -0,0 +1,116 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+# node fields each sheet reads; the tree shape is carried by the preorder depths
+SHEET_FIELDS = {
+    "GE": ("depth", "name", "app", "enabled"),
+    "Ablage": ("depth", "name", "app", "desc", "enabled", "unterbrechen"),
+    "Roles": ("depth", "app", "desc", "enabled"),
+}
+TABLE_FIELDS = ("depth", "name", "app", "desc", "enabled", "unterbrechen")
+
+
+def _digest(value) -> str:
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def table_digests(table):
+    """
+    One hash per node field of the flattened tree, so the same tree posted
+    twice hashes the same no matter how the client serialised it, and
+    hashing is not bounded by the nesting depth.
+    """
+    return {f: _digest(getattr(table, f)) for f in TABLE_FIELDS}
+
+
+def payload_key(digests, sheets, roles_count: int, compression: str, fillers: str) -> str:
+    """
+    Content hash of everything that determines the workbook file. The engine
+    is left out: both write the same cells, so either build may answer.
+    """
+    return _digest({
+        "tree": digests, "sheets": sorted(sheets), "rolesCount": roles_count, "compression": compression,
+        "fillers": fillers,
+    })
+
+
+def sheet_keys(digests, sheets, roles_count: int, fillers: str):
+    """Per sheet, a hash of only the inputs that sheet depends on."""
+    return {
+        s: _digest({
+            "sheet": s,
+            "tree": [digests[f] for f in SHEET_FIELDS[s]],
+            "rolesCount": roles_count if s == "Roles" else None,
+            "fillers": fillers if s == "GE" else None,
+        })
+        for s in sheets
+    }
+
+
+def etag_for(key: str) -> str:
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match, key: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag_for(key):
+            return True
+    return False
+
+
+class WorkbookCache:
+    """
+    LRU of generated workbooks (or sheet parts), bounded by the total size of
+    the stored bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: str, data, size: int = None):
+        size = len(data) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[key] = (data, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
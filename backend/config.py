@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 PREFIX = "203_"
 GROUPS_FROM_LEVEL = 3
 
@@ -27,4 +30,78 @@ LEFT_SUFFIX  = [s for h, s in zip(PERM_HEADERS, PERM_SUFFIX) if h != "Schreiben"
 FORCE_BLUE = {"Org", "Org Name"}
 
 ROLES_COUNT = 10
+# same bound as the Laravel export controller; far below Excel's 16384 columns
+ROLES_COUNT_MAX = 50
+# rolesCount the Laravel side sends when the Roles sheet is not selected
+ROLES_OMITTED = 0
 ROLE_HEADER_TEXT = "Rollenname"
+
+# Above this many nodes /generate-excel switches to the write-only (streaming) engine
+STREAM_NODE_THRESHOLD = 5000
+
+# Upper bound for the /generate-excel response cache (sum of workbook sizes)
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Request limits: bodies over MAX_BODY_BYTES and trees of more than MAX_TREE_NODES
+# nodes are refused with 413, trees nested deeper than MAX_TREE_DEPTH levels with 422
+MAX_BODY_BYTES = 64 * 1024 * 1024
+MAX_TREE_NODES = 500_000
+MAX_TREE_DEPTH = 200
+
+# Workbook builds run in a process pool so one big export can't block the event loop
+BUILD_WORKERS = 4
+BUILD_TIMEOUT_S = 300
+
+# serve.py runs SERVE_WORKERS server processes and replaces one whose RSS (with
+# its build pools) is above WORKER_MAX_RSS_BYTES after an export, or that has
+# done WORKER_MAX_EXPORTS exports; 0 turns a limit off. A replaced worker gets
+# WORKER_DRAIN_TIMEOUT_S to finish its open requests before it is killed.
+SERVE_WORKERS = 2
+WORKER_MAX_RSS_BYTES = 1536 * 1024 * 1024
+WORKER_MAX_EXPORTS = 500
+WORKER_DRAIN_TIMEOUT_S = BUILD_TIMEOUT_S + 30
+
+# Finished workbooks above this size are spooled to disk and streamed in chunks
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+RESPONSE_CHUNK_BYTES = 64 * 1024
+
+# /generate-excel/batch: upper bound for the jobs in one request
+BATCH_MAX_JOBS = 200
+
+# Upper bound for cached per-sheet worksheet parts (sum of their XML sizes)
+PART_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# /jobs: background exports run in a pool of their own, so they never hold up
+# /generate-excel; above JOB_QUEUE_MAX unfinished jobs new ones get 429
+JOB_WORKERS = 2
+JOB_QUEUE_MAX = 16
+# jobs are kept as files under JOB_DIR, so every serve.py worker can answer for them
+JOB_DIR = os.path.join(tempfile.gettempdir(), "excel-jobs")
+# finished jobs and their results are dropped this long after they end
+JOB_TTL_S = 3600
+# ...or earlier, oldest first, once more than JOB_RESULTS_MAX results or
+# JOB_RESULTS_MAX_BYTES of them are held
+JOB_RESULTS_MAX = 64
+JOB_RESULTS_MAX_BYTES = 512 * 1024 * 1024
+JOB_SWEEP_S = 60
+# a job that is unfinished this long after it was created is failed
+JOB_TIMEOUT_S = 3600
+# the process that took a job touches its heartbeat this often; a job whose
+# heartbeat stopped is failed, its owner being gone or hung on whichever host
+# or container it ran (pids can't tell that across them)
+JOB_HEARTBEAT_S = 10
+
+# Zip compression of the xlsx unless a request sets its own: stored, fast, default or max
+XLSX_COMPRESSION = "default"
+
+# GE filler/spacer cells unless a request sets its own: "cells" writes every "-"
+# and spacer cell, "sparse" leaves them out and boxes the fillers by a conditional
+# format, which shows no dashes
+GE_FILLERS = "cells"
+
+# Run a small export through every pool worker at start-up; /health/ready reports
+# ready only after that (or right away with WARMUP off)
+WARMUP = True
+
+# Sheet header templates kept per layout key (GE: max_depth, Roles: rolesCount)
+TEMPLATE_CACHE_SIZE = 64
@@ -0,0 +1,154 @@
+import csv
+import io
+import json
+
+from config import (
+    PREFIX,
+    GROUPS_FROM_LEVEL,
+    PERM_SUFFIX,
+    SKIP_PARENTS,
+    ORG_NAME,
+    ADMIN_ACCOUNT,
+)
+from utils import strip_prefix_levels
+
+
+def ge_key(tokens) -> str:
+    """GE group key of a node from the name tokens of its path (root first)."""
+    start = min(GROUPS_FROM_LEVEL, len(tokens) - 1)
+    return PREFIX + "_".join(tokens[start:])
+
+
+def make_addr(group_key: str, suffix: str = "") -> str:
+    key = f"{group_key}-{suffix}" if suffix else group_key
+    return f"{key}@{ORG_NAME}"
+
+
+class GroupKeyPath:
+    """
+    Group keys along the current path, one entry per level. A node's key
+    extends its parent's by the node's token (unnamed nodes add nothing, a
+    path without named nodes has the key ""). The LA/AA lists hold the
+    addresses of all ancestor keys, so a level's list is a prefix of its
+    child's: only the deepest list is kept, with its end offset per level,
+    and each level appends one address instead of rebuilding every prefix.
+    """
+
+    __slots__ = ("joined", "la", "aa", "la_end", "aa_end")
+
+    def __init__(self):
+        self.joined = []
+        self.la = ""
+        self.aa = ""
+        self.la_end = []
+        self.aa_end = []
+
+    def cut(self, level: int):
+        del self.joined[level:]
+        del self.la_end[level:]
+        del self.aa_end[level:]
+
+    def push(self, table, i) -> str:
+        joined = self.joined[-1] if self.joined else None
+        if table.name[i]:
+            joined = table.token[i] if joined is None else f"{joined}_{table.token[i]}"
+        key = PREFIX + joined if joined is not None else ""
+        self.joined.append(joined)
+
+        la = make_addr(key, "LA")
+        aa = make_addr(key, "AA")
+        if self.la_end:
+            la = f"{self.la[:self.la_end[-1]]};{la}"
+            aa = f"{self.aa[:self.aa_end[-1]]};{aa}"
+        self.la, self.aa = la, aa
+        self.la_end.append(len(la))
+        self.aa_end.append(len(aa))
+        return key
+
+
+# Plain exports of the keys and addresses, for machine consumers (LDAP sync)
+# that have no use for the styled workbook. Rows are lists in column order.
+
+GROUP_COLUMNS = ("level", "name", "key", "groups")
+ADDRESS_COLUMNS = ("label", "parent", "type", "key", "read", "write", "admin", "delete_admin", "filing_admin")
+
+
+def iter_groups(table):
+    """The groups of the GE sheet's permission columns, one row per node that has them."""
+    tokens = []
+    for i in range(len(table)):
+        level = table.depth[i]
+        del tokens[level:]
+        tokens.append(table.token[i])
+        name = table.name[i]
+        if level < GROUPS_FROM_LEVEL or not name:
+            continue
+        key = ge_key(tokens)
+        yield [level, name, key, [f"{key}-{suf}" if suf else key for suf in PERM_SUFFIX]]
+
+
+def iter_addresses(table):
+    """The address columns of the Ablage sheet, one row per node below the wrapped ancestors."""
+    for top in strip_prefix_levels(table, SKIP_PARENTS):
+        base = table.depth[top]
+        keys = GroupKeyPath()
+        path_apps = []
+        for i in range(top, table.end[top]):
+            level = table.depth[i] - base
+            keys.cut(level)
+            del path_apps[level:]
+
+            label = table.app[i] or table.name[i] or "(unnamed)"
+            parent = path_apps[-1] if path_apps else ""
+            key = keys.push(table, i)
+            yield [
+                label,
+                parent,
+                "Hierarchieelement" if table.has_children[i] else "Aktenablage",
+                key,
+                [make_addr(key, "RO"), ADMIN_ACCOUNT],
+                [make_addr(key, ""), ADMIN_ACCOUNT],
+                [make_addr(key, "FA"), ADMIN_ACCOUNT],
+                keys.la.split(";") + [ADMIN_ACCOUNT],
+                keys.aa.split(";") + [ADMIN_ACCOUNT],
+            ]
+            path_apps.append(label)
+
+
+EXPORTS = {
+    "groups": (GROUP_COLUMNS, iter_groups),
+    "addresses": (ADDRESS_COLUMNS, iter_addresses),
+}
+
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+
+
+def csv_lines(columns, rows):
+    """CSV with a header line; list values are joined with ';' as in the workbook cells."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow([";".join(v) if isinstance(v, list) else v for v in row])
+    yield buf.getvalue()
+
+
+def encode_chunks(lines, chunk_size: int):
+    """Joins text lines into UTF-8 chunks of about chunk_size bytes."""
+    parts = []
+    size = 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(parts).encode("utf-8")
+            parts.clear()
+            size = 0
+    if parts:
+        yield "".join(parts).encode("utf-8")
@@ -0,0 +1,238 @@
+try:
+    import ijson
+except ImportError:  # optional, without it bodies are read whole and decoded at once
+    ijson = None
+
+from config import MAX_BODY_BYTES, MAX_TREE_NODES, MAX_TREE_DEPTH
+from schema import ExcelRequest, excel_request, parse_request
+from utils import NodeTable, PayloadError, PayloadTooLarge, breaks_inheritance, norm_token
+
+NODE_TEXT = ("name", "appName", "description")
+
+
+async def body_chunks(request, limit: int = MAX_BODY_BYTES):
+    """
+    The request body as it arrives. Raises PayloadTooLarge as soon as more
+    than `limit` bytes are announced or received.
+    """
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit:
+        raise PayloadTooLarge(f"Request body is larger than {limit} bytes")
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise PayloadTooLarge(f"Request body is larger than {limit} bytes")
+        if chunk:
+            yield chunk
+
+
+async def read_body(request, limit: int = MAX_BODY_BYTES) -> bytes:
+    return b"".join([chunk async for chunk in body_chunks(request, limit)])
+
+
+class _List:
+    """An open sibling list: depth of its nodes, their parent, nodes so far, last node."""
+
+    __slots__ = ("depth", "parent", "count", "last")
+
+    def __init__(self, depth: int, parent: int):
+        self.depth = depth
+        self.parent = parent
+        self.count = 0
+        self.last = -1
+
+
+class _Node:
+    """An open node object: its index, the key being read and the fields so far."""
+
+    __slots__ = ("index", "key", "fields", "children")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.key = None
+        self.fields = {}
+        self.children = None
+
+
+class TreeReader:
+    """
+    Builds an ExcelRequest from the ijson basic_parse events of a body while
+    it arrives. The "tree" array is flattened straight into a NodeTable, so
+    the nodes never exist as dicts; the other fields are small and built as
+    usual. Checks and messages are those of utils.flatten_tree, and the node
+    and depth limits are enforced at the node that crosses them. A node's row
+    is taken when its object opens, since its children may come before its
+    name; the fields are filled in when it closes. Unknown node fields are
+    skipped whatever they hold. Unlike json.loads, a node may not repeat a
+    children list: its subtree is already in the table.
+    """
+
+    def __init__(self, max_nodes: int = MAX_TREE_NODES, max_depth: int = MAX_TREE_DEPTH):
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.data = {}
+        self.table = None
+        self._stack = []      # open _List and _Node frames of the tree
+        self._started = False
+        self._key = None      # top-level key whose value comes next
+        self._value = None    # ijson.ObjectBuilder of a top-level value other than the tree
+        self._nesting = 0     # open containers of the value being built or skipped
+
+    def feed(self, events):
+        for event, value in events:
+            if self._nesting:
+                self._inner(event, value)
+            elif self._stack:
+                self._tree(event, value)
+            else:
+                self._top(event, value)
+
+    def request(self) -> ExcelRequest:
+        return excel_request(self.data, self.table)
+
+    def _top(self, event, value):
+        if not self._started:
+            if event != "start_map":
+                raise PayloadError("JSON body must be an object")
+            self._started = True
+        elif event == "map_key":
+            self._key = value
+        elif self._key == "tree" and event == "start_array":
+            # a repeated key replaces the earlier value, as with json.loads
+            self.data.pop("tree", None)
+            self.table = NodeTable()
+            self._stack.append(_List(0, -1))
+        elif event != "end_map":
+            if self._key == "tree":
+                self.table = None
+            self._value = ijson.ObjectBuilder()
+            self._inner(event, value)
+
+    def _inner(self, event, value):
+        """A value that is built (self._value) or skipped, up to its end."""
+        if event in ("start_map", "start_array"):
+            self._nesting += 1
+        elif event in ("end_map", "end_array"):
+            self._nesting -= 1
+        if self._value is not None:
+            self._value.event(event, value)
+            if not self._nesting:
+                self.data[self._key] = self._value.value
+                self._value = None
+
+    def _path(self) -> str:
+        return "tree" + ".children".join(f"[{f.count - 1}]" for f in self._stack if isinstance(f, _List))
+
+    def _tree(self, event, value):
+        frame = self._stack[-1]
+        if isinstance(frame, _List):
+            if event == "end_array":
+                self._stack.pop()
+                if frame.last >= 0:
+                    self.table.is_last[frame.last] = True
+                if self._stack:
+                    self._stack[-1].children = frame.count
+                return
+            frame.count += 1
+            if event != "start_map":
+                raise PayloadError(f"{self._path()} must be an object")
+            self._open(frame)
+        elif event == "map_key":
+            frame.key = value
+        elif event == "end_map":
+            self._close(frame)
+        else:
+            self._field(frame, event, value)
+
+    def _open(self, siblings: _List):
+        t = self.table
+        if siblings.depth >= self.max_depth:
+            raise PayloadError(f"{self._path()} is nested deeper than {self.max_depth} levels")
+        i = len(t.depth)
+        if i >= self.max_nodes:
+            raise PayloadTooLarge(f"tree has more than {self.max_nodes} nodes")
+        if siblings.depth > t.max_depth:
+            t.max_depth = siblings.depth
+        t.depth.append(siblings.depth)
+        t.parent.append(siblings.parent)
+        t.is_last.append(False)
+        t.end.append(i + 1)
+        t.name.append("")
+        t.token.append("")
+        t.app.append("")
+        t.desc.append("")
+        t.enabled.append(True)
+        t.has_children.append(False)
+        t.unterbrechen.append(False)
+        siblings.last = i
+        self._stack.append(_Node(i))
+
+    def _field(self, node: _Node, event, value):
+        key = node.key
+        if key in NODE_TEXT:
+            if event not in ("string", "null"):
+                raise PayloadError(f"{self._path()}.{key} must be a string")
+        elif key == "enabled":
+            if event not in ("boolean", "null"):
+                raise PayloadError(f"{self._path()}.enabled must be a boolean")
+        elif key == "unterbrechen":
+            if event not in ("boolean", "string", "null"):
+                raise PayloadError(f"{self._path()}.unterbrechen must be a boolean or string")
+        elif key == "children":
+            if event == "start_array":
+                if node.children is not None:
+                    raise PayloadError(f"{self._path()}.children is given twice")
+                self._stack.append(_List(self.table.depth[node.index] + 1, node.index))
+            elif event != "null":
+                raise PayloadError(f"{self._path()}.children must be a list")
+            elif node.children:
+                raise PayloadError(f"{self._path()}.children is given twice")
+            return
+        else:
+            if event in ("start_map", "start_array"):
+                self._nesting = 1
+            return
+        node.fields[key] = value
+
+    def _close(self, node: _Node):
+        self._stack.pop()
+        t = self.table
+        i = node.index
+        fields = node.fields
+        name = (fields.get("name") or "").strip()
+        t.name[i] = name
+        t.token[i] = norm_token(name)
+        t.app[i] = (fields.get("appName") or name).strip()
+        t.desc[i] = (fields.get("description") or "").strip()
+        t.enabled[i] = fields.get("enabled") is not False
+        t.has_children[i] = bool(node.children)
+        t.unterbrechen[i] = breaks_inheritance(fields.get("unterbrechen"))
+        t.end[i] = len(t.depth)
+
+
+async def read_request(request, limit: int = MAX_BODY_BYTES) -> ExcelRequest:
+    """
+    Reads and checks a /generate-excel style body. With ijson the tree is
+    flattened chunk by chunk, so a request holds at most its NodeTable and
+    one chunk; without it the body is read whole (up to `limit`) and parsed
+    by schema.parse_request. Either way a body over `limit` raises
+    PayloadTooLarge as soon as the limit is crossed.
+    """
+    if ijson is None:
+        return parse_request(await read_body(request, limit))
+    reader = TreeReader()
+    events = ijson.sendable_list()
+    parser = ijson.basic_parse_coro(events, use_float=True)
+    try:
+        async for chunk in body_chunks(request, limit):
+            parser.send(chunk)
+            reader.feed(events)
+            del events[:]
+        parser.close()
+        reader.feed(events)
+    except ijson.JSONError as e:
+        # yajl adds the offending input and a marker on lines of their own
+        reason = str(e).splitlines()[0] if str(e) else type(e).__name__
+        raise PayloadError(f"Invalid JSON body: {reason}") from None
+    return reader.request()
@@ -0,0 +1,374 @@
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the store's limits are then only per process
+    fcntl = None
+
+from builder import render_workbook
+
+
+class JobProgress:
+    """
+    Worker side of a job's progress: rows written per sheet, flushed every
+    FLUSH_EVERY rows to a small JSON file that the API process reads when
+    the job is polled. Replacing the file keeps every read whole.
+    """
+
+    FLUSH_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state = {"sheets": {}, "saving": False}
+
+    def track(self, sheet: str, rows):
+        entry = self.state["sheets"][sheet] = {"rows": 0, "done": False}
+        self.flush()
+        n = 0
+        try:
+            while True:
+                value = next(rows)
+                n += 1
+                if n % self.FLUSH_EVERY == 0:
+                    entry["rows"] = n
+                    self.flush()
+                yield value
+        except StopIteration as done:
+            entry["rows"] = n
+            entry["done"] = True
+            self.flush()
+            return done.value
+
+    def reused(self, sheet: str):
+        self.state["sheets"][sheet] = {"rows": None, "done": True, "cached": True}
+        self.flush()
+
+    def saving(self):
+        self.state["saving"] = True
+        self.flush()
+
+    def flush(self):
+        write_json(self.path, self.state)
+
+
+def write_json(path: str, data):
+    """Replaces the file whole, so a concurrent reader never sees half of it."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def read_json(path: str):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class Job:
+    """
+    One background export, kept in a directory of its own so that every
+    server process can answer for it: job.json holds the status, progress.json
+    the rows written so far and result.xlsx the finished workbook. The build
+    runs in a pool worker of the owner, the process that took the POST. The
+    owner touches the heartbeat file every `heartbeat` seconds while the job
+    is unfinished; a job whose heartbeat stopped for HEARTBEAT_MISSED of
+    them, or that is still unfinished at its deadline, is reported as failed.
+    """
+
+    HEARTBEAT_MISSED = 3
+
+    __slots__ = (
+        "id", "dir", "nodes", "key", "keys", "owner", "status", "size",
+        "compression", "error", "progress", "created", "finished", "deadline", "heartbeat",
+    )
+
+    def __init__(self, root: str, job_id: str):
+        self.id = job_id
+        self.dir = os.path.join(root, job_id)
+        self.nodes = 0
+        self.key = None
+        self.keys = {}
+        self.owner = os.getpid()
+        self.status = "queued"
+        self.size = None
+        self.compression = None
+        self.error = None
+        self.progress = None
+        self.created = time.time()
+        self.finished = None
+        self.deadline = None
+        self.heartbeat = None
+
+    @classmethod
+    def create(cls, root: str, nodes: int, key: str, keys, timeout: float, heartbeat: float):
+        job = cls(root, uuid.uuid4().hex)
+        job.nodes = nodes
+        job.key = key
+        job.keys = keys
+        job.deadline = job.created + timeout
+        job.heartbeat = heartbeat
+        os.makedirs(job.dir)
+        job.beat()
+        job.save()
+        return job
+
+    @classmethod
+    def load(cls, root: str, job_id: str):
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        job = cls(root, job_id)
+        data = read_json(job.meta_path)
+        if data is None:
+            return None
+        for name in cls.__slots__[2:]:
+            if name in data:
+                setattr(job, name, data[name])
+        return job
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.dir, "job.json")
+
+    @property
+    def progress_path(self) -> str:
+        return os.path.join(self.dir, "progress.json")
+
+    @property
+    def result_path(self) -> str:
+        return os.path.join(self.dir, "result.xlsx")
+
+    @property
+    def heartbeat_path(self) -> str:
+        return os.path.join(self.dir, "heartbeat")
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def save(self):
+        write_json(self.meta_path, {name: getattr(self, name) for name in self.__slots__[2:]})
+
+    def beat(self):
+        """Owner side: the job is still looked after. Its own file, so job.json is never rewritten for it."""
+        with open(self.heartbeat_path, "a"):
+            pass
+        os.utime(self.heartbeat_path)
+
+    def stalled(self, now: float):
+        """Why an unfinished job is to be failed, or None while it is on time and its owner beats."""
+        if self.deadline is not None and now > self.deadline:
+            return f"unfinished after {self.deadline - self.created:.0f}s"
+        if self.heartbeat:
+            try:
+                last = os.path.getmtime(self.heartbeat_path)
+            except OSError:
+                last = self.created
+            if now - last > self.HEARTBEAT_MISSED * self.heartbeat:
+                return "the server process running the job has exited or hangs"
+        return None
+
+    def start(self):
+        self.status = "running"
+        self.save()
+
+    def finish(self, result=None, size: int = None, error: str = None):
+        """Stores the result (xlsx bytes or a temp file, which is moved) and the final status."""
+        if isinstance(result, bytes):
+            with open(self.result_path, "wb") as f:
+                f.write(result)
+        elif result is not None:
+            shutil.move(result, self.result_path)
+        self.status = "failed" if error else "done"
+        self.size = size
+        self.error = error
+        self.finished = time.time()
+        self.progress = read_json(self.progress_path) or self.progress
+        _remove(self.progress_path)
+        _remove(self.heartbeat_path)
+        self.save()
+
+    def poll(self):
+        """Status as sent by GET /jobs/{id}."""
+        if self.active:
+            error = self.stalled(time.time())
+            if error is not None:
+                self.finish(error=error)
+            else:
+                self.progress = read_json(self.progress_path) or self.progress
+        out = {
+            "id": self.id,
+            "status": self.status,
+            "nodes": self.nodes,
+            "progress": self.progress,
+            "created": self.created,
+        }
+        if self.finished is not None:
+            out["finished"] = self.finished
+        if self.size is not None:
+            out["bytes"] = self.size
+        if self.compression is not None:
+            out["compression"] = self.compression
+        if self.error:
+            out["error"] = self.error
+        return out
+
+    def discard(self):
+        """Deletes the job with its result."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def run_job(root: str, job_id: str, table, sheets, roles_count: int, stream: bool, parts, **kwargs):
+    """
+    Pool task: builds a job's workbook with render_workbook and stores it in
+    the job's directory, so the job is done whether or not its owner is
+    still there to hear about it. Returns the stage durations, new sheet
+    parts, package stats and size for the owner's metrics and caches.
+    """
+    job = Job.load(root, job_id)
+    if job is None or not job.active:
+        # swept, or failed while it was queued
+        return None
+    job.start()
+    try:
+        body, stages, new_parts, packing = render_workbook(
+            table, sheets, roles_count, stream, parts, JobProgress(job.progress_path), **kwargs
+        )
+    except Exception as e:
+        job.finish(error=f"{type(e).__name__}: {e}")
+        raise
+    size = len(body) if isinstance(body, bytes) else os.path.getsize(body)
+    current = Job.load(root, job_id)
+    if current is None or not current.active:
+        # swept, or failed for its deadline while it was being built
+        if not isinstance(body, bytes):
+            _remove(body)
+        return None
+    job.finish(body, size)
+    return stages, new_parts, packing, size
+
+
+class JobStore:
+    """
+    Jobs by id, one directory each under root, shared by all server processes.
+    At most max_active of them may be queued or running; finished jobs are
+    kept for ttl seconds after they end and then swept together with their
+    results. Finished jobs are also capped at max_held results and
+    max_held_bytes of them: trim() drops the oldest beyond that, even before
+    their ttl. Each job gets `timeout` seconds to finish and is failed once
+    its owner misses its heartbeats (see Job). Changes to the set of jobs
+    take a file lock on the root.
+    """
+
+    def __init__(self, root: str, max_active: int, ttl: float, max_held: int, max_held_bytes: int,
+                 timeout: float, heartbeat: float):
+        self.root = root
+        self.max_active = max_active
+        self.ttl = ttl
+        self.max_held = max_held
+        self.max_held_bytes = max_held_bytes
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def _lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _jobs(self):
+        jobs = []
+        for name in os.listdir(self.root):
+            job = Job.load(self.root, name)
+            if job is not None:
+                if job.active:
+                    job.poll()
+                jobs.append(job)
+        return jobs
+
+    def __len__(self):
+        return len(self._jobs())
+
+    def active(self) -> int:
+        return sum(1 for job in self._jobs() if job.active)
+
+    def held(self):
+        """Number of finished jobs and the bytes of their results."""
+        done = [job for job in self._jobs() if not job.active]
+        return len(done), sum(job.size or 0 for job in done)
+
+    def _full(self, jobs) -> bool:
+        active = sum(1 for job in jobs if job.active)
+        return active >= self.max_active or len(jobs) >= self.max_active + self.max_held
+
+    def full(self) -> bool:
+        return self._full(self._jobs())
+
+    def create(self, nodes: int, key: str, keys):
+        """A new queued Job, or None if the store is full."""
+        with self._lock():
+            if self._full(self._jobs()):
+                return None
+            return Job.create(self.root, nodes, key, keys, self.timeout, self.heartbeat)
+
+    def get(self, job_id: str):
+        return Job.load(self.root, job_id)
+
+    def beat(self, job_ids):
+        """Touches the heartbeat of the owner's unfinished jobs."""
+        for job_id in job_ids:
+            job = Job.load(self.root, job_id)
+            if job is not None and job.active:
+                job.beat()
+
+    def sweep(self, now: float = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock():
+            expired = [
+                job for job in self._jobs()
+                if job.finished is not None and now - job.finished >= self.ttl
+            ]
+            for job in expired:
+                job.discard()
+        return len(expired)
+
+    def trim(self) -> int:
+        """Drops the oldest finished jobs until the rest fit max_held and max_held_bytes."""
+        with self._lock():
+            done = sorted((job for job in self._jobs() if not job.active), key=lambda job: job.finished)
+            count = len(done)
+            size = sum(job.size or 0 for job in done)
+            dropped = 0
+            for job in done:
+                if count <= self.max_held and size <= self.max_held_bytes:
+                    break
+                job.discard()
+                count -= 1
+                size -= job.size or 0
+                dropped += 1
+        return dropped
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -1,18 +1,407 @@
-import io
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+import time
 
-from openpyxl import Workbook
+# everything below is imported before the first request; /health/ready reports how long it took
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 
 from config import (
-    LEFT_HEADERS,
-    PERM_HEADERS,
-    DATA_START_ROW,
-    ROLES_COUNT,
+    CACHE_MAX_BYTES,
+    PART_CACHE_MAX_BYTES,
+    BUILD_WORKERS,
+    BUILD_TIMEOUT_S,
+    RESPONSE_CHUNK_BYTES,
+    JOB_WORKERS,
+    JOB_DIR,
+    JOB_QUEUE_MAX,
+    JOB_TTL_S,
+    JOB_RESULTS_MAX,
+    JOB_RESULTS_MAX_BYTES,
+    JOB_SWEEP_S,
+    JOB_TIMEOUT_S,
+    JOB_HEARTBEAT_S,
+    SPOOL_MAX_BYTES,
+    WORKER_DRAIN_TIMEOUT_S,
+    WARMUP,
 )
-from utils import tree_max_depth, autosize_columns
-from worksheets import create_sheet, write_rows, add_second_sheet, add_third_sheet
+from batch import ZipStream
+from builder import render_workbook
+from cache import WorkbookCache, table_digests, payload_key, sheet_keys, etag_for, etag_matches
+from groups import EXPORTS, ndjson_lines, csv_lines, encode_chunks
+from jobs import Job, JobStore, run_job
+from metrics import Registry, StageTimer, server_timing, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from parts import SPLICE_UNSUPPORTED
+from ingest import read_body, read_request
+from recycle import budget
+from schema import parse_batch
+from utils import PayloadError, PayloadTooLarge
+from warmup import warm_up_request, warm_up_worker
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+log = logging.getLogger("uvicorn.error")
+
 app = FastAPI()
+cache = WorkbookCache(CACHE_MAX_BYTES)
+part_cache = WorkbookCache(PART_CACHE_MAX_BYTES)
+jobs = JobStore(
+    JOB_DIR, JOB_QUEUE_MAX, JOB_TTL_S, JOB_RESULTS_MAX, JOB_RESULTS_MAX_BYTES, JOB_TIMEOUT_S, JOB_HEARTBEAT_S
+)
+# job id -> pool future of the jobs this process started and that are unfinished
+running_jobs = {}
+
+pool = None
+job_pool = None
+rebuilder = None
+sweeper = None
+warmer = None
+heart = None
+readiness = {"status": "starting", "import_seconds": round(IMPORT_SECONDS, 3)}
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "excel_stage_seconds", "Duration of each /generate-excel stage.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    labels=("stage",),
+)
+REQUEST_SECONDS = metrics.histogram(
+    "excel_request_seconds", "Total /generate-excel handling time.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+TREE_NODES = metrics.histogram(
+    "excel_tree_nodes", "Nodes per requested tree.",
+    buckets=(10, 100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000),
+)
+OUTPUT_BYTES = metrics.histogram(
+    "excel_output_bytes", "Size of the generated xlsx files.",
+    buckets=(10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 50_000_000),
+)
+IN_FLIGHT = metrics.gauge("excel_requests_in_flight", "/generate-excel requests being handled.")
+BUILDS_IN_FLIGHT = metrics.gauge("excel_builds_in_flight", "Workbook builds submitted to the pool.")
+ERRORS = metrics.counter("excel_errors_total", "Failed /generate-excel requests.", labels=("reason",))
+CACHE_LOOKUPS = metrics.counter("excel_cache_lookups_total", "Response cache lookups.", labels=("result",))
+PART_LOOKUPS = metrics.counter(
+    "excel_part_cache_lookups_total", "Sheet part cache lookups.", labels=("sheet", "result")
+)
+CACHE_BYTES = metrics.gauge("excel_cache_bytes", "Bytes held by the response cache.")
+CACHE_ENTRIES = metrics.gauge("excel_cache_entries", "Workbooks held by the response cache.")
+COMPRESSION_RATIO = metrics.histogram(
+    "excel_compression_ratio", "Zipped to raw size of the built xlsx packages.",
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1), labels=("level",),
+)
+PART_CACHE_BYTES = metrics.gauge("excel_part_cache_bytes", "Worksheet XML held by the sheet part cache.")
+JOBS_ACTIVE = metrics.gauge("excel_jobs_active", "Background jobs queued or running.")
+JOBS_HELD = metrics.gauge("excel_jobs_held", "Background jobs known to /jobs, finished ones included.")
+JOB_RESULT_BYTES = metrics.gauge("excel_job_result_bytes", "Bytes of finished job results held for /jobs.")
+WORKER_RSS = metrics.gauge(
+    "excel_worker_rss_bytes", "RSS of this server process and its build pools after the last export."
+)
+WORKER_EXPORTS = metrics.gauge("excel_worker_exports", "Exports built by this server process.")
+POOL_BREAKS = metrics.counter(
+    "excel_pool_broken_total", "Build pools found broken (a worker died) and replaced.", labels=("pool",)
+)
+
+
+def get_pool():
+    global pool
+    if pool is None:
+        pool = ProcessPoolExecutor(max_workers=BUILD_WORKERS)
+    return pool
+
+
+def get_job_pool():
+    global job_pool
+    if job_pool is None:
+        job_pool = ProcessPoolExecutor(max_workers=JOB_WORKERS)
+    return job_pool
+
+
+def drop_pool(executor):
+    """
+    Called with a pool that raised BrokenProcessPool (one of its workers
+    died): it is shut down and a new one is started and warmed up in the
+    background. /health/ready reports "broken" until that is done; if the
+    new pool fails too the worker asks serve.py to replace it.
+    """
+    global pool, job_pool, rebuilder
+    if executor is pool:
+        pool = None
+        name, get, size = "build", get_pool, BUILD_WORKERS
+    elif executor is job_pool:
+        job_pool = None
+        name, get, size = "jobs", get_job_pool, JOB_WORKERS
+    else:
+        return
+    POOL_BREAKS.inc(pool=name)
+    log.warning("%s pool is broken, starting a new one", name)
+    executor.shutdown(wait=False, cancel_futures=True)
+    if readiness["status"] in ("ready", "broken"):
+        readiness.update(status="broken", error=f"a {name} pool worker died")
+        rebuilder = asyncio.ensure_future(rebuild_pool(get, size))
+
+
+async def rebuild_pool(get, size: int):
+    try:
+        tasks = [get().submit(warm_up_worker) for _ in range(size)]
+        await asyncio.gather(*map(asyncio.wrap_future, tasks))
+    except Exception as e:
+        log.exception("new build pool failed as well")
+        readiness.update(status="broken", error=f"{type(e).__name__}: {e}")
+        budget.recycle_now("broken_pool")
+        return
+    if readiness["status"] == "broken":
+        readiness["status"] = "ready"
+        readiness.pop("error", None)
+    log.info("new build pool is warmed up")
+
+
+def pool_recovered():
+    if readiness["status"] == "broken" and (rebuilder is None or rebuilder.done()):
+        readiness["status"] = "ready"
+        readiness.pop("error", None)
+
+
+def check_pools():
+    """Drops a pool whose worker died even if no build has noticed yet."""
+    for executor in (pool, job_pool):
+        # set by the executor's management thread when a worker exits unexpectedly
+        if executor is not None and getattr(executor, "_broken", False):
+            drop_pool(executor)
+
+
+@app.on_event("startup")
+async def start_sweeper():
+    global sweeper, heart
+    sweeper = asyncio.ensure_future(sweep_jobs())
+    heart = asyncio.ensure_future(beat_jobs())
+
+
+async def sweep_jobs():
+    while True:
+        await asyncio.sleep(JOB_SWEEP_S)
+        jobs.sweep()
+
+
+async def beat_jobs():
+    while True:
+        jobs.beat(list(running_jobs))
+        await asyncio.sleep(JOB_HEARTBEAT_S)
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    global warmer
+    log.info("backend imports took %.2fs", IMPORT_SECONDS)
+    if SPLICE_UNSUPPORTED:
+        log.error("sheet part cache and fast engine are off: %s", SPLICE_UNSUPPORTED)
+        readiness["parts_disabled"] = SPLICE_UNSUPPORTED
+    if not WARMUP:
+        readiness["status"] = "ready"
+    elif budget.channel is not None:
+        # under serve.py the worker takes connections on the shared socket
+        # only once startup returns, so it warms up first
+        await warm_up()
+    else:
+        warmer = asyncio.ensure_future(warm_up())
+    budget.announce_ready()
+
+
+async def warm_up():
+    """
+    Runs a tiny export through every pool worker (and the request steps in
+    this process), in the background unless under serve.py; /health/ready
+    answers 503 until done.
+    """
+    t0 = time.perf_counter()
+    try:
+        warm_up_request()
+        tasks = [get_pool().submit(warm_up_worker) for _ in range(BUILD_WORKERS)]
+        tasks += [get_job_pool().submit(warm_up_worker) for _ in range(JOB_WORKERS)]
+        results = await asyncio.gather(*map(asyncio.wrap_future, tasks))
+    except Exception as e:
+        log.exception("warm-up failed")
+        readiness.update(status="failed", error=f"{type(e).__name__}: {e}")
+        return
+    seconds = time.perf_counter() - t0
+    readiness.update(
+        status="ready",
+        warmup_seconds=round(seconds, 3),
+        workers=len({pid for pid, _ in results}),
+        slowest_worker_seconds=round(max(sec for _, sec in results), 3),
+    )
+    log.info("warm-up took %.2fs over %d worker processes", seconds, readiness["workers"])
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    200 once the start-up warm-up is done (or disabled), 503 before, if it
+    failed, or while a broken build pool is being replaced.
+    """
+    check_pools()
+    return JSONResponse(status_code=200 if readiness["status"] == "ready" else 503, content=readiness)
+
+
+@app.on_event("shutdown")
+async def shutdown_pool():
+    """
+    Background jobs this process started are let finish, for up to
+    WORKER_DRAIN_TIMEOUT_S, since their results outlive it in JOB_DIR; what
+    is still queued after that is cancelled and reported as failed.
+    """
+    global pool, job_pool, sweeper, warmer, rebuilder, heart
+    for task in (sweeper, warmer, rebuilder):
+        if task is not None:
+            task.cancel()
+    sweeper = warmer = rebuilder = None
+    if running_jobs:
+        log.info("waiting for %d background jobs to finish", len(running_jobs))
+        await asyncio.wait(
+            [asyncio.wrap_future(fut) for fut in running_jobs.values()], timeout=WORKER_DRAIN_TIMEOUT_S
+        )
+    # beats until here, so the jobs waited for are not taken for abandoned
+    if heart is not None:
+        heart.cancel()
+        heart = None
+    for executor in (pool, job_pool):
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    pool = job_pool = None
+
+
+async def wait_disconnect(request: Request, interval: float = 0.5):
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+def discard_result(job):
+    if job.cancelled() or job.exception() is not None:
+        return
+    result = job.result()[0]
+    if isinstance(result, str):
+        remove_file(result)
+
+
+def remove_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def cached_parts(table_keys):
+    """Cached SheetParts for the given {sheet: key}, by sheet name."""
+    parts = {}
+    for sheet, key in table_keys.items():
+        part = part_cache.get(key)
+        PART_LOOKUPS.inc(sheet=sheet, result="miss" if part is None else "hit")
+        if part is not None:
+            parts[sheet] = part
+    return parts
+
+
+def store_parts(table_keys, built):
+    for sheet, part in built.items():
+        part_cache.put(table_keys[sheet], part, size=len(part.xml))
+
+
+def payload_error(e: PayloadError):
+    """413 for a body or tree over the limits, 422 for anything else malformed."""
+    if isinstance(e, PayloadTooLarge):
+        ERRORS.inc(reason="too_large")
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    ERRORS.inc(reason="invalid_payload")
+    return JSONResponse(status_code=422, content={"error": str(e)})
+
+
+def exported():
+    """After every finished build: measure the process against its budget (see recycle.py)."""
+    WORKER_RSS.set(budget.after_export())
+    WORKER_EXPORTS.set(budget.exports)
+
+
+def compression_report(packing):
+    COMPRESSION_RATIO.observe(packing["ratio"], level=packing["level"])
+    return {
+        "level": packing["level"],
+        "ratio": round(packing["ratio"], 4),
+        "seconds": round(packing["seconds"], 4),
+        "raw_bytes": packing["raw_bytes"],
+    }
+
+
+def iter_file(f, chunk_size: int = RESPONSE_CHUNK_BYTES):
+    with f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def run_build(request: Request, *args, **kwargs):
+    """
+    Runs render_workbook in the pool. Returns the xlsx bytes or a temp-file
+    path with the build's stage durations and new sheet parts, or None when
+    the client went away first. A build that is still queued is cancelled; one that already runs
+    finishes in its worker and the result is dropped.
+    If the pool is broken the build is retried once in a new pool; if that
+    breaks as well BrokenProcessPool is raised and the worker asks serve.py
+    to replace it.
+    """
+    try:
+        return await build_in_pool(request, *args, **kwargs)
+    except BrokenProcessPool:
+        pass
+    try:
+        return await build_in_pool(request, *args, **kwargs)
+    except BrokenProcessPool:
+        budget.recycle_now("broken_pool")
+        raise
+
+
+async def build_in_pool(request: Request, *args, **kwargs):
+    executor = get_pool()
+    try:
+        job = executor.submit(render_workbook, *args, **kwargs)
+    except BrokenProcessPool:
+        drop_pool(executor)
+        raise
+    build = asyncio.wrap_future(job)
+    watch = asyncio.ensure_future(wait_disconnect(request))
+    BUILDS_IN_FLIGHT.inc()
+    try:
+        done, _ = await asyncio.wait(
+            {build, watch}, timeout=BUILD_TIMEOUT_S, return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        watch.cancel()
+        BUILDS_IN_FLIGHT.dec()
+    if build in done:
+        try:
+            result = build.result()
+        except BrokenProcessPool:
+            drop_pool(executor)
+            raise
+        exported()
+        pool_recovered()
+        return result
+    if not job.cancel():
+        job.add_done_callback(discard_result)
+    if watch in done:
+        return None
+    raise asyncio.TimeoutError
 
 
 @app.post("/generate-excel")
@@ -22,47 +411,443 @@ async def generate_excel(request: Request):
       {
         "tree": [...],                 # REQUIRED
         "sheets": ["GE","Ablage","Roles"],   # OPTIONAL
-        "rolesCount": 10              # OPTIONAL
+        "rolesCount": 10,             # OPTIONAL
+        "mode": "stream",             # OPTIONAL, write-only workbook
+        "engine": "fast",             # OPTIONAL, sheet XML written directly
+        "compression": "fast",        # OPTIONAL, stored/fast/default/max
+        "fillers": "sparse"           # OPTIONAL, cells/sparse GE filler cells (sparse: no dashes)
+      }
+
+    Trees with more than STREAM_NODE_THRESHOLD nodes are always streamed.
+    The response carries a content hash of tree/sheets/rolesCount as ETag;
+    a matching If-None-Match gets 304, repeated payloads are served from cache.
+    Malformed bodies are rejected with 422 before anything is built. The tree
+    is read while the body arrives (see ingest.py): bodies over MAX_BODY_BYTES
+    and trees over MAX_TREE_NODES nodes get 413 as soon as the limit is
+    crossed, trees deeper than MAX_TREE_DEPTH levels 422.
+    Stage durations (parse, build and within it ge/ablage/roles/save, compress) are
+    sent as Server-Timing and collected for /metrics; a freshly built file
+    also reports its compression level and ratio as X-Compression.
+    """
+    IN_FLIGHT.inc()
+    t0 = time.perf_counter()
+    timer = StageTimer()
+    try:
+        return await handle_generate(request, timer)
+    except Exception:
+        ERRORS.inc(reason="exception")
+        raise
+    finally:
+        IN_FLIGHT.dec()
+        REQUEST_SECONDS.observe(time.perf_counter() - t0)
+        for stage, sec in timer.stages.items():
+            STAGE_SECONDS.observe(sec, stage=stage)
+
+
+async def handle_generate(request: Request, timer: StageTimer):
+    try:
+        with timer("parse"):
+            req = await read_request(request)
+    except PayloadError as e:
+        return payload_error(e)
+    TREE_NODES.observe(len(req.table))
+
+    digests = table_digests(req.table)
+    key = payload_key(digests, req.sheets, req.roles_count, req.compression, req.fillers)
+    etag = etag_for(key)
+    if etag_matches(request.headers.get("if-none-match"), key):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    body = cache.get(key)
+    status = "HIT"
+    if body is None:
+        status = "MISS"
+        keys = sheet_keys(digests, req.sheets, req.roles_count, req.fillers)
+        parts = cached_parts(keys)
+        try:
+            with timer("build"):
+                built = await run_build(
+                    request, req.table, req.sheets, req.roles_count, req.stream, parts,
+                    engine=req.engine, compression=req.compression, fillers=req.fillers,
+                )
+        except asyncio.TimeoutError:
+            ERRORS.inc(reason="timeout")
+            return JSONResponse(
+                status_code=504,
+                content={"error": f"Excel generation exceeded {BUILD_TIMEOUT_S}s"},
+            )
+        except BrokenProcessPool:
+            ERRORS.inc(reason="broken_pool")
+            return JSONResponse(
+                status_code=503,
+                content={"error": "Excel generation is unavailable, try again"},
+                headers={"Retry-After": "10"},
+            )
+        if built is None:
+            ERRORS.inc(reason="disconnect")
+            return Response(status_code=499)
+        body, stages, new_parts, packing = built
+        timer.stages.update(stages)
+        store_parts(keys, new_parts)
+    CACHE_LOOKUPS.inc(result=status.lower())
+
+    headers = {
+        "Content-Disposition": "attachment; filename=tree.xlsx",
+        "ETag": etag,
+        "X-Cache": status,
+        "Server-Timing": server_timing(timer.stages),
+    }
+    if status == "MISS":
+        report = compression_report(packing)
+        headers["X-Compression"] = f"level={report['level']}; ratio={report['ratio']}"
+    if isinstance(body, str):
+        # spooled to disk: too big for the cache. The file is unlinked once
+        # open, so it disappears with the handle however the response ends.
+        f = open(body, "rb")
+        remove_file(body)
+        size = os.fstat(f.fileno()).st_size
+        OUTPUT_BYTES.observe(size)
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file(f), media_type=XLSX_MEDIA_TYPE, headers=headers)
+
+    cache.put(key, body)
+    OUTPUT_BYTES.observe(len(body))
+    return Response(content=body, media_type=XLSX_MEDIA_TYPE, headers=headers)
+
+
+@app.post("/generate-excel/batch")
+async def generate_excel_batch(request: Request):
+    """
+    JSON body:
+      {
+        "jobs": [
+          {"tree": [...], "sheets": [...], "rolesCount": 10, "filename": "2024.xlsx"},
+          ...
+        ]
       }
+
+    Jobs are built in the pool, at most BUILD_WORKERS at a time so an
+    interactive export never waits behind a whole batch, and returned as one
+    zip, streamed as the workbooks finish. manifest.json at the end of the archive
+    lists every job in request order with its status; a job that is invalid,
+    fails or times out is reported there instead of failing the batch.
     """
-    data = await request.json()
-    tree = data.get("tree")
-    if not tree:
-        return {"error": "Missing 'tree' in JSON body"}
+    try:
+        jobs = parse_batch(await read_body(request))
+    except PayloadError as e:
+        return payload_error(e)
+
+    return StreamingResponse(
+        stream_batch(jobs),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=trees.zip"},
+    )
+
+
+async def stream_batch(jobs):
+    archive = ZipStream()
+    manifest = []
+    ready = []
+    queued = deque()
+    pending = {}
+    try:
+        for filename, req in jobs:
+            entry = {"filename": filename}
+            manifest.append(entry)
+            if isinstance(req, PayloadError):
+                entry.update(status="error", error=str(req))
+                ERRORS.inc(reason="invalid_payload")
+                continue
+            TREE_NODES.observe(len(req.table))
+            digests = table_digests(req.table)
+            key = payload_key(digests, req.sheets, req.roles_count, req.compression, req.fillers)
+            entry["etag"] = etag_for(key)
+            body = cache.get(key)
+            CACHE_LOOKUPS.inc(result="miss" if body is None else "hit")
+            if body is not None:
+                ready.append((entry, body))
+                continue
+            queued.append((entry, req, key, sheet_keys(digests, req.sheets, req.roles_count, req.fillers)))
+
+        for entry, body in ready:
+            entry.update(status="ok", bytes=len(body))
+            yield archive.add_bytes(entry["filename"], body)
+
+        def submit_next():
+            # at most BUILD_WORKERS batch builds are in the pool at a time, so an
+            # interactive /generate-excel queues behind a few builds, not the batch
+            while queued and len(pending) < BUILD_WORKERS:
+                entry, req, key, keys = queued.popleft()
+                args = (render_workbook, req.table, req.sheets, req.roles_count, req.stream, cached_parts(keys))
+                kwargs = dict(engine=req.engine, compression=req.compression, fillers=req.fillers)
+                executor = get_pool()
+                try:
+                    job = executor.submit(*args, **kwargs)
+                except BrokenProcessPool:
+                    drop_pool(executor)
+                    executor = get_pool()
+                    job = executor.submit(*args, **kwargs)
+                BUILDS_IN_FLIGHT.inc()
+                pending[asyncio.wrap_future(job)] = (entry, job, (key, keys, executor))
 
-    sheets = data.get("sheets") or ["GE", "Ablage", "Roles"]
-    roles_count = int(data.get("rolesCount") or ROLES_COUNT)
+        submit_next()
+        while pending:
+            # the timeout runs from the last finished build, not per job
+            done, _ = await asyncio.wait(
+                pending, timeout=BUILD_TIMEOUT_S, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for fut in done:
+                entry, job, (key, keys, executor) = pending.pop(fut)
+                BUILDS_IN_FLIGHT.dec()
+                exported()
+                try:
+                    body, _, new_parts, packing = fut.result()
+                except BrokenProcessPool as e:
+                    drop_pool(executor)
+                    entry.update(status="error", error=f"{type(e).__name__}: {e}")
+                    ERRORS.inc(reason="broken_pool")
+                    submit_next()
+                    continue
+                except Exception as e:
+                    entry.update(status="error", error=f"{type(e).__name__}: {e}")
+                    ERRORS.inc(reason="exception")
+                    submit_next()
+                    continue
+                pool_recovered()
+                submit_next()
+                store_parts(keys, new_parts)
+                if isinstance(body, str):
+                    size = os.path.getsize(body)
+                    try:
+                        for chunk in archive.add_file(body, entry["filename"]):
+                            yield chunk
+                    finally:
+                        remove_file(body)
+                else:
+                    size = len(body)
+                    cache.put(key, body)
+                    yield archive.add_bytes(entry["filename"], body)
+                OUTPUT_BYTES.observe(size)
+                entry.update(status="ok", bytes=size, compression=compression_report(packing))
 
-    max_depth = max(0, tree_max_depth(tree))
-    last_name_col = max_depth + 1
+        for entry in [e for e, _, _ in pending.values()] + [e for e, _, _, _ in queued]:
+            entry.update(status="error", error=f"Excel generation exceeded {BUILD_TIMEOUT_S}s")
+            ERRORS.inc(reason="timeout")
 
-    if "GE" in sheets:
-        wb, ws, cols = create_sheet(
-            last_name_col,
-            perm1_cols=len(LEFT_HEADERS),
-            perm2_cols=len(PERM_HEADERS),
-            max_depth=max_depth
+        text = json.dumps({"jobs": manifest}, ensure_ascii=False, indent=2)
+        yield archive.add_bytes("manifest.json", text.encode("utf-8"))
+        yield archive.close()
+    finally:
+        # also reached when the client disconnects mid-stream
+        for _, job, _ in pending.values():
+            BUILDS_IN_FLIGHT.dec()
+            if not job.cancel():
+                job.add_done_callback(discard_result)
+
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv; charset=utf-8"),
+}
+
+
+@app.post("/export/{kind}")
+async def export_keys(kind: str, request: Request, fmt: str = Query("ndjson", alias="format")):
+    """
+    Same JSON body as /generate-excel (only the tree is used). Streams, without
+    building a workbook, what the sheets compute for every node:
+      /export/groups     the GE permission groups (PREFIX + path tokens + PERM_SUFFIX)
+      /export/addresses  the Ablage addresses, LA/AA with all ancestor keys
+    as NDJSON (default) or, with ?format=csv, as CSV.
+    """
+    if kind not in EXPORTS:
+        return JSONResponse(status_code=404, content={"error": f"unknown export {kind}"})
+    if fmt not in EXPORT_FORMATS:
+        return JSONResponse(
+            status_code=422, content={"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}
         )
-        write_rows(
-            ws, tree, DATA_START_ROW, level=0, last_stack=[],
-            cols=cols, lineage_names=[], lineage_apps=[]
+    try:
+        req = await read_request(request)
+    except PayloadError as e:
+        return payload_error(e)
+    TREE_NODES.observe(len(req.table))
+
+    columns, rows = EXPORTS[kind]
+    lines, media_type = EXPORT_FORMATS[fmt]
+    return StreamingResponse(
+        encode_chunks(lines(columns, rows(req.table)), RESPONSE_CHUNK_BYTES),
+        media_type=media_type,
+    )
+
+
+@app.post("/jobs")
+async def create_job(request: Request):
+    """
+    Same JSON body as /generate-excel, built in the background: answers 202
+    with the job id at once. Poll GET /jobs/{id} for the progress (rows
+    written per sheet) and fetch the xlsx from GET /jobs/{id}/result.
+    Jobs run in a pool of JOB_WORKERS processes separate from
+    /generate-excel; with JOB_QUEUE_MAX jobs unfinished, new ones get 429.
+    Finished jobs are kept for JOB_TTL_S seconds, or until more than
+    JOB_RESULTS_MAX results or JOB_RESULTS_MAX_BYTES of them are held, when
+    the oldest go first.
+    """
+    try:
+        req = await read_request(request)
+    except PayloadError as e:
+        return payload_error(e)
+    TREE_NODES.observe(len(req.table))
+
+    digests = table_digests(req.table)
+    key = payload_key(digests, req.sheets, req.roles_count, req.compression, req.fillers)
+    job = jobs.create(len(req.table), key, sheet_keys(digests, req.sheets, req.roles_count, req.fillers))
+    if job is None:
+        ERRORS.inc(reason="queue_full")
+        return JSONResponse(
+            status_code=429,
+            content={"error": f"{jobs.active()} jobs queued or running, {len(jobs)} held in all"},
+            headers={"Retry-After": "30"},
         )
-        autosize_columns(ws, min_w=8, max_w=60)
+
+    body = cache.get(key)
+    CACHE_LOOKUPS.inc(result="miss" if body is None else "hit")
+    if body is not None:
+        job.finish(body, len(body))
+        jobs.trim()
     else:
-        wb = Workbook()
-        wb.remove(wb.active)
+        try:
+            start_job(job, req)
+        except BrokenProcessPool:
+            ERRORS.inc(reason="broken_pool")
+            return JSONResponse(
+                status_code=503,
+                content={"error": "Excel generation is unavailable, try again"},
+                headers={"Retry-After": "10"},
+            )
+    return JSONResponse(status_code=202, content=job.poll(), headers={"Location": f"/jobs/{job.id}"})
 
-    if "Ablage" in sheets:
-        add_second_sheet(wb, tree)
 
-    if "Roles" in sheets:
-        add_third_sheet(wb, tree, roles_count)
+def start_job(job: Job, req):
+    """
+    Submits the job to the job pool, to a new one if that is broken. A job
+    that cannot be submitted at all is deleted before the error is raised,
+    so no queued job is left behind without a build.
+    """
+    args = (run_job, jobs.root, job.id, req.table, req.sheets, req.roles_count, req.stream, cached_parts(job.keys))
+    kwargs = dict(engine=req.engine, compression=req.compression, fillers=req.fillers)
+    executor = get_job_pool()
+    try:
+        try:
+            fut = executor.submit(*args, **kwargs)
+        except BrokenProcessPool:
+            drop_pool(executor)
+            executor = get_job_pool()
+            fut = executor.submit(*args, **kwargs)
+    except BaseException:
+        job.discard()
+        raise
+    running_jobs[job.id] = fut
+    asyncio.wrap_future(fut).add_done_callback(lambda _: finish_job(job, fut, executor))
 
-    buf = io.BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=tree.xlsx"}
-    )
+
+def finish_job(job: Job, fut, executor):
+    """
+    Owner side of a finished job: the pool worker has already stored its
+    result, or its error if the build raised. A worker that died stored
+    nothing, so its job is failed here and the broken pool replaced.
+    """
+    running_jobs.pop(job.id, None)
+    if fut.cancelled():
+        job.finish(error="cancelled")
+        return
+    exported()
+    error = fut.exception()
+    if error is not None:
+        if isinstance(error, BrokenProcessPool):
+            ERRORS.inc(reason="broken_pool")
+            drop_pool(executor)
+        else:
+            ERRORS.inc(reason="exception")
+        failed = jobs.get(job.id)
+        if failed is not None and failed.active:
+            failed.finish(error=f"{type(error).__name__}: {error}")
+        jobs.trim()
+        return
+    if fut.result() is None:
+        # swept before it started
+        return
+    pool_recovered()
+    stages, new_parts, packing, size = fut.result()
+    for stage, sec in stages.items():
+        STAGE_SECONDS.observe(sec, stage=stage)
+    store_parts(job.keys, new_parts)
+    OUTPUT_BYTES.observe(size)
+    report = compression_report(packing)
+    done = jobs.get(job.id)
+    if done is None:
+        # swept or trimmed while it was running
+        return
+    done.compression = report
+    done.save()
+    if size <= SPOOL_MAX_BYTES:
+        with open(done.result_path, "rb") as f:
+            cache.put(done.key, f.read())
+    jobs.trim()
+
+
+def unknown_job(job_id: str):
+    return JSONResponse(status_code=404, content={"error": f"no job {job_id}"})
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return unknown_job(job_id)
+    return job.poll()
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """The finished xlsx; 409 with the status while the job is unfinished, 500 if it failed."""
+    job = jobs.get(job_id)
+    if job is None:
+        return unknown_job(job_id)
+    status = job.poll()
+    if job.active:
+        return JSONResponse(status_code=409, content=status)
+    if job.error:
+        return JSONResponse(status_code=500, content=status)
+
+    headers = {
+        "Content-Disposition": "attachment; filename=tree.xlsx",
+        "ETag": etag_for(job.key),
+    }
+    try:
+        # kept on disk until the job expires; an unlink while this response
+        # is sent does not cut it short
+        f = open(job.result_path, "rb")
+    except FileNotFoundError:
+        return unknown_job(job_id)
+    headers["Content-Length"] = str(os.fstat(f.fileno()).st_size)
+    return StreamingResponse(iter_file(f), media_type=XLSX_MEDIA_TYPE, headers=headers)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    stats = cache.stats()
+    CACHE_BYTES.set(stats["bytes"])
+    CACHE_ENTRIES.set(stats["entries"])
+    stats = part_cache.stats()
+    PART_CACHE_BYTES.set(stats["bytes"])
+    JOBS_ACTIVE.set(jobs.active())
+    JOBS_HELD.set(len(jobs))
+    JOB_RESULT_BYTES.set(jobs.held()[1])
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {**cache.stats(), "parts": part_cache.stats()}
@@ -0,0 +1,151 @@
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        if not self.values and not self.label_names:
+            self.values[()] = self._empty()
+        for key in sorted(self.values):
+            yield from self._samples(key, self.values[key])
+
+    def _empty(self):
+        return 0
+
+    def _samples(self, key, value):
+        yield f"{self.name}{_labels(self.label_names, key)} {_num(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets, labels=()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def _empty(self):
+        # per-bucket counts (not cumulative), sum, count
+        return [[0] * len(self.buckets), 0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        h = self.values.get(key)
+        if h is None:
+            h = self.values[key] = self._empty()
+        for k, bound in enumerate(self.buckets):
+            if value <= bound:
+                h[0][k] += 1
+                break
+        h[1] += value
+        h[2] += 1
+
+    def _samples(self, key, value):
+        counts, total, n = value
+        running = 0
+        for bound, c in zip(self.buckets, counts):
+            running += c
+            le = _labels(self.label_names, key, [("le", _num(bound))])
+            yield f"{self.name}_bucket{le} {running}"
+        yield f"{self.name}_sum{_labels(self.label_names, key)} {_num(float(total))}"
+        yield f"{self.name}_count{_labels(self.label_names, key)} {n}"
+
+
+class Registry:
+    """Process-local metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, buckets, labels=()):
+        return self._add(Histogram(name, help_text, buckets, labels))
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """Wall time per named stage in seconds; a stage entered twice adds up."""
+
+    __slots__ = ("stages",)
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def __call__(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+
+def server_timing(stages) -> str:
+    """Server-Timing header value, durations in milliseconds."""
+    return ", ".join(f"{name};dur={sec * 1000:.1f}" for name, sec in stages.items())
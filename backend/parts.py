@@ -0,0 +1,240 @@
+import datetime
+import io
+import re
+import shutil
+import time
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+import openpyxl
+from openpyxl import Workbook
+from openpyxl.packaging.relationship import RelationshipList
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.writer.excel import ExcelWriter
+
+from config import XLSX_COMPRESSION
+
+# xf references in a worksheet part: cell and row "s", column "style"
+STYLE_REF = re.compile(rb'(<(?:c|row)\b[^>]*?\ss="|<col\b[^>]*?\sstyle=")(\d+)"')
+# differential style references of conditional formats
+DXF_REF = re.compile(rb'(<cfRule\b[^>]*?\sdxfId=")(\d+)"')
+
+
+def splice_support():
+    """
+    None if the installed openpyxl can be spliced from parts (and drive the
+    "fast" engine), else the reason why not. Both rely on openpyxl internals,
+    the style tables of Workbook, WorksheetWriter's temp file, ExcelWriter's
+    per-sheet hook and ZipExtFile's compressor, and on strings written inline,
+    which openpyxl does from 3.1 on; older versions write shared string ids
+    that splice() does not merge.
+    """
+    try:
+        version = tuple(int(n) for n in openpyxl.__version__.split(".")[:2])
+    except ValueError:
+        return f"unknown openpyxl version {openpyxl.__version__}"
+    if version < (3, 1):
+        return f"openpyxl {openpyxl.__version__} is older than 3.1"
+
+    wb = Workbook()
+    missing = [
+        f"Workbook.{name}" for name in (
+            "_cell_styles", "_fonts", "_fills", "_borders", "_number_formats",
+            "_protections", "_alignments", "_differential_styles",
+        ) if not hasattr(wb, name)
+    ]
+    writer = WorksheetWriter(wb.active)
+    missing += [f"WorksheetWriter.{name}" for name in ("out", "write", "cleanup") if not hasattr(writer, name)]
+    writer.cleanup()
+    missing += [f"ExcelWriter.{name}" for name in ("write_worksheet", "save") if not hasattr(ExcelWriter, name)]
+    with ZipFile(io.BytesIO(), "w", ZIP_DEFLATED) as archive, archive.open("probe", "w") as f:
+        if not hasattr(f, "_compressor"):
+            missing.append("ZipExtFile._compressor")
+    if missing:
+        return f"openpyxl {openpyxl.__version__} lacks {', '.join(missing)}"
+    return None
+
+
+# checked once per process; builder.py and schema.py refuse parts and the fast engine while set
+SPLICE_UNSUPPORTED = splice_support()
+
+
+class SheetPart:
+    """
+    One serialised worksheet. openpyxl writes strings inline, so the XML only
+    refers to the workbook through its xf (cell style) ids and the dxf ids
+    of its conditional formats; `styles` and `dxfs` resolve each id to the
+    style objects it stands for.
+    """
+
+    __slots__ = ("title", "xml", "styles", "dxfs")
+
+    def __init__(self, title: str, xml: bytes, styles, dxfs=()):
+        self.title = title
+        self.xml = xml
+        self.styles = styles
+        self.dxfs = dxfs
+
+
+def _resolve(wb, arr):
+    fmt = arr.numFmtId
+    if fmt >= BUILTIN_FORMATS_MAX_SIZE:
+        fmt = wb._number_formats[fmt - BUILTIN_FORMATS_MAX_SIZE]
+    return (
+        wb._fonts[arr.fontId], wb._fills[arr.fillId], wb._borders[arr.borderId], fmt,
+        wb._protections[arr.protectionId], wb._alignments[arr.alignmentId],
+        arr.pivotButton, arr.quotePrefix, arr.xfId,
+    )
+
+
+def sheet_part(wb, ws) -> SheetPart:
+    """Serialises a finished worksheet (normal or write-only) of wb."""
+    if wb.write_only:
+        ws.close()
+        writer = ws._writer
+    else:
+        writer = WorksheetWriter(ws)
+        writer.write()
+    with open(writer.out, "rb") as f:
+        xml = f.read()
+    writer.cleanup()
+    return xml_part(wb, ws.title, xml)
+
+
+def xml_part(wb, title: str, xml: bytes) -> SheetPart:
+    """A SheetPart for worksheet XML whose style ids refer to wb, e.g. one written by sheetml."""
+    styles = [_resolve(wb, arr) for arr in wb._cell_styles]
+    return SheetPart(title, xml, styles, list(wb._differential_styles.styles))
+
+
+def _register(wb, style) -> int:
+    font, fill, border, fmt, protection, alignment, pivot, quote, xf = style
+    if not isinstance(fmt, int):
+        fmt = wb._number_formats.add(fmt) + BUILTIN_FORMATS_MAX_SIZE
+    arr = StyleArray([
+        wb._fonts.add(font), wb._fills.add(fill), wb._borders.add(border), fmt,
+        wb._protections.add(protection), wb._alignments.add(alignment), pivot, quote, xf,
+    ])
+    return wb._cell_styles.add(arr)
+
+
+def remap_styles(xml: bytes, remap, pattern=STYLE_REF) -> bytes:
+    if all(k == v for k, v in enumerate(remap)):
+        return xml
+    ids = {str(k).encode(): str(v).encode() for k, v in enumerate(remap)}
+    return pattern.sub(lambda m: m.group(1) + ids[m.group(2)] + b'"', xml)
+
+
+# zip method and deflate level per compression name (None: zlib's default, 6)
+COMPRESSION = {
+    "stored": (ZIP_STORED, None),
+    "fast": (ZIP_DEFLATED, 1),
+    "default": (ZIP_DEFLATED, None),
+    "max": (ZIP_DEFLATED, 9),
+}
+
+
+class _TimedCompressor:
+    __slots__ = ("inner", "archive")
+
+    def __init__(self, inner, archive):
+        self.inner = inner
+        self.archive = archive
+
+    def compress(self, data):
+        t0 = time.perf_counter()
+        out = self.inner.compress(data)
+        self.archive.compress_seconds += time.perf_counter() - t0
+        return out
+
+    def flush(self):
+        t0 = time.perf_counter()
+        out = self.inner.flush()
+        self.archive.compress_seconds += time.perf_counter() - t0
+        return out
+
+
+class TimedZipFile(ZipFile):
+    """ZipFile that adds up the time its members spend in the compressor."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compress_seconds = 0.0
+
+    def open(self, name, mode="r", pwd=None, *, force_zip64=False):
+        f = super().open(name, mode, pwd, force_zip64=force_zip64)
+        if mode == "w" and getattr(f, "_compressor", None) is not None:
+            f._compressor = _TimedCompressor(f._compressor, self)
+        return f
+
+    def stats(self, level: str):
+        raw = sum(info.file_size for info in self.infolist())
+        packed = sum(info.compress_size for info in self.infolist())
+        return {
+            "level": level,
+            "seconds": self.compress_seconds,
+            "raw_bytes": raw,
+            "zip_bytes": packed,
+            "ratio": packed / raw if raw else 1.0,
+        }
+
+
+class _SpliceWriter(ExcelWriter):
+    """
+    ExcelWriter that takes each worksheet's XML ready made, as bytes or a
+    file object. Worksheets without prepared XML are written as usual.
+    """
+
+    def __init__(self, workbook, archive, sheets):
+        super().__init__(workbook, archive)
+        self.sheets = sheets
+
+    def write_worksheet(self, ws):
+        xml = self.sheets.get(ws.title)
+        if xml is None:
+            super().write_worksheet(ws)
+            return
+        ws._rels = RelationshipList()
+        if isinstance(xml, bytes):
+            self._archive.writestr(ws.path[1:], xml)
+        else:
+            with self._archive.open(ws.path[1:], "w", force_zip64=True) as dst:
+                shutil.copyfileobj(xml, dst)
+        self.manifest.append(ws)
+
+
+def splice(parts, out, compression: str = XLSX_COMPRESSION):
+    """
+    Writes an xlsx package with one worksheet per part, in order, to the
+    file object out. The parts' style tables are merged into one stylesheet
+    and their xf and dxf ids rewritten to match. Returns write_package()'s
+    stats.
+    """
+    wb = Workbook()
+    wb.remove(wb.active)
+    sheets = {}
+    for part in parts:
+        ws = wb.create_sheet(title=part.title)
+        remap = [_register(wb, style) for style in part.styles]
+        xml = remap_styles(part.xml, remap)
+        if part.dxfs:
+            xml = remap_styles(xml, [wb._differential_styles.add(d) for d in part.dxfs], DXF_REF)
+        sheets[ws.title] = xml
+    return write_package(wb, sheets, out, compression)
+
+
+def write_package(wb, sheets, out, compression: str = XLSX_COMPRESSION):
+    """
+    Saves wb to out like wb.save(), with the worksheet XML taken from sheets
+    (by title) where given, compressed as named in COMPRESSION. Returns the
+    compression level, time in the compressor, raw and zipped member sizes
+    and their ratio.
+    """
+    method, level = COMPRESSION[compression]
+    if wb.write_only and not wb.worksheets:
+        wb.create_sheet()
+    wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+    archive = TimedZipFile(out, "w", method, allowZip64=True, compresslevel=level)
+    _SpliceWriter(wb, archive, sheets).save()
+    return archive.stats(compression)
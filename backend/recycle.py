@@ -0,0 +1,100 @@
+import logging
+import os
+
+from config import WORKER_MAX_RSS_BYTES, WORKER_MAX_EXPORTS
+
+log = logging.getLogger("uvicorn.error")
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+MIB = 1024 * 1024
+
+
+def rss_bytes(pid: int) -> int:
+    """Resident set size of a process, read from /proc; 0 where that isn't available."""
+    try:
+        with open(f"/proc/{pid}/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def child_pids(pid: int):
+    pids = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return pids
+    for tid in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children", "rb") as f:
+                pids.extend(int(p) for p in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return pids
+
+
+def worker_rss(pid: int = None) -> int:
+    """RSS of a server process plus its direct children, the build pool workers."""
+    pid = os.getpid() if pid is None else pid
+    return rss_bytes(pid) + sum(rss_bytes(c) for c in child_pids(pid))
+
+
+class WorkerBudget:
+    """
+    Memory and export budget of one server process. After every export the
+    process measures its RSS (openpyxl leaves the heap fragmented, so it
+    hardly ever shrinks) and counts the export; the first time a limit is
+    passed it asks the supervisor in serve.py to replace it, and it tells
+    the supervisor when it is warmed up and serving. Run without serve.py
+    there is no channel and a recycle request is only logged. A limit of 0
+    is off; without /proc the RSS reads 0 and only the export count applies.
+    """
+
+    def __init__(self, max_rss: int = WORKER_MAX_RSS_BYTES, max_exports: int = WORKER_MAX_EXPORTS):
+        self.max_rss = max_rss
+        self.max_exports = max_exports
+        self.channel = None   # multiprocessing queue to the supervisor
+        self.exports = 0
+        self.rss = 0
+        self.recycling = False
+
+    def after_export(self) -> int:
+        """Counts a finished export and returns the RSS measured after it."""
+        self.exports += 1
+        self.rss = worker_rss()
+        if not self.recycling:
+            reason = self.exceeded()
+            if reason is not None:
+                self.recycling = True
+                self.ask_recycle(reason)
+        return self.rss
+
+    def recycle_now(self, reason: str):
+        """Asks to be replaced for a reason other than the budget, e.g. a build pool that keeps breaking."""
+        if not self.recycling:
+            self.recycling = True
+            self.ask_recycle(reason)
+
+    def exceeded(self):
+        if self.max_rss and self.rss > self.max_rss:
+            return "rss"
+        if self.max_exports and self.exports >= self.max_exports:
+            return "exports"
+        return None
+
+    def ask_recycle(self, reason: str):
+        log.warning(
+            "worker %d asks to be recycled (%s): rss %.0f MiB after %d exports%s",
+            os.getpid(), reason, self.rss / MIB, self.exports,
+            "" if self.channel is not None else " (not supervised, keeps running)",
+        )
+        if self.channel is not None:
+            self.channel.put(("recycle", os.getpid(), reason, self.rss, self.exports))
+
+    def announce_ready(self):
+        if self.channel is not None:
+            self.channel.put(("ready", os.getpid()))
+
+
+# the budget of this process; serve.run_worker sets its channel and limits
+budget = WorkerBudget()
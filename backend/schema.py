@@ -0,0 +1,154 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib decoder is only slower
+    orjson = None
+
+from config import ROLES_COUNT, ROLES_COUNT_MAX, ROLES_OMITTED, BATCH_MAX_JOBS, XLSX_COMPRESSION, GE_FILLERS
+from parts import COMPRESSION, SPLICE_UNSUPPORTED
+from utils import NodeTable, PayloadError, flatten_tree
+
+SHEETS = ("GE", "Ablage", "Roles")
+ENGINES = ("openpyxl", "fast")
+FILLERS = ("cells", "sparse")
+
+
+def loads(body: bytes):
+    try:
+        if orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body)
+    except RecursionError:
+        raise PayloadError("JSON body is nested too deeply") from None
+    except ValueError as e:
+        # orjson reports its nesting limit as a decode error
+        raise PayloadError(f"Invalid JSON body: {e}") from None
+
+
+class ExcelRequest:
+    """A validated /generate-excel body, with the tree already flattened."""
+
+    __slots__ = ("table", "sheets", "roles_count", "mode", "engine", "compression", "fillers")
+
+    def __init__(self, table: NodeTable, sheets, roles_count: int, mode, engine: str = "openpyxl",
+                 compression: str = XLSX_COMPRESSION, fillers: str = GE_FILLERS):
+        self.table = table
+        self.sheets = sheets
+        self.roles_count = roles_count
+        self.mode = mode
+        self.engine = engine
+        self.compression = compression
+        self.fillers = fillers
+
+    @property
+    def stream(self) -> bool:
+        return self.mode == "stream"
+
+
+def parse_request(body: bytes) -> ExcelRequest:
+    """
+    Decodes and checks the whole body up front, so malformed input is
+    rejected with PayloadError before any workbook is built.
+    """
+    data = loads(body)
+    if not isinstance(data, dict):
+        raise PayloadError("JSON body must be an object")
+    return excel_request(data)
+
+
+def excel_request(data: dict, table: NodeTable = None) -> ExcelRequest:
+    """
+    Checks the fields of a request body. The tree is flattened from
+    data["tree"] unless it was already read into `table` (see ingest.py).
+    """
+    tree = data.get("tree") if table is None else table
+    if not tree:
+        raise PayloadError("Missing 'tree' in JSON body")
+
+    sheets = data.get("sheets") or list(SHEETS)
+    if not isinstance(sheets, list) or not all(s in SHEETS for s in sheets):
+        raise PayloadError(f"sheets must be a list of {', '.join(SHEETS)}")
+
+    roles_count = data.get("rolesCount")
+    if roles_count is None:
+        roles_count = ROLES_COUNT
+    if isinstance(roles_count, bool) or not isinstance(roles_count, int):
+        raise PayloadError(f"rolesCount must be an integer from 1 to {ROLES_COUNT_MAX}")
+    if "Roles" not in sheets:
+        # no Roles sheet: ROLES_OMITTED (what Laravel sends then) or any valid count,
+        # all stored as ROLES_OMITTED so they share one cache entry
+        if roles_count != ROLES_OMITTED and not 1 <= roles_count <= ROLES_COUNT_MAX:
+            raise PayloadError(f"rolesCount must be {ROLES_OMITTED} or from 1 to {ROLES_COUNT_MAX}")
+        roles_count = ROLES_OMITTED
+    elif not 1 <= roles_count <= ROLES_COUNT_MAX:
+        raise PayloadError(f"rolesCount must be an integer from 1 to {ROLES_COUNT_MAX} with the Roles sheet")
+
+    mode = data.get("mode")
+    if mode is not None and not isinstance(mode, str):
+        raise PayloadError("mode must be a string")
+
+    engine = data.get("engine") or "openpyxl"
+    if engine not in ENGINES:
+        raise PayloadError(f"engine must be one of {', '.join(ENGINES)}")
+    if engine == "fast" and SPLICE_UNSUPPORTED:
+        raise PayloadError(f"engine fast is not available: {SPLICE_UNSUPPORTED}")
+
+    compression = data.get("compression") or XLSX_COMPRESSION
+    if compression not in COMPRESSION:
+        raise PayloadError(f"compression must be one of {', '.join(COMPRESSION)}")
+
+    fillers = data.get("fillers") or GE_FILLERS
+    if fillers not in FILLERS:
+        raise PayloadError(f"fillers must be one of {', '.join(FILLERS)}")
+
+    if table is None:
+        table = flatten_tree(tree)
+    return ExcelRequest(table, sheets, roles_count, mode, engine, compression, fillers)
+
+
+def parse_batch(body: bytes):
+    """
+    Checks the batch envelope; each job is validated on its own. Returns a
+    list of (filename, ExcelRequest or PayloadError), so one bad job only
+    fails itself.
+    """
+    data = loads(body)
+    jobs = data.get("jobs") if isinstance(data, dict) else None
+    if not isinstance(jobs, list) or not jobs:
+        raise PayloadError("Missing 'jobs' list in JSON body")
+    if len(jobs) > BATCH_MAX_JOBS:
+        raise PayloadError(f"At most {BATCH_MAX_JOBS} jobs per batch")
+
+    parsed = []
+    taken = set()
+    for n, job in enumerate(jobs, start=1):
+        name = job.get("filename") if isinstance(job, dict) else None
+        filename = batch_filename(name, n, taken)
+        try:
+            if not isinstance(job, dict):
+                raise PayloadError("job must be an object")
+            parsed.append((filename, excel_request(job)))
+        except PayloadError as e:
+            parsed.append((filename, e))
+    return parsed
+
+
+def batch_filename(name, n: int, taken) -> str:
+    """Archive member name: the base name only, ending in .xlsx, unique in the batch."""
+    base = ""
+    if isinstance(name, str):
+        base = name.replace("\\", "/").rsplit("/", 1)[-1].strip()
+        base = "".join(ch for ch in base if ch.isprintable())
+    if base.lower().endswith(".xlsx"):
+        base = base[:-5]
+    if not base or base in {".", ".."}:
+        base = f"tree-{n}"
+
+    filename = f"{base}.xlsx"
+    k = 2
+    while filename in taken:
+        filename = f"{base} ({k}).xlsx"
+        k += 1
+    taken.add(filename)
+    return filename
@@ -0,0 +1,205 @@
+"""
+Supervised server for main:app. Runs a number of uvicorn worker processes on
+one shared socket and replaces a worker once it reports that it passed its
+memory or export budget (see recycle.py). A worker warms up before it takes
+connections; the replacement is started first, and once it is serving the
+old worker gets SIGTERM, stops accepting, finishes its open requests and
+background jobs and exits, which hands its fragmented heap back to the OS.
+Jobs live in JOB_DIR, so any worker answers for them. A worker that dies on
+its own is restarted.
+
+    cd backend
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4 --max-rss-mb 1536
+"""
+import argparse
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+
+import uvicorn
+
+from config import SERVE_WORKERS, WORKER_MAX_RSS_BYTES, WORKER_MAX_EXPORTS, WORKER_DRAIN_TIMEOUT_S
+from recycle import MIB
+
+log = logging.getLogger("uvicorn.error")
+
+# a worker that exits this soon after its start is taken as broken, not restarted
+MIN_UPTIME_S = 5
+# a draining worker gets the drain timeout for its open requests, then again
+# for its background jobs, plus this for the rest of its shutdown
+KILL_GRACE_S = 10
+
+
+def run_worker(config: uvicorn.Config, sockets, channel, max_rss: int, max_exports: int):
+    """Process target: sets up the budget before main is imported, then serves."""
+    import recycle
+
+    recycle.budget.channel = channel
+    recycle.budget.max_rss = max_rss
+    recycle.budget.max_exports = max_exports
+    config.configure_logging()
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, workers: int, max_rss: int, max_exports: int,
+                 drain_timeout: float):
+        self.config = config
+        self.size = workers
+        self.max_rss = max_rss
+        self.max_exports = max_exports
+        self.drain_timeout = drain_timeout
+        self.ctx = multiprocessing.get_context("spawn")
+        self.channel = self.ctx.Queue()
+        self.sockets = []
+        self.workers = {}    # pid -> (process, start time), serving or warming up
+        self.replacing = {}  # pid of a replacement still warming up -> pid of the worker it replaces
+        self.draining = {}   # pid -> (process, deadline), finishing their open requests
+        self.recycled = 0
+        self.stopping = False
+
+    def run(self):
+        self.sockets = [self.config.bind_socket()]
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.stop)
+        log.info(
+            "supervising %d workers: recycled above %s or after %s exports",
+            self.size,
+            f"{self.max_rss / MIB:.0f} MiB" if self.max_rss else "no RSS limit",
+            self.max_exports or "unlimited",
+        )
+        for _ in range(self.size):
+            self.spawn()
+        try:
+            while not self.stopping:
+                try:
+                    kind, pid, *info = self.channel.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+                else:
+                    if kind == "recycle":
+                        self.recycle(pid, *info)
+                    elif kind == "ready":
+                        self.ready(pid)
+                self.reap()
+        finally:
+            self.shutdown()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def spawn(self):
+        p = self.ctx.Process(
+            target=run_worker,
+            args=(self.config, self.sockets, self.channel, self.max_rss, self.max_exports),
+            name="excel-worker",
+        )
+        p.start()
+        self.workers[p.pid] = (p, time.monotonic())
+        log.info("started worker %d", p.pid)
+        return p.pid
+
+    def recycle(self, pid: int, reason: str, rss: int, exports: int):
+        """Starts a replacement; the worker keeps serving until that is ready."""
+        if pid not in self.workers or pid in self.replacing.values():
+            return
+        self.recycled += 1
+        log.warning(
+            "recycling worker %d (%s): rss %.0f MiB after %d exports, %d recycled so far",
+            pid, reason, rss / MIB, exports, self.recycled,
+        )
+        self.replacing[self.spawn()] = pid
+
+    def ready(self, pid: int):
+        log.info("worker %d is serving", pid)
+        old = self.replacing.pop(pid, None)
+        if old is not None and old in self.workers:
+            self.drain(old)
+
+    def drain(self, pid: int):
+        p, _ = self.workers.pop(pid)
+        p.terminate()
+        self.draining[pid] = (p, time.monotonic() + 2 * self.drain_timeout + KILL_GRACE_S)
+        log.info("draining worker %d", pid)
+
+    def reap(self):
+        now = time.monotonic()
+        for pid, (p, started) in list(self.workers.items()):
+            if p.is_alive():
+                continue
+            p.join()
+            del self.workers[pid]
+            old = self.replacing.pop(pid, None)
+            if pid in self.replacing.values():
+                # it was to be replaced anyway; its replacement is on the way
+                self.replacing = {new: o for new, o in self.replacing.items() if o != pid}
+                log.warning("worker %d exited with %s while being replaced", pid, p.exitcode)
+                continue
+            if self.stopping:
+                continue
+            if now - started < MIN_UPTIME_S:
+                log.error("worker %d exited with %s right after its start, stopping", pid, p.exitcode)
+                self.stopping = True
+                continue
+            log.error("worker %d exited with %s, restarting it", pid, p.exitcode)
+            new = self.spawn()
+            if old is not None:
+                self.replacing[new] = old
+        for pid, (p, deadline) in list(self.draining.items()):
+            if not p.is_alive():
+                p.join()
+                del self.draining[pid]
+                log.info("worker %d drained and exited", pid)
+            elif now > deadline:
+                log.warning("worker %d still busy at its drain deadline, killing it", pid)
+                p.kill()
+                self.draining[pid] = (p, float("inf"))
+
+    def shutdown(self):
+        procs = [p for p, _ in self.workers.values()] + [p for p, _ in self.draining.values()]
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        deadline = time.monotonic() + 2 * self.drain_timeout + KILL_GRACE_S
+        for p in procs:
+            p.join(max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                p.kill()
+                p.join()
+        self.workers.clear()
+        self.draining.clear()
+        for sock in self.sockets:
+            sock.close()
+        log.info("supervisor stopped")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    ap.add_argument("--max-rss-mb", type=int, default=WORKER_MAX_RSS_BYTES // MIB,
+                    help="recycle a worker above this RSS, build pools included (0: off)")
+    ap.add_argument("--max-exports", type=int, default=WORKER_MAX_EXPORTS,
+                    help="recycle a worker after this many exports (0: off)")
+    ap.add_argument("--drain-timeout", type=float, default=WORKER_DRAIN_TIMEOUT_S,
+                    help="seconds a recycled worker gets for its open requests")
+    ap.add_argument("--log-level", default="info")
+    args = ap.parse_args(argv)
+
+    config = uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        log_level=args.log_level,
+        timeout_graceful_shutdown=int(args.drain_timeout),
+    )
+    Supervisor(
+        config, args.workers, args.max_rss_mb * MIB, args.max_exports, args.drain_timeout
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
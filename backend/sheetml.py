@@ -0,0 +1,277 @@
+from tempfile import SpooledTemporaryFile
+
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.formatting.formatting import ConditionalFormattingList
+from openpyxl.styles.differential import DifferentialStyle
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.utils import get_column_letter, column_index_from_string, coordinate_to_tuple
+from openpyxl.utils.exceptions import IllegalCharacterError
+from openpyxl.xml.functions import tostring
+
+from config import SPOOL_MAX_BYTES, RESPONSE_CHUNK_BYTES, XLSX_COMPRESSION
+from parts import write_package, xml_part
+from utils import CellRun, Dimensions, IdentityCache, style_key
+
+NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+HEAD = (
+    f'<worksheet xmlns="{NS}"><sheetPr><outlinePr summaryBelow="1" summaryRight="1" />'
+    '<pageSetUpPr /></sheetPr>'
+)
+FORMAT = '<sheetFormatPr baseColWidth="8" defaultRowHeight="15" />'
+TAIL = '<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5" /></worksheet>'
+
+
+def escape(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def cell_xml(ref: str, xf: int, value) -> str:
+    """
+    One <c> element, as openpyxl's write-only writer would produce it. Without
+    a ref the r attribute is left out: the cell follows the previous one.
+    """
+    r = f' r="{ref}"' if ref else ""
+    s = f' s="{xf}"' if xf else ""
+    if value is None:
+        return f'<c{r}{s} t="n" />'
+    if isinstance(value, str):
+        if not value:
+            return f'<c{r}{s} t="inlineStr" />'
+        value = value[:32767]
+        if ILLEGAL_CHARACTERS_RE.search(value):
+            raise IllegalCharacterError(f"{value} cannot be used in worksheets.")
+        stripped = value.strip()
+        space = ' xml:space="preserve"' if stripped and stripped != value else ""
+        return f'<c{r}{s} t="inlineStr"><is><t{space}>{escape(value)}</t></is></c>'
+    if isinstance(value, bool):
+        return f'<c{r}{s} t="b"><v>{int(value)}</v></c>'
+    return f'<c{r}{s} t="n"><v>{value}</v></c>'
+
+
+class SheetMLSheet:
+    """
+    Worksheet whose XML is written directly from the composed {column: RowCell}
+    rows, without cell objects. It offers the part of the write-only worksheet
+    interface the stream_* builders use: dimensions, freeze_panes and merges
+    are set before the first row, then rows go through append_cells().
+    Conditional formats may be added until the sheet is closed.
+    """
+
+    def __init__(self, book, title: str):
+        self.book = book
+        self.title = title
+        self.column_dimensions = Dimensions()
+        self.row_dimensions = Dimensions()
+        self.freeze_panes = None
+        self.merged = []
+        self.conditional_formatting = ConditionalFormattingList()
+        self.out = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self._pending = []
+        self._size = 0
+        self._row = 0
+        self._started = False
+
+    def merge_cells(self, start_row, start_column, end_row, end_column):
+        self.merged.append(
+            f"{get_column_letter(start_column)}{start_row}:{get_column_letter(end_column)}{end_row}"
+        )
+
+    def _write(self, text: str):
+        self._pending.append(text)
+        self._size += len(text)
+        if self._size >= RESPONSE_CHUNK_BYTES:
+            self._flush()
+
+    def _flush(self):
+        self.out.write("".join(self._pending).encode("utf-8"))
+        self._pending.clear()
+        self._size = 0
+
+    def _sheet_view(self) -> str:
+        if not self.freeze_panes:
+            body = '<selection activeCell="A1" sqref="A1" />'
+        else:
+            row, col = coordinate_to_tuple(self.freeze_panes)
+            split = ""
+            if col > 1:
+                split += f' xSplit="{col - 1}"'
+            if row > 1:
+                split += f' ySplit="{row - 1}"'
+            if col > 1 and row > 1:
+                pane = "bottomRight"
+                body = '<selection pane="topRight" /><selection pane="bottomLeft" />'
+            else:
+                pane = "topRight" if col > 1 else "bottomLeft"
+                body = ""
+            body = (
+                f'<pane{split} topLeftCell="{self.freeze_panes}" activePane="{pane}" state="frozen" />'
+                f'{body}<selection pane="{pane}" activeCell="A1" sqref="A1" />'
+            )
+        return f'<sheetViews><sheetView workbookViewId="0">{body}</sheetView></sheetViews>'
+
+    def _start(self):
+        self._started = True
+        self._write(HEAD)
+        self._write(self._sheet_view())
+        self._write(FORMAT)
+        cols = sorted(
+            (column_index_from_string(letter), dim.width)
+            for letter, dim in self.column_dimensions.items() if dim.width is not None
+        )
+        if cols:
+            self._write("<cols>")
+            for col, width in cols:
+                self._write(f'<col width="{width}" customWidth="1" min="{col}" max="{col}" />')
+            self._write("</cols>")
+        self._write("<sheetData>")
+
+    def append_cells(self, cells):
+        if not self._started:
+            self._start()
+        self._row += 1
+        r = self._row
+        dim = self.row_dimensions.get(r)
+        height = f' ht="{dim.height}" customHeight="1"' if dim is not None and dim.height is not None else ""
+        if not cells:
+            if height:
+                self._write(f'<row r="{r}"{height} />')
+            return
+        letters = self.book.letters
+        xf = self.book.xf
+        parts = [f'<row r="{r}"{height}>']
+        for col in sorted(cells):
+            src = cells[col]
+            if isinstance(src, CellRun):
+                head, tail = self.book.run_xml(src)
+                parts.append(cell_xml(f"{letters(col)}{r}", head, src.value))
+                parts.append(tail)
+            else:
+                parts.append(cell_xml(f"{letters(col)}{r}", xf(src), src.value))
+        parts.append("</row>")
+        self._write("".join(parts))
+
+    def _write_formatting(self):
+        # as openpyxl's WorksheetWriter: the rules' dxfs go to the workbook's stylesheet
+        empty = DifferentialStyle()
+        styles = self.book.wb._differential_styles
+        for cf in self.conditional_formatting:
+            for rule in cf.rules:
+                if rule.dxf and rule.dxf != empty:
+                    rule.dxfId = styles.add(rule.dxf)
+            self._write(tostring(cf.to_tree()).decode("utf-8"))
+
+    def close(self):
+        """Finishes the XML and rewinds it for reading."""
+        if not self._started:
+            self._start()
+        self._write("</sheetData>")
+        if self.merged:
+            self._write(f'<mergeCells count="{len(self.merged)}">')
+            for ref in self.merged:
+                self._write(f'<mergeCell ref="{ref}" />')
+            self._write("</mergeCells>")
+        self._write_formatting()
+        self._write(TAIL)
+        self._flush()
+        self.out.seek(0)
+        return self.out
+
+
+class SheetMLBook:
+    """
+    Write-only workbook stand-in for the "fast" engine. The palette from
+    styles.py is interned once per workbook: every (fill, font, alignment,
+    border) combination gets its xf id on first use, straight in the
+    stylesheet of the package, so the sheet XML needs no rewriting. The rest
+    of the package (styles, workbook, content types) is written by openpyxl.
+
+    Given an openpyxl workbook (normal or write-only), the book writes its
+    sheets into that one, next to the sheets openpyxl writes there itself;
+    save() then writes them all.
+    """
+
+    def __init__(self, wb: Workbook = None):
+        if wb is None:
+            wb = Workbook()
+            wb.remove(wb.active)
+        self.wb = wb
+        self.sheets = []
+        self._placeholders = []
+        self._xfs = IdentityCache()
+        self._runs = IdentityCache()
+        self._letters = {}
+
+    def create_sheet(self, title: str) -> SheetMLSheet:
+        # the workbook's own sheet only holds the place; its XML comes from ws
+        self._placeholders.append(self.wb.create_sheet(title=title))
+        ws = SheetMLSheet(self, title)
+        self.sheets.append(ws)
+        return ws
+
+    def letters(self, col: int) -> str:
+        letter = self._letters.get(col)
+        if letter is None:
+            letter = self._letters[col] = get_column_letter(col)
+        return letter
+
+    def xf(self, src) -> int:
+        key = style_key(src)
+        entry = self._xfs.get(key)
+        if entry is not None:
+            return entry[0]
+        wb = self.wb
+        arr = StyleArray([
+            wb._fonts.add(src.font) if src.font is not None else 0,
+            wb._fills.add(src.fill) if src.fill is not None else 0,
+            wb._borders.add(src.border) if src.border is not None else 0,
+            0, 0,
+            wb._alignments.add(src.alignment) if src.alignment is not None else 0,
+            0, 0, 0,
+        ])
+        return self._xfs.put(key, wb._cell_styles.add(arr), (src.fill, src.font, src.alignment, src.border))
+
+    def run_xml(self, run):
+        """
+        The xf id of a CellRun's first cell and the XML of the others. Those
+        are written without r, so one string serves every row with the same
+        run; the first cell carries the row's ref.
+        """
+        key = (run.first, run.last, run.value, id(run.fill), id(run.font), id(run.borders))
+        entry = self._runs.get(key)
+        if entry is not None:
+            return entry[0]
+        cells = run.cells()
+        _, first = next(cells)
+        head = self.xf(first)
+        tail = "".join(cell_xml(None, self.xf(cell), run.value) for _, cell in cells)
+        return self._runs.put(key, (head, tail), (run.fill, run.font, run.borders))
+
+    def part(self, ws: SheetMLSheet):
+        """The finished sheet as a parts.SheetPart, for splicing; the book is not saved then."""
+        with ws.close() as f:
+            part = xml_part(self.wb, ws.title, f.read())
+        self._cleanup()
+        return part
+
+    def save(self, out, compression: str = XLSX_COMPRESSION):
+        sheets = {ws.title: ws.close() for ws in self.sheets}
+        try:
+            return write_package(self.wb, sheets, out, compression)
+        finally:
+            for f in sheets.values():
+                f.close()
+            self._cleanup()
+
+    def _cleanup(self):
+        # a write-only placeholder has opened a temp file for rows it never gets
+        for placeholder in self._placeholders:
+            writer = getattr(placeholder, "_writer", None)
+            if writer is not None:
+                writer.cleanup()
@@ -0,0 +1,66 @@
+import random
+
+PREFIX_CHAIN = ["DigitaleAkte-203", "ba", ".PANKOW"]
+WORDS = ["Akte", "Vorgang", "Referat", "Sachgebiet", "Leitung", "Team", "Verwaltung", "Bürgeramt"]
+
+
+def _description(rnd, length: int) -> str:
+    if length <= 0:
+        return ""
+    text = " ".join(rnd.choice(WORDS) for _ in range(length // 6 + 1))
+    return text[:length]
+
+
+def synthetic_tree(
+    depth: int = 6,
+    fanout: int = 4,
+    disabled: float = 0.1,
+    ab: float = 0.15,
+    pe: float = 0.1,
+    poeing: float = 0.05,
+    desc_len: int = 40,
+    seed: int = 1,
+):
+    """
+    Deterministic org tree shaped like the exports from the editor: the usual
+    three prefix levels, then `depth` levels below them with on average
+    `fanout` children per node. `disabled`, `ab`, `pe` and `poeing` are the
+    shares of disabled nodes and of Ab_/Pe_/poeing app names; descriptions
+    are up to `desc_len` characters long.
+    """
+    rnd = random.Random(seed)
+    counter = [0]
+
+    def node(level: int, path: str):
+        counter[0] += 1
+        name = f"Referat {path}"
+        r = rnd.random()
+        if r < ab:
+            app = f"Ab_{path}"
+        elif r < ab + pe:
+            app = f"Pe_{path}"
+        elif r < ab + pe + poeing:
+            app = "poeing"
+        else:
+            app = ""
+
+        d = {
+            "name": name,
+            "appName": app,
+            "description": _description(rnd, rnd.randint(0, desc_len)),
+            "enabled": rnd.random() >= disabled,
+            "children": [],
+        }
+        if level < depth:
+            for k in range(rnd.randint(0, 2 * fanout)):
+                d["children"].append(node(level + 1, f"{path}.{k + 1}"))
+        return d
+
+    roots = [node(1, str(k + 1)) for k in range(max(1, fanout))]
+    for name in reversed(PREFIX_CHAIN):
+        roots = [{"name": name, "children": roots}]
+    return roots
+
+
+def count_nodes(nodes) -> int:
+    return sum(1 + count_nodes(n.get("children") or []) for n in nodes)
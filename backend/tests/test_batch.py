@@ -0,0 +1,82 @@
+import io
+import json
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from batch import ZipStream
+from schema import batch_filename, parse_batch
+from utils import PayloadError
+
+TREE = [{"name": "A", "children": [{"name": "B"}]}]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "WARMUP", False)
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("report.xlsx", "report.xlsx"),
+    ("report", "report.xlsx"),
+    ("../../etc/passwd", "passwd.xlsx"),
+    ("C:\\Users\\x\\bericht.XLSX", "bericht.xlsx"),
+    ("a\x00b\nc.xlsx", "abc.xlsx"),
+    ("  spaced  ", "spaced.xlsx"),
+    ("..", "tree-3.xlsx"),
+    ("dir/", "tree-3.xlsx"),
+    (".xlsx", "tree-3.xlsx"),
+    (42, "tree-3.xlsx"),
+    (None, "tree-3.xlsx"),
+])
+def test_filenames_are_sanitised(name, expected):
+    assert batch_filename(name, 3, set()) == expected
+
+
+def test_filenames_are_unique_in_the_batch():
+    taken = set()
+    names = [batch_filename(n, i, taken) for i, n in enumerate(["a", "a.xlsx", "x/a", None, "tree-4"], start=1)]
+    assert names == ["a.xlsx", "a (2).xlsx", "a (3).xlsx", "tree-4.xlsx", "tree-4 (2).xlsx"]
+
+
+def test_bad_jobs_only_fail_themselves():
+    body = json.dumps({"jobs": [{"tree": TREE}, "nope", {"tree": []}, {"tree": TREE, "filename": "b"}]})
+    parsed = parse_batch(body.encode())
+    assert [name for name, _ in parsed] == ["tree-1.xlsx", "tree-2.xlsx", "tree-3.xlsx", "b.xlsx"]
+    assert [isinstance(req, PayloadError) for _, req in parsed] == [False, True, True, False]
+    for envelope in ({}, {"jobs": []}, {"jobs": {}}, [1]):
+        with pytest.raises(PayloadError):
+            parse_batch(json.dumps(envelope).encode())
+
+
+def test_zip_stream_round_trip(tmp_path):
+    path = tmp_path / "big.bin"
+    path.write_bytes(b"x" * 100_000)
+    archive = ZipStream()
+    out = archive.add_bytes("a.txt", b"hello") + b"".join(archive.add_file(str(path), "big.bin")) + archive.close()
+    with zipfile.ZipFile(io.BytesIO(out)) as z:
+        assert z.namelist() == ["a.txt", "big.bin"]
+        assert z.read("a.txt") == b"hello"
+        assert z.read("big.bin") == b"x" * 100_000
+        assert z.getinfo("big.bin").compress_type == zipfile.ZIP_STORED
+
+
+def test_batch_endpoint_zips_workbooks_and_manifest(client):
+    jobs = [
+        {"tree": TREE, "sheets": ["GE"], "filename": "../same"},
+        {"tree": TREE, "sheets": ["Ablage"], "filename": "same.xlsx"},
+        {"tree": "bad", "filename": "bad"},
+    ]
+    r = client.post("/generate-excel/batch", json={"jobs": jobs})
+    assert r.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(r.content)) as z:
+        assert sorted(z.namelist()) == ["manifest.json", "same (2).xlsx", "same.xlsx"]
+        manifest = json.loads(z.read("manifest.json"))["jobs"]
+        assert z.read("same.xlsx")[:2] == b"PK"
+    assert [(e["filename"], e["status"]) for e in manifest] == [
+        ("same.xlsx", "ok"), ("same (2).xlsx", "ok"), ("bad.xlsx", "error"),
+    ]
@@ -0,0 +1,77 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from cache import WorkbookCache, etag_for, etag_matches, payload_key, sheet_keys, table_digests
+from utils import flatten_tree
+
+TREE = [{"name": "A", "description": "d", "children": [{"name": "B", "appName": "Ab_B"}]}]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "WARMUP", False)
+    with TestClient(main.app) as c:
+        yield c
+
+
+def digests(tree):
+    return table_digests(flatten_tree(tree))
+
+
+def test_lru_bounded_by_bytes():
+    cache = WorkbookCache(10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"   # a is now the most recent
+    cache.put("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == cache.get("c") == b"1234"
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
+    assert cache.stats() == {"entries": 2, "bytes": 8, "max_bytes": 10, "hits": 3, "misses": 2}
+
+
+def test_keys_follow_content_not_serialisation():
+    same = [{"children": [{"appName": "Ab_B", "name": " B "}], "description": "d", "name": "A"}]
+    key = payload_key(digests(TREE), ["GE", "Roles"], 5, "default", "cells")
+    assert payload_key(digests(same), ["Roles", "GE"], 5, "default", "cells") == key
+    assert payload_key(digests(TREE), ["GE", "Roles"], 6, "default", "cells") != key
+    assert payload_key(digests(TREE), ["GE", "Roles"], 5, "max", "cells") != key
+
+
+def test_sheet_keys_only_follow_their_inputs():
+    other_desc = [{**TREE[0], "description": "other"}]
+    a = sheet_keys(digests(TREE), ["GE", "Ablage", "Roles"], 5, "cells")
+    b = sheet_keys(digests(other_desc), ["GE", "Ablage", "Roles"], 6, "cells")
+    assert a["GE"] == b["GE"]
+    assert a["Ablage"] != b["Ablage"]
+    assert a["Roles"] != b["Roles"]
+    assert sheet_keys(digests(TREE), ["GE"], 5, "sparse")["GE"] != a["GE"]
+
+
+def test_etag_matching():
+    tag = etag_for("k")
+    assert etag_matches(tag, "k")
+    assert etag_matches(f'"x", W/{tag}', "k")
+    assert etag_matches("*", "k")
+    assert not etag_matches('"x"', "k")
+    assert not etag_matches(None, "k")
+
+
+def test_repeated_payload_is_cached_and_revalidated(client):
+    payload = {"tree": TREE, "sheets": ["GE", "Ablage"]}
+    first = client.post("/generate-excel", json=payload)
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    etag = first.headers["ETag"]
+
+    again = client.post("/generate-excel", json=payload)
+    assert again.headers["X-Cache"] == "HIT"
+    assert again.headers["ETag"] == etag
+    assert again.content == first.content
+
+    fresh = client.post("/generate-excel", json=payload, headers={"If-None-Match": etag})
+    assert fresh.status_code == 304
+    assert fresh.headers["ETag"] == etag
+    assert fresh.content == b""
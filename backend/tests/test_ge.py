@@ -0,0 +1,34 @@
+from builder import build_ge_sheet
+from utils import DISABLED_FILL, flatten_tree
+from worksheets.ge import DATA_START_ROW, LEFT_HEADERS, PERM_HEADERS, sheet_columns
+
+TREE = [{"name": "A", "children": [
+    {"name": "B", "enabled": False},
+    {"name": "C", "children": [{"name": "D", "children": [{"name": "E"}]}]},
+]}]
+
+
+def rows(sparse):
+    table = flatten_tree(TREE)
+    _, ws = build_ge_sheet(table, 3, sparse=sparse)
+    cols = sheet_columns(4, len(LEFT_HEADERS), len(PERM_HEADERS), 3)
+    return ws, cols
+
+
+def test_sparse_disabled_row_leaves_filler_columns_out():
+    ws, cols = rows(sparse=True)
+    row = DATA_START_ROW + 1   # B, disabled, at depth 1
+    assert ws.cell(row, 2).value == "B"
+    assert ws.cell(row, 2).fill == DISABLED_FILL
+    assert ws.cell(row, cols["flat_col"]).fill == DISABLED_FILL
+    written = {c for (r, c) in ws._cells if r == row}
+    fillers = set(range(3, cols["spacer1"]))
+    spacers = {cols["spacer1"], cols["spacer2"], cols["spacer3"], cols["spacer4"]}
+    assert not written & (fillers | spacers)
+
+
+def test_cells_disabled_row_greys_the_whole_row():
+    ws, cols = rows(sparse=False)
+    row = DATA_START_ROW + 1
+    assert all(ws.cell(row, c).fill == DISABLED_FILL for c in range(1, cols["tree_end"] + 1))
+    assert ws.cell(row, 3).value == "-"
@@ -0,0 +1,128 @@
+"""
+Every engine against the workbook of the original builder, before the
+NodeTable, row plans, width tracking, streaming and the fast engine: the
+golden file holds that workbook's cell values and looks, merges, column
+widths and freeze panes for TREE with rolesCount 3, as snapshot() takes
+them. Cells that are empty and look unstyled are left out, since engines
+differ in whether they write them at all.
+"""
+import io
+import json
+import os
+
+import pytest
+from openpyxl import load_workbook
+
+from builder import render_workbook
+from parts import SPLICE_UNSUPPORTED
+from utils import flatten_tree
+
+GOLDEN = os.path.join(os.path.dirname(__file__), "golden", "workbook.json")
+SHEETS = ["GE", "Ablage", "Roles"]
+ROLES = 3
+
+# the three prefix levels, Ab_/Pe_/AblgOE/Poeing labels, FORCE_BLUE names,
+# disabled leaves and parents, unterbrechen and an unnamed leaf
+TREE = [{"name": "Org", "children": [{"name": "Org Name", "children": [{"name": "Bezirk", "children": [
+    {"name": "Abteilung 1", "appName": "Ab_1", "description": "Erste Abteilung", "children": [
+        {"name": "Referat 1.1", "appName": "Pe_1.1", "description": "Personal", "children": [
+            {"name": "Team A", "appName": "AblgOE", "description": "", "children": [
+                {"name": "Sachgebiet", "appName": "Poeing", "description": "tief", "children": []},
+            ]},
+        ]},
+        {"name": "Referat 1.2", "appName": "Ab_1.2", "description": "aus", "enabled": False, "children": []},
+    ]},
+    {"name": "Abteilung 2", "appName": "", "description": "Zweite", "enabled": False, "unterbrechen": True,
+     "children": [
+         {"name": "Referat 2.1", "appName": "Pe_2.1", "description": "", "children": []},
+         {"name": "", "appName": "", "children": []},
+     ]},
+    {"name": "Stab", "appName": "Stab", "description": "Leitung", "children": []},
+]}]}]}]
+
+PLAIN = [False, None, None, None, [None, None, None, None], None, None, None]
+
+
+def color(c):
+    return c.rgb if c is not None and c.type == "rgb" else None
+
+
+def look(c):
+    b = c.border
+    return [
+        bool(c.font.b), color(c.font.color),
+        c.fill.fill_type, color(c.fill.fgColor) if c.fill.fill_type else None,
+        [s.style if s is not None else None for s in (b.left, b.right, b.top, b.bottom)],
+        c.alignment.horizontal, c.alignment.vertical, c.alignment.wrap_text,
+    ]
+
+
+def snapshot(body: bytes):
+    """Per sheet: {cell: [value, look]}, merges, custom column widths and freeze panes."""
+    out = {}
+    for ws in load_workbook(io.BytesIO(body)).worksheets:
+        cells = {}
+        for row in ws.iter_rows():
+            for c in row:
+                value = None if c.value == "" else c.value
+                style = look(c)
+                if value is not None or style != PLAIN:
+                    cells[c.coordinate] = [value, style]
+        out[ws.title] = {
+            "cells": cells,
+            "merges": sorted(str(r) for r in ws.merged_cells.ranges),
+            "widths": {k: v.width for k, v in sorted(ws.column_dimensions.items()) if v.customWidth},
+            "freeze": ws.freeze_panes,
+        }
+    return out
+
+
+def load_golden():
+    """The golden snapshot; the file keeps each distinct look once, in "looks"."""
+    with open(GOLDEN, encoding="utf-8") as f:
+        golden = json.load(f)
+    return {
+        title: {**sheet, "cells": {ref: [value, sheet["looks"][i]] for ref, (value, i) in sheet["cells"].items()}}
+        for title, sheet in golden.items()
+    }
+
+
+def assert_golden(body: bytes):
+    golden, got = load_golden(), json.loads(json.dumps(snapshot(body)))
+    assert list(got) == list(golden)
+    for title, want in golden.items():
+        sheet = got[title]
+        wrong = {
+            ref: (want["cells"].get(ref), sheet["cells"].get(ref))
+            for ref in set(want["cells"]) | set(sheet["cells"])
+            if want["cells"].get(ref) != sheet["cells"].get(ref)
+        }
+        assert not wrong, f"{title}: {dict(sorted(wrong.items())[:5])}"
+        for key in ("merges", "widths", "freeze"):
+            assert sheet[key] == want[key], f"{title} {key}"
+
+
+def render(**kwargs):
+    body = render_workbook(flatten_tree(TREE), SHEETS, ROLES, **kwargs)[0]
+    assert isinstance(body, bytes)
+    return body
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["default", "stream"])
+def test_openpyxl_engines_match_the_original(stream):
+    assert_golden(render(stream=stream))
+
+
+@pytest.mark.skipif(SPLICE_UNSUPPORTED is not None, reason=str(SPLICE_UNSUPPORTED))
+def test_fast_engine_matches_the_original():
+    assert_golden(render(stream=True, engine="fast"))
+
+
+@pytest.mark.skipif(SPLICE_UNSUPPORTED is not None, reason=str(SPLICE_UNSUPPORTED))
+def test_spliced_cached_parts_match_the_original():
+    table = flatten_tree(TREE)
+    _, _, built, _ = render_workbook(table, SHEETS, ROLES, False)
+    assert set(built) == set(SHEETS)
+    # every sheet from the part cache, then one of them rebuilt next to the others
+    assert_golden(render_workbook(table, SHEETS, ROLES, False, parts=built)[0])
+    assert_golden(render_workbook(table, SHEETS, ROLES, False, parts={"GE": built["GE"]})[0])
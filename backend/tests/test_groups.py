@@ -0,0 +1,94 @@
+import csv
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from openpyxl import load_workbook
+
+import main
+from builder import render_workbook
+from config import ADMIN_ACCOUNT, LEFT_HEADERS, PERM_HEADERS, PREFIX
+from groups import ADDRESS_COLUMNS, GROUP_COLUMNS, csv_lines, encode_chunks, iter_addresses, iter_groups, ndjson_lines
+from utils import flatten_tree, tree_max_depth
+from worksheets.ge import sheet_columns
+
+TREE = [{"name": "Org", "children": [{"name": "Org Name", "children": [{"name": "Bezirk", "children": [
+    {"name": "Abteilung Süd", "appName": "Ab_S", "children": [
+        {"name": "Referat 1", "appName": "Pe_1", "children": [{"name": "Team", "appName": "AblgOE"}]},
+        {"name": "", "appName": "ohne Namen"},
+    ]},
+    {"name": "Stab", "enabled": False},
+]}]}]}]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "WARMUP", False)
+    with TestClient(main.app) as c:
+        yield c
+
+
+def workbook():
+    table = flatten_tree(TREE)
+    body = render_workbook(table, ["GE", "Ablage"], 1, False)[0]
+    return table, load_workbook(io.BytesIO(body))
+
+
+def test_groups_match_the_ge_permission_columns():
+    table, wb = workbook()
+    depth = max(0, tree_max_depth(table))
+    cols = sheet_columns(depth + 1, len(LEFT_HEADERS), len(PERM_HEADERS), depth)
+    ws = wb.worksheets[0]
+    sheet = [
+        [ws.cell(r, c).value for c in range(cols["perm2_s"], cols["perm2_e"] + 1)]
+        for r in range(1, ws.max_row + 1)
+        if str(ws.cell(r, cols["perm2_s"]).value).startswith(PREFIX)
+    ]
+    groups = list(iter_groups(table))
+    assert [row[3] for row in groups] == sheet
+    assert [row[:2] for row in groups] == [[3, "Abteilung Süd"], [4, "Referat 1"], [5, "Team"], [3, "Stab"]]
+
+
+def test_addresses_match_the_ablage_columns():
+    table, wb = workbook()
+    ws = wb.worksheets[1]
+    addresses = list(iter_addresses(table))
+    assert [row[0] for row in addresses] == ["Ab_S", "Pe_1", "AblgOE", "ohne Namen", "Stab"]
+    # the sheet has separator rows between the blocks and the Postkorb rows after them
+    rows = [r for r in range(2, ws.max_row + 1) if ws.cell(r, 1).value][:len(addresses)]
+    for r, row in zip(rows, addresses):
+        label, parent, kind, _, *lists = row
+        assert [ws.cell(r, c).value or "" for c in (1, 3, 4)] == [label, parent, kind]
+        assert [ws.cell(r, c).value for c in range(7, 12)] == [";".join(v) for v in lists]
+        assert all(v[-1] == ADMIN_ACCOUNT for v in lists)
+
+
+def test_ndjson_and_csv_lines():
+    rows = [[3, "a", "k", ["k", "k-x"]]]
+    assert list(ndjson_lines(GROUP_COLUMNS, rows)) == [
+        json.dumps({"level": 3, "name": "a", "key": "k", "groups": ["k", "k-x"]}) + "\n"
+    ]
+    text = "".join(csv_lines(GROUP_COLUMNS, rows))
+    assert list(csv.reader(io.StringIO(text))) == [list(GROUP_COLUMNS), ["3", "a", "k", "k;k-x"]]
+    chunks = list(encode_chunks(["ab", "cd", "é"], 3))
+    assert chunks == [b"abcd", "é".encode()]
+
+
+@pytest.mark.parametrize("kind, fmt", [("groups", "ndjson"), ("addresses", "csv")])
+def test_export_endpoint(client, kind, fmt):
+    r = client.post(f"/export/{kind}?format={fmt}", json={"tree": TREE})
+    assert r.status_code == 200
+    table = flatten_tree(TREE)
+    if fmt == "ndjson":
+        got = [json.loads(line) for line in r.text.splitlines()]
+        assert got == [dict(zip(GROUP_COLUMNS, row)) for row in iter_groups(table)]
+    else:
+        got = list(csv.reader(io.StringIO(r.text)))
+        assert got[0] == list(ADDRESS_COLUMNS)
+        assert len(got) == 1 + len(list(iter_addresses(table)))
+
+
+def test_export_rejects_unknown_kind_and_format(client):
+    assert client.post("/export/nope", json={"tree": TREE}).status_code == 404
+    assert client.post("/export/groups?format=xml", json={"tree": TREE}).status_code == 422
@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import pytest
+
+ijson = pytest.importorskip("ijson")
+
+from ingest import TreeReader, read_request
+from schema import parse_request
+from synthetic import synthetic_tree
+from utils import NodeTable, PayloadError, PayloadTooLarge, flatten_tree
+
+
+class ChunkedRequest:
+    """The part of a starlette Request that ingest reads: headers and the body in chunks."""
+
+    def __init__(self, body: bytes, chunk: int = 7):
+        self.headers = {}
+        self.body = body
+        self.chunk = chunk
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk):
+            yield self.body[i:i + self.chunk]
+
+
+def read(data, **kwargs):
+    body = data if isinstance(data, bytes) else json.dumps(data).encode()
+    return asyncio.run(read_request(ChunkedRequest(body), **kwargs))
+
+
+def feed(tree, **limits):
+    reader = TreeReader(**limits)
+    reader.feed(ijson.basic_parse(json.dumps({"tree": tree}).encode(), use_float=True))
+    return reader.table
+
+
+def assert_same_table(got: NodeTable, want: NodeTable):
+    for name in NodeTable.__slots__:
+        assert getattr(got, name) == getattr(want, name), name
+
+
+def test_table_matches_flatten_tree():
+    tree = synthetic_tree(depth=3, fanout=3, seed=5)
+    # fields in every order, children before the name, unknown fields of any shape
+    tree[0]["children"].insert(0, {"children": [{"name": " x "}], "extra": {"a": [1, {"b": 2}]}, "name": "late"})
+    tree[0]["children"].append({"name": "n", "children": None, "enabled": None, "unterbrechen": "ja"})
+    req = read({"tree": tree, "sheets": ["GE", "Roles"], "rolesCount": 4})
+    assert_same_table(req.table, flatten_tree(tree))
+    assert (req.sheets, req.roles_count) == (["GE", "Roles"], 4)
+
+
+def test_other_fields_match_parse_request():
+    data = {"sheets": ["Ablage"], "tree": [{"name": "a"}], "mode": "stream", "tree_note": [1, 2]}
+    body = json.dumps(data).encode()
+    streamed, whole = read(body), parse_request(body)
+    assert (streamed.sheets, streamed.stream, streamed.roles_count) == (whole.sheets, whole.stream, whole.roles_count)
+    assert_same_table(streamed.table, whole.table)
+
+
+@pytest.mark.parametrize("tree", [
+    [{"name": 3}],
+    [{"name": "a", "children": [{"name": "b", "enabled": "no"}]}],
+    [{"name": "a", "children": {"name": "b"}}],
+    [{"name": "a", "children": ["b"]}],
+    [{"name": "a", "unterbrechen": 1}],
+    [],
+])
+def test_errors_match_flatten_tree(tree):
+    with pytest.raises(PayloadError) as whole:
+        parse_request(json.dumps({"tree": tree}).encode())
+    with pytest.raises(PayloadError) as streamed:
+        read({"tree": tree})
+    assert str(streamed.value) == str(whole.value)
+
+
+def test_node_and_depth_limits():
+    tree = [{"name": "a", "children": [{"name": "b", "children": [{"name": "c"}]}, {"name": "d"}]}]
+    for limits, error in (({"max_nodes": 3}, PayloadTooLarge), ({"max_depth": 2}, PayloadError)):
+        with pytest.raises(error) as whole:
+            flatten_tree(tree, **limits)
+        with pytest.raises(error) as streamed:
+            feed(tree, **limits)
+        assert str(streamed.value) == str(whole.value)
+    assert len(feed(tree, max_nodes=4, max_depth=3)) == 4
+
+
+def test_body_limit_and_bad_json():
+    with pytest.raises(PayloadTooLarge):
+        read({"tree": [{"name": "a" * 100}]}, limit=50)
+    with pytest.raises(PayloadError, match="Invalid JSON body"):
+        read(b'{"tree": [{"name": "a"')
+    with pytest.raises(PayloadError, match="must be an object"):
+        read(b'[1]')
@@ -0,0 +1,78 @@
+import os
+import time
+
+from jobs import JobStore
+
+
+def store(root, **limits):
+    return JobStore(str(root), limits.get("max_active", 2), 3600, limits.get("max_held", 3),
+                    limits.get("max_held_bytes", 100), limits.get("timeout", 3600), limits.get("heartbeat", 10))
+
+
+def test_jobs_are_shared_through_the_directory(tmp_path):
+    a, b = store(tmp_path), store(tmp_path)
+    job = a.create(5, "key", {"GE": "k1"})
+    seen = b.get(job.id)
+    assert seen.poll()["status"] == "queued"
+    assert seen.keys == {"GE": "k1"}
+
+    job.finish(b"xlsx", 4)
+    seen = b.get(job.id)
+    assert seen.poll()["status"] == "done"
+    with open(seen.result_path, "rb") as f:
+        assert f.read() == b"xlsx"
+
+
+def test_active_limit_counts_every_process(tmp_path):
+    a, b = store(tmp_path), store(tmp_path)
+    assert a.create(1, "k", {}) is not None
+    assert b.create(1, "k", {}) is not None
+    assert a.create(1, "k", {}) is None
+
+
+def test_trim_drops_oldest_finished_results(tmp_path):
+    s = store(tmp_path, max_active=10)
+    jobs = [s.create(1, "k", {}) for _ in range(4)]
+    for n, job in enumerate(jobs):
+        job.finish(b"x" * 40, 40)
+        job.finished = n
+        job.save()
+    assert s.trim() == 2
+    assert [s.get(job.id) is not None for job in jobs] == [False, False, True, True]
+    assert s.held() == (2, 80)
+
+
+def test_unknown_or_malformed_ids(tmp_path):
+    s = store(tmp_path)
+    assert s.get("0" * 32) is None
+    assert s.get("../etc") is None
+
+
+def test_job_past_its_deadline_fails(tmp_path):
+    s = store(tmp_path, timeout=60)
+    job = s.create(1, "k", {})
+    job.deadline = time.time() - 1
+    job.save()
+    status = s.get(job.id).poll()
+    assert status["status"] == "failed"
+    assert "unfinished after" in status["error"]
+
+
+def test_job_fails_once_its_owner_stops_beating(tmp_path):
+    s = store(tmp_path, heartbeat=10)
+    job = s.create(1, "k", {})
+    assert s.get(job.id).poll()["status"] == "queued"
+
+    stale = time.time() - 31
+    os.utime(job.heartbeat_path, (stale, stale))
+    assert s.active() == 0
+    assert s.get(job.id).poll()["status"] == "failed"
+
+
+def test_beat_keeps_a_job_alive(tmp_path):
+    s = store(tmp_path, heartbeat=10)
+    job = s.create(1, "k", {})
+    stale = time.time() - 31
+    os.utime(job.heartbeat_path, (stale, stale))
+    s.beat([job.id])
+    assert s.get(job.id).poll()["status"] == "queued"
@@ -0,0 +1,81 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from metrics import CONTENT_TYPE, Registry, StageTimer, server_timing
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "WARMUP", False)
+    with TestClient(main.app) as c:
+        yield c
+
+
+def test_render_in_prometheus_text_format():
+    r = Registry()
+    c = r.counter("t_errors_total", "Errors.", labels=("reason",))
+    g = r.gauge("t_in_flight", "In flight.")
+    h = r.histogram("t_seconds", "Time.", buckets=(0.5, 0.1), labels=("stage",))
+    c.inc(reason='a "b"\n')
+    c.inc(2, reason="x")
+    g.inc()
+    g.inc()
+    g.dec()
+    h.observe(0.05, stage="s")
+    h.observe(0.3, stage="s")
+    h.observe(7, stage="s")
+    assert r.render() == "\n".join([
+        "# HELP t_errors_total Errors.",
+        "# TYPE t_errors_total counter",
+        't_errors_total{reason="a \\"b\\"\\n"} 1',
+        't_errors_total{reason="x"} 2',
+        "# HELP t_in_flight In flight.",
+        "# TYPE t_in_flight gauge",
+        "t_in_flight 1",
+        "# HELP t_seconds Time.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{stage="s",le="0.1"} 1',
+        't_seconds_bucket{stage="s",le="0.5"} 2',
+        't_seconds_bucket{stage="s",le="+Inf"} 3',
+        't_seconds_sum{stage="s"} 7.35',
+        't_seconds_count{stage="s"} 3',
+    ]) + "\n"
+
+
+def test_unlabelled_metrics_render_zero_before_use():
+    r = Registry()
+    r.counter("t_total", "Total.")
+    r.histogram("t_seconds", "Time.", buckets=(1,))
+    assert r.render().splitlines()[2:] == [
+        "t_total 0",
+        "# HELP t_seconds Time.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{le="1"} 0',
+        't_seconds_bucket{le="+Inf"} 0',
+        "t_seconds_sum 0.0",
+        "t_seconds_count 0",
+    ]
+
+
+def test_stage_timer_adds_up_and_formats_server_timing():
+    timer = StageTimer()
+    with timer("build"):
+        pass
+    with timer("build"):
+        pass
+    timer.stages.update(parse=0.0123, build=1.5)
+    assert server_timing(timer.stages) == "build;dur=1500.0, parse;dur=12.3"
+
+
+def test_endpoint_reports_requests_and_stages(client):
+    r = client.post("/generate-excel", json={"tree": [{"name": "metrics", "children": [{"name": "m"}]}]})
+    stages = [part.split(";")[0] for part in r.headers["Server-Timing"].split(", ")]
+    assert {"parse", "build"} <= set(stages)
+
+    m = client.get("/metrics")
+    assert m.headers["content-type"] == CONTENT_TYPE
+    text = m.text
+    assert "# TYPE excel_request_seconds histogram" in text
+    assert 'excel_stage_seconds_count{stage="build"}' in text
+    assert "excel_cache_lookups_total" in text
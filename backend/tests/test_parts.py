@@ -0,0 +1,67 @@
+import io
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+from parts import SPLICE_UNSUPPORTED, sheet_part, splice
+
+pytestmark = pytest.mark.skipif(SPLICE_UNSUPPORTED is not None, reason=str(SPLICE_UNSUPPORTED))
+
+THIN = Side(style="thin", color="FF000000")
+
+
+def first_part():
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "A"
+    ws["A1"] = "Kopf"
+    ws["A1"].font = Font(bold=True, color="FFFFFFFF")
+    ws["A1"].fill = PatternFill("solid", fgColor="FF1F4E78")
+    ws["B2"] = 42
+    ws["B2"].border = Border(left=THIN, bottom=THIN)
+    ws["C3"] = "ohne Stil"
+    return sheet_part(wb, ws)
+
+
+def second_part():
+    # different styles in a different order, so its xf ids must be remapped
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("B")
+    gray = WriteOnlyCell(ws, value="grau")
+    gray.fill = PatternFill("solid", fgColor="FFD9D9D9")
+    gray.alignment = Alignment(wrap_text=True, vertical="top")
+    bold = WriteOnlyCell(ws, value="Kopf")
+    bold.font = Font(bold=True, color="FFFFFFFF")
+    bold.fill = PatternFill("solid", fgColor="FF1F4E78")
+    ws.append([gray, bold, "plain"])
+    return sheet_part(wb, ws)
+
+
+def style_of(cell):
+    return (
+        cell.font.b, cell.font.color.rgb if cell.font.color is not None and cell.font.color.type == "rgb" else None,
+        cell.fill.fill_type, cell.fill.fgColor.rgb,
+        cell.border.left.style, cell.border.bottom.style,
+        cell.alignment.wrap_text, cell.alignment.vertical,
+    )
+
+
+def test_splice_round_trip():
+    out = io.BytesIO()
+    splice([first_part(), second_part()], out)
+    out.seek(0)
+    wb = load_workbook(out)
+
+    assert wb.sheetnames == ["A", "B"]
+    a, b = wb["A"], wb["B"]
+    assert [a["A1"].value, a["B2"].value, a["C3"].value] == ["Kopf", 42, "ohne Stil"]
+    assert [b["A1"].value, b["B1"].value, b["C1"].value] == ["grau", "Kopf", "plain"]
+
+    assert style_of(a["A1"]) == (True, "FFFFFFFF", "solid", "FF1F4E78", None, None, None, None)
+    assert style_of(a["B2"])[4:6] == ("thin", "thin")
+    assert not a["C3"].has_style
+    assert style_of(b["A1"]) == (False, None, "solid", "FFD9D9D9", None, None, True, "top")
+    assert style_of(b["B1"]) == style_of(a["A1"])
+    assert style_of(b["C1"]) == style_of(a["C3"])
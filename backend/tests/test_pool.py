@@ -0,0 +1,95 @@
+import os
+import signal
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+TREE = {"tree": [{"name": "A", "children": [{"name": "B"}]}], "sheets": ["GE"]}
+
+
+def tree(name):
+    """A payload no other test builds, so it is never served from the cache."""
+    return {**TREE, "tree": [{"name": name, "children": [{"name": "B"}]}]}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "WARMUP", False)
+    with TestClient(main.app) as c:
+        yield c
+
+
+def kill_one_worker(executor):
+    pid = next(iter(executor._processes))
+    os.kill(pid, signal.SIGKILL)
+    deadline = time.time() + 10
+    while not executor._broken and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def wait_ready(client, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        r = client.get("/health/ready")
+        if r.status_code == 200:
+            return r
+        time.sleep(0.2)
+    return r
+
+
+def test_build_survives_a_killed_pool_worker(client):
+    assert client.post("/generate-excel", json=tree("survive-before")).status_code == 200
+    kill_one_worker(main.get_pool())
+
+    # distinct payload, so it is built rather than served from the cache
+    r = client.post("/generate-excel", json={**tree("survive-after"), "rolesCount": 3, "sheets": ["GE", "Roles"]})
+    assert r.status_code == 200
+    assert "excel_pool_broken_total{pool=\"build\"}" in client.get("/metrics").text
+
+
+def test_health_reports_a_broken_pool_until_replaced(client):
+    assert client.post("/generate-excel", json=tree("health-before")).status_code == 200
+    kill_one_worker(main.get_pool())
+
+    r = client.get("/health/ready")
+    assert r.status_code == 503
+    assert r.json()["status"] == "broken"
+    assert wait_ready(client).status_code == 200
+    assert client.post("/generate-excel", json=tree("health-after")).status_code == 200
+
+
+def test_job_fails_when_its_worker_dies(client):
+    from synthetic import synthetic_tree
+
+    big = {"tree": synthetic_tree(depth=6, fanout=5), "sheets": ["GE", "Roles"], "rolesCount": 50}
+    r = client.post("/jobs", json=big)
+    assert r.status_code == 202
+    job_id = r.json()["id"]
+    deadline = time.time() + 30
+    while client.get(f"/jobs/{job_id}").json()["status"] == "queued" and time.time() < deadline:
+        time.sleep(0.05)
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "running"
+    kill_one_worker(main.get_job_pool())
+
+    deadline = time.time() + 10
+    while (status := client.get(f"/jobs/{job_id}").json())["status"] == "running" and time.time() < deadline:
+        time.sleep(0.05)
+    assert status["status"] == "failed"
+    assert "BrokenProcessPool" in status["error"]
+    assert not main.jobs.get(job_id).active
+    assert wait_ready(client).status_code == 200
+
+
+def test_job_that_cannot_be_submitted_is_not_left_queued(client, monkeypatch):
+    class Refusing:
+        def submit(self, *args, **kwargs):
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+    monkeypatch.setattr(main, "get_job_pool", Refusing)
+    before = len(main.jobs)
+    with pytest.raises(RuntimeError):
+        client.post("/jobs", json=tree("refused"))
+    assert len(main.jobs) == before
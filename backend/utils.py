@@ -1,6 +1,11 @@
 import re
+from copy import copy
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
 
+from config import MAX_TREE_NODES, MAX_TREE_DEPTH
 from styles import DISABLED_FILL, GRAY, GRAYB
 
 
@@ -11,13 +16,142 @@ def norm_token(s: str) -> str:
     return s
 
 
-def tree_max_depth(nodes, level=0):
-    if not nodes:
-        return level - 1
-    m = level
-    for n in nodes:
-        m = max(m, tree_max_depth(n.get("children") or [], level + 1))
-    return m
+class NodeTable:
+    """
+    The JSON tree flattened in preorder into parallel lists. Node i is the
+    i-th entry of every list and its subtree is the index range [i, end[i]).
+    Names are stripped and normalized once here, so the sheet builders never
+    go back to the raw dicts.
+    """
+
+    __slots__ = (
+        "depth", "parent", "is_last", "end",
+        "name", "token", "app", "desc",
+        "enabled", "has_children", "unterbrechen",
+        "max_depth",
+    )
+
+    def __init__(self):
+        self.depth = []
+        self.parent = []
+        self.is_last = []
+        self.end = []
+        self.name = []
+        self.token = []
+        self.app = []
+        self.desc = []
+        self.enabled = []
+        self.has_children = []
+        self.unterbrechen = []
+        self.max_depth = -1
+
+    def __len__(self):
+        return len(self.depth)
+
+    def children(self, i=-1):
+        """Indices of the direct children of node i (of the roots for i == -1)."""
+        j = i + 1
+        stop = len(self.depth) if i < 0 else self.end[i]
+        end = self.end
+        while j < stop:
+            yield j
+            j = end[j]
+
+
+def breaks_inheritance(v) -> bool:
+    if isinstance(v, str) and v.strip().lower() in {"wahr", "true", "ja"}:
+        return True
+    return v is True
+
+
+class PayloadError(ValueError):
+    """Malformed request data, reported to the client as 422."""
+
+
+class PayloadTooLarge(PayloadError):
+    """Request data over a size limit, reported to the client as 413."""
+
+
+def _node_path(stack) -> str:
+    return "tree" + ".children".join(f"[{f[3] - 1}]" for f in stack)
+
+
+def _text(node, field, stack) -> str:
+    v = node.get(field)
+    if v is None:
+        return ""
+    if not isinstance(v, str):
+        raise PayloadError(f"{_node_path(stack)}.{field} must be a string")
+    return v
+
+
+def flatten_tree(nodes, max_nodes: int = MAX_TREE_NODES, max_depth: int = MAX_TREE_DEPTH) -> NodeTable:
+    """
+    Iterative preorder walk with an explicit stack of sibling lists, so the
+    nesting depth of the JSON is not bounded by the recursion limit. Node
+    fields are type-checked on the way; a bad node raises PayloadError with
+    its position before any sheet is written, and so does a node nested
+    max_depth levels deep. More than max_nodes nodes raise PayloadTooLarge.
+    (ingest.TreeReader builds the same table from a body still arriving.)
+    """
+    if nodes is not None and not isinstance(nodes, list):
+        raise PayloadError("tree must be a list of nodes")
+    t = NodeTable()
+    # frames: [sibling list, depth, parent index, next position]
+    stack = [[nodes or [], 0, -1, 0]]
+    while stack:
+        frame = stack[-1]
+        siblings, depth, parent, k = frame
+        if k == len(siblings):
+            stack.pop()
+            if parent >= 0:
+                t.end[parent] = len(t.depth)
+            continue
+        frame[3] = k + 1
+
+        node = siblings[k]
+        if not isinstance(node, dict):
+            raise PayloadError(f"{_node_path(stack)} must be an object")
+        if depth >= max_depth:
+            raise PayloadError(f"{_node_path(stack)} is nested deeper than {max_depth} levels")
+        if len(t.depth) >= max_nodes:
+            raise PayloadTooLarge(f"tree has more than {max_nodes} nodes")
+        name = _text(node, "name", stack).strip()
+        app = _text(node, "appName", stack)
+        desc = _text(node, "description", stack)
+        enabled = node.get("enabled")
+        if enabled is not None and not isinstance(enabled, bool):
+            raise PayloadError(f"{_node_path(stack)}.enabled must be a boolean")
+        unterbrechen = node.get("unterbrechen")
+        if unterbrechen is not None and not isinstance(unterbrechen, (bool, str)):
+            raise PayloadError(f"{_node_path(stack)}.unterbrechen must be a boolean or string")
+        children = node.get("children")
+        if children is not None and not isinstance(children, list):
+            raise PayloadError(f"{_node_path(stack)}.children must be a list")
+
+        i = len(t.depth)
+        if depth > t.max_depth:
+            t.max_depth = depth
+
+        t.depth.append(depth)
+        t.parent.append(parent)
+        t.is_last.append(k == len(siblings) - 1)
+        t.end.append(i + 1)
+        t.name.append(name)
+        t.token.append(norm_token(name))
+        t.app.append((app or name).strip())
+        t.desc.append(desc.strip())
+        t.enabled.append(enabled is not False)
+        t.has_children.append(bool(children))
+        t.unterbrechen.append(breaks_inheritance(unterbrechen))
+
+        if children:
+            stack.append([children, depth + 1, i, 0])
+    return t
+
+
+def tree_max_depth(table: NodeTable):
+    return table.max_depth
 
 
 def autosize_columns(ws, min_w=10, max_w=120):
@@ -31,27 +165,337 @@ def autosize_columns(ws, min_w=10, max_w=120):
         ws.column_dimensions[letter].width = max(min_w, min(max_w, max_len + 2))
 
 
-def gray_out_row(ws, row, col_start, col_end):
-    for c in range(col_start, col_end + 1):
-        cell = ws.cell(row=row, column=c)
-        bold = bool(cell.font and cell.font.bold)
-        cell.fill = DISABLED_FILL
-        cell.font = GRAYB if bold else GRAY
+class ColumnWidths:
+    """
+    Longest text per column, reported by the sheet builders while they write,
+    so widths can be set without reading the sheet back (autosize_columns).
+    """
+
+    __slots__ = ("max_len",)
+
+    def __init__(self):
+        self.max_len = {}
 
+    def see(self, col: int, text: str):
+        n = len(text)
+        if n > self.max_len.get(col, 0):
+            self.max_len[col] = n
 
-def gray_out_row_full(ws, row, total_cols):
-    for c in range(1, total_cols + 1):
+    def apply(self, ws, total_cols: int, min_w=10, max_w=120):
+        max_len = self.max_len
+        for col in range(1, total_cols + 1):
+            ws.column_dimensions[get_column_letter(col)].width = max(min_w, min(max_w, max_len.get(col, 0) + 2))
+
+
+def gray_out_row(ws, row, col_start, col_end):
+    for c in range(col_start, col_end + 1):
         cell = ws.cell(row=row, column=c)
         bold = bool(cell.font and cell.font.bold)
         cell.fill = DISABLED_FILL
         cell.font = GRAYB if bold else GRAY
 
 
-def strip_prefix_levels(nodes, n):
-    cur = nodes
+def strip_prefix_levels(table: NodeTable, n):
+    """Children of the node reached by following the first child n times."""
+    cur = -1
     for _ in range(n):
-        if not cur:
+        if len(table) <= cur + 1 or (cur >= 0 and not table.has_children[cur]):
             return []
-        first = cur[0]
-        cur = first.get("children") or []
-    return cur
+        cur += 1
+    return list(table.children(cur))
+
+
+def merge_cells(ws, start_row, start_column, end_row, end_column):
+    if isinstance(ws, WriteOnlyWorksheet):
+        ws.merged_cells.add(CellRange(
+            min_row=start_row, min_col=start_column, max_row=end_row, max_col=end_column
+        ))
+    else:
+        ws.merge_cells(start_row=start_row, start_column=start_column, end_row=end_row, end_column=end_column)
+
+
+# Streaming (write-only) helpers
+
+class RowCell:
+    """Detached stand-in for a worksheet cell while a streamed row is composed."""
+
+    __slots__ = ("value", "fill", "font", "alignment", "border")
+
+    def __init__(self):
+        self.value = None
+        self.fill = None
+        self.font = None
+        self.alignment = None
+        self.border = None
+
+
+class CellRun:
+    """
+    Columns first..last of one composed row whose cells share value, fill and
+    font and differ only in their border, looked up per column in `borders`.
+    It sits in the row under its first column in place of that many RowCells.
+    """
+
+    __slots__ = ("first", "last", "value", "fill", "font", "borders")
+
+    def __init__(self, first: int, last: int, borders, value=None):
+        self.first = first
+        self.last = last
+        self.value = value
+        self.fill = None
+        self.font = None
+        self.borders = borders
+
+    def cells(self):
+        """(column, RowCell) for every column of the run; the RowCell is reused."""
+        cell = RowCell()
+        cell.value = self.value
+        cell.fill = self.fill
+        cell.font = self.font
+        borders = self.borders
+        for col in range(self.first, self.last + 1):
+            cell.border = borders[col]
+            yield col, cell
+
+
+def row_items(cells):
+    """(column, RowCell) of a composed row, with its CellRuns spelled out."""
+    for col, src in cells.items():
+        if isinstance(src, CellRun):
+            yield from src.cells()
+        else:
+            yield col, src
+
+
+class RowBuffer:
+    """
+    Offers the ws.cell() call the sheet builders use, but only keeps the rows
+    that have not been handed to the write-only worksheet yet.
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def cell(self, row, column, value=None):
+        cells = self.rows.setdefault(row, {})
+        cell = cells.get(column)
+        if cell is None:
+            cell = cells[column] = RowCell()
+        if value is not None:
+            cell.value = value
+        return cell
+
+    def pop(self, row):
+        return self.rows.pop(row, {})
+
+
+class Dimension:
+    __slots__ = ("width", "height")
+
+    def __init__(self):
+        self.width = None
+        self.height = None
+
+
+class Dimensions(dict):
+    """column_dimensions/row_dimensions stand-in: entries appear on first use."""
+
+    def __missing__(self, key):
+        dim = self[key] = Dimension()
+        return dim
+
+
+class SheetTemplate(RowBuffer):
+    """
+    The fixed header and layout of a sheet, recorded once by running the code
+    that writes it against this object (ws.cell(), merges, row heights and
+    column widths) and then stamped into every new sheet with the same
+    layout parameters. The texts the header reported are kept in `widths`.
+    Recorded cells are never handed out, only copies or their styles.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.column_dimensions = Dimensions()
+        self.row_dimensions = Dimensions()
+        self.merged = []
+        self.widths = ColumnWidths()
+
+    def merge_cells(self, start_row, start_column, end_row, end_column):
+        self.merged.append((start_row, start_column, end_row, end_column))
+
+    def layout(self, ws):
+        """Column widths, row heights and merged ranges."""
+        for letter, dim in self.column_dimensions.items():
+            if dim.width is not None:
+                ws.column_dimensions[letter].width = dim.width
+        for row, dim in self.row_dimensions.items():
+            if dim.height is not None:
+                ws.row_dimensions[row].height = dim.height
+        for rng in self.merged:
+            merge_cells(ws, *rng)
+
+    def see(self, widths):
+        max_len = widths.max_len
+        for col, n in self.widths.max_len.items():
+            if n > max_len.get(col, 0):
+                max_len[col] = n
+
+    def row(self, row: int):
+        """Copy of one recorded row as {column: RowCell}."""
+        cells = {}
+        for col, src in self.rows.get(row, {}).items():
+            cell = cells[col] = RowCell()
+            cell.value = src.value
+            cell.fill = src.fill
+            cell.font = src.font
+            cell.alignment = src.alignment
+            cell.border = src.border
+        return cells
+
+    def write(self, ws, widths):
+        """
+        The recorded cells into ws, which is a worksheet, a RowBuffer or a
+        NullSheet (only widths learn the header texts).
+        """
+        self.see(widths)
+        if isinstance(ws, NullSheet):
+            return
+        if isinstance(ws, RowBuffer):
+            for row in self.rows:
+                ws.rows.setdefault(row, {}).update(self.row(row))
+            return
+        styles = StyleCache(ws)
+        for row, cells in self.rows.items():
+            write_row(ws, row, cells, styles)
+
+
+class NullSheet:
+    """ws.cell() target that keeps nothing: runs a builder only for what it reports."""
+
+    def __init__(self):
+        self._cell = RowCell()
+
+    def cell(self, row, column, value=None):
+        return self._cell
+
+
+def drain(rows):
+    """Run a row generator to the end and return its return value."""
+    try:
+        while True:
+            next(rows)
+    except StopIteration as done:
+        return done.value
+
+
+def track_rows(rows, progress, sheet: str):
+    """Row generator passed through progress.track(), or as is without a progress."""
+    if progress is None:
+        return rows
+    return progress.track(sheet, rows)
+
+
+def compose_rows(rows, buf):
+    """
+    Turn a row generator writing into buf into the per-row cell dicts that
+    stream_rows() expects. The generator yields the row it is about to start,
+    so every buffered row above it is final.
+    """
+    nxt = 1
+    for start in rows:
+        while nxt < start:
+            yield buf.pop(nxt)
+            nxt += 1
+    while buf.rows:
+        yield buf.pop(nxt)
+        nxt += 1
+
+
+class IdentityCache(dict):
+    """
+    Values derived from style objects, keyed by the objects' ids (e.g. from
+    style_key): builders share the style objects from styles.py, so an id is
+    cheaper to hash than the object and equal combinations still meet. A
+    lookup is a plain get() of the entry, whose first item is the value.
+    put() stores the objects along with it, so none of them is collected and
+    its id reused for another while the cache lives.
+    """
+
+    __slots__ = ()
+
+    def put(self, key, value, objs):
+        self[key] = (value, objs)
+        return value
+
+
+def style_key(src):
+    """Key of a RowCell's (fill, font, alignment, border) in an IdentityCache."""
+    return id(src.fill), id(src.font), id(src.alignment), id(src.border)
+
+
+class StyleCache:
+    """
+    Interns the (fill, font, alignment, border) combinations written to one
+    workbook as ready StyleArrays, so a cell gets its whole style with a single
+    assignment instead of four hashed collection lookups.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self._arrays = IdentityCache()
+
+    def apply(self, cell, src):
+        key = style_key(src)
+        entry = self._arrays.get(key)
+        if entry is not None:
+            arr = entry[0]
+        else:
+            proto = WriteOnlyCell(self.ws)
+            if src.fill is not None:
+                proto.fill = src.fill
+            if src.font is not None:
+                proto.font = src.font
+            if src.alignment is not None:
+                proto.alignment = src.alignment
+            if src.border is not None:
+                proto.border = src.border
+            arr = self._arrays.put(key, proto._style, (src.fill, src.font, src.alignment, src.border))
+        cell._style = copy(arr)
+
+
+def write_row(ws, row, cells, styles):
+    for col, src in row_items(cells):
+        cell = ws.cell(row=row, column=col)
+        if src.value is not None:
+            cell.value = src.value
+        styles.apply(cell, src)
+
+
+def write_only_row(ws, cells, styles):
+    if not cells:
+        return []
+    last = max(src.last if isinstance(src, CellRun) else col for col, src in cells.items())
+    out = [None] * last
+    for col, src in row_items(cells):
+        cell = WriteOnlyCell(ws, value=src.value)
+        styles.apply(cell, src)
+        out[col - 1] = cell
+    return out
+
+
+def stream_rows(ws, rows):
+    """
+    Append {column: cell} rows, starting at row 1, to a write-only worksheet.
+    Column widths must already be set: they are written before the first row.
+    A sheetml.SheetMLSheet takes the composed cells, CellRuns included, as
+    they are.
+    """
+    append_cells = getattr(ws, "append_cells", None)
+    if append_cells is not None:
+        for cells in rows:
+            append_cells(cells)
+        return
+    styles = StyleCache(ws)
+    for cells in rows:
+        ws.append(write_only_row(ws, cells, styles))
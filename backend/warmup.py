@@ -0,0 +1,43 @@
+import os
+import time
+
+from builder import render_workbook
+from cache import table_digests
+from config import ROLES_COUNT
+from groups import EXPORTS
+from parts import SPLICE_UNSUPPORTED
+from schema import SHEETS, ENGINES, excel_request
+from synthetic import synthetic_tree
+from utils import drain
+
+
+def warm_up_tree():
+    """Small synthetic tree that still reaches every row kind of the three sheets."""
+    return synthetic_tree(depth=3, fanout=3, pe=0.3, poeing=0.2, seed=1)
+
+
+def warm_up_request():
+    """
+    Runs the steps of a request that happen in the API process: validating
+    and flattening the body, hashing it for the cache, and the key exports.
+    """
+    req = excel_request({"tree": warm_up_tree(), "rolesCount": ROLES_COUNT})
+    table_digests(req.table)
+    for _, rows in EXPORTS.values():
+        drain(rows(req.table))
+    return req
+
+
+def warm_up_worker():
+    """
+    Pool task: one complete tiny export per engine, so the worker process has
+    imported, built and saved through every code path before real work
+    arrives. Returns its pid and the seconds it took.
+    """
+    t0 = time.perf_counter()
+    req = excel_request({"tree": warm_up_tree(), "rolesCount": ROLES_COUNT})
+    for engine in ENGINES:
+        if engine == "fast" and SPLICE_UNSUPPORTED:
+            continue
+        render_workbook(req.table, list(SHEETS), req.roles_count, False, engine=engine)
+    return os.getpid(), time.perf_counter() - t0
@@ -1,10 +1,13 @@
-from .ge import create_sheet, write_rows
-from .ablage import add_second_sheet
-from .roles import add_third_sheet
+from .ge import create_sheet, write_rows, stream_sheet
+from .ablage import add_second_sheet, stream_second_sheet
+from .roles import add_third_sheet, stream_third_sheet
 
 __all__ = [
     "create_sheet",
     "write_rows",
+    "stream_sheet",
     "add_second_sheet",
+    "stream_second_sheet",
     "add_third_sheet",
+    "stream_third_sheet",
 ]
@@ -1,13 +1,14 @@
+from functools import lru_cache
+
 from openpyxl import Workbook
 from openpyxl.styles import PatternFill
 
 from config import (
     SHEET2_NAME,
     SKIP_PARENTS,
-    ORG_NAME,
     ADMIN_ACCOUNT,
-    PREFIX,
 )
+from groups import GroupKeyPath, make_addr
 from styles import (
     PALEGR,
     BLACKB,
@@ -21,7 +22,18 @@ from styles import (
     THICK_BOTTOM,
 )
 
-from utils import strip_prefix_levels, gray_out_row, autosize_columns, norm_token
+from utils import (
+    strip_prefix_levels,
+    gray_out_row,
+    drain,
+    ColumnWidths,
+    NullSheet,
+    RowBuffer,
+    SheetTemplate,
+    compose_rows,
+    stream_rows,
+    track_rows,
+)
 
 
 USE_THICK_TOP = False
@@ -40,22 +52,14 @@ def allowed_types_for(label, typ):
     return "GOV_FILE" if typ == "Aktenablage" else ""
 
 
-def break_inheritance_from_node(node, desc_text):
-    v = node.get("unterbrechen")
-    if isinstance(v, str) and v.strip().lower() in {"wahr", "true", "ja"}:
-        return "WAHR"
-    if v is True:
+def break_inheritance_from_node(table, i, desc_text):
+    if table.unterbrechen[i]:
         return "WAHR"
     if "ohne leitungszugriff" in (desc_text or "").lower():
         return "WAHR"
     return ""
 
 
-def build_group_key_from_names(path_names):
-    tokens = [norm_token(x) for x in path_names if (x or "").strip()]
-    return PREFIX + "_".join(tokens) if tokens else ""
-
-
 def set_row_top_thick(ws, row, col_start=1, col_end=11):
     if not USE_THICK_TOP:
         return
@@ -91,113 +95,121 @@ def set_group_bottom_thick(ws, row_last, col_start=1, col_end=11):
         set_row_bottom_thick(ws, row_last, col_start, col_end)
 
 
-def make_addr(group_key: str, suffix: str = "") -> str:
-    key = f"{group_key}-{suffix}" if suffix else group_key
-    return f"{key}@{ORG_NAME}"
-
-
 def is_poe_label(label: str) -> bool:
     low = (label or "").lower()
     return low.startswith("pe_") or "poeing" in low
 
 
-def write_group_recursive(ws, node, r, path_names, path_apps, poeings):
-    name = (node.get("name") or "").strip()
-    appn = (node.get("appName") or name).strip()
-    kids = node.get("children") or []
-    desc = (node.get("description") or "").strip()
-    label = appn if appn else (name if name else "(unnamed)")
-    is_parent = bool(kids)
-    disabled = node.get("enabled") is False
-    parent_raw = path_apps[-1] if path_apps else ""
-
-    if (
-        USE_BLANK_BEFORE_PARENT
-        and is_parent
-        and (path_names or path_apps)
-    ):
-        r += 1
+def iter_group_rows(ws, table, top, r, poeings, widths):
+    """
+    Writes the rows of the group rooted at `top` through ws.cell(), yielding
+    each row number before the row is started (all rows above it are final
+    then). The subtree is walked in preorder over the table; the ancestor
+    labels and group keys are kept in shared buffers cut back to each node's
+    depth, and open parents wait on a stack for their bottom border.
+    Returns the last row used by the group.
+    """
+    base = table.depth[top]
+    keys = GroupKeyPath()
+    path_apps = []
+    open_parents = []
+    cur = r - 1
+
+    for i in range(top, table.end[top]):
+        level = table.depth[i] - base
+        while len(open_parents) > level:
+            open_parents.pop()
+            set_group_bottom_thick(ws, cur, 1, 11)
+        keys.cut(level)
+        del path_apps[level:]
+
+        name = table.name[i]
+        appn = table.app[i]
+        desc = table.desc[i]
+        label = appn if appn else (name if name else "(unnamed)")
+        is_parent = table.has_children[i]
+        disabled = not table.enabled[i]
+        parent_raw = path_apps[-1] if path_apps else ""
 
-    display_a = label
-    parent_display = parent_raw
-    typ = "Hierarchieelement" if is_parent else "Aktenablage"
+        cur += 1
+        if USE_BLANK_BEFORE_PARENT and is_parent and level:
+            cur += 1
 
-    full_names_path = path_names + [name]
-    perm_key = build_group_key_from_names(full_names_path)
-    ancestor_keys = [
-        build_group_key_from_names(full_names_path[:i])
-        for i in range(1, len(full_names_path) + 1)
-    ]
+        yield cur
 
-    values = [
-        display_a,
-        desc,
-        parent_display,
-        typ,
-        break_inheritance_from_node(node, desc),
-        allowed_types_for(label, "Posteingang" if is_poe_label(label) else typ),
-    ]
+        display_a = label
+        parent_display = parent_raw
+        typ = "Hierarchieelement" if is_parent else "Aktenablage"
 
-    for j, v in enumerate(values, start=1):
-        c = ws.cell(row=r, column=j, value=v)
-        c.alignment = LEFT
-        c.border = BOX2
+        perm_key = keys.push(table, i)
 
-    g_list = [make_addr(perm_key, "RO")]
-    h_list = [make_addr(perm_key, "")]
-    i_list = [make_addr(perm_key, "FA")]
-    j_list_vals = [make_addr(k, "LA") for k in ancestor_keys]
-    # CHANGED: Ablageadmin now also uses all ancestor keys (like Löschadmin)
-    k_list = [make_addr(k, "AA") for k in ancestor_keys]
+        values = [
+            display_a,
+            desc,
+            parent_display,
+            typ,
+            break_inheritance_from_node(table, i, desc),
+            allowed_types_for(label, "Posteingang" if is_poe_label(label) else typ),
+        ]
 
-    for offset, items in enumerate([g_list, h_list, i_list, j_list_vals, k_list], start=7):
-        cell_val = ";".join(items) + f";{ADMIN_ACCOUNT}"
-        c = ws.cell(row=r, column=offset, value=cell_val)
-        c.alignment = LEFT
-        c.border = BOX2
+        for j, v in enumerate(values, start=1):
+            widths.see(j, v)
+            c = ws.cell(row=cur, column=j, value=v)
+            c.alignment = LEFT
+            c.border = BOX2
 
-    if is_parent:
-        fill = DISABLED_BLUE if disabled else BLUE
-        font = GRAYB if disabled else WHITEB
-    else:
-        fill = PALEGR
-        font = GRAYB if disabled else BLACK
+        addr_lists = [
+            make_addr(perm_key, "RO"),
+            make_addr(perm_key, ""),
+            make_addr(perm_key, "FA"),
+            keys.la,
+            # CHANGED: Ablageadmin now also uses all ancestor keys (like Löschadmin)
+            keys.aa,
+        ]
+
+        for offset, items in enumerate(addr_lists, start=7):
+            cell_val = f"{items};{ADMIN_ACCOUNT}"
+            widths.see(offset, cell_val)
+            c = ws.cell(row=cur, column=offset, value=cell_val)
+            c.alignment = LEFT
+            c.border = BOX2
 
-    for col in range(1, 12):
-        ws.cell(row=r, column=col).fill = fill
-        ws.cell(row=r, column=col).font = font
+        if is_parent:
+            fill = DISABLED_BLUE if disabled else BLUE
+            font = GRAYB if disabled else WHITEB
+        else:
+            fill = PALEGR
+            font = GRAYB if disabled else BLACK
 
-    if not is_parent and disabled:
-        gray_out_row(ws, r, 1, 11)
+        for col in range(1, 12):
+            ws.cell(row=cur, column=col).fill = fill
+            ws.cell(row=cur, column=col).font = font
 
-    if is_parent:
-        set_row_top_thick(ws, r, 1, 11)
+        if not is_parent and disabled:
+            gray_out_row(ws, cur, 1, 11)
 
-    cur = r
+        if is_parent:
+            set_row_top_thick(ws, cur, 1, 11)
 
-    if is_poe_label(label):
-        poeings.append({"path": list(path_apps), "disabled": disabled})
+        if is_poe_label(label):
+            poeings.append({"path": list(path_apps), "disabled": disabled})
 
-    for child in kids:
-        cur += 1
-        cur, _ = write_group_recursive(
-            ws,
-            child,
-            cur,
-            path_names=full_names_path,
-            path_apps=path_apps + [label],
-            poeings=poeings,
-        )
+        path_apps.append(label)
+        if is_parent:
+            open_parents.append(i)
 
-    if is_parent:
+    for _ in open_parents:
         set_group_bottom_thick(ws, cur, 1, 11)
 
-    return cur, poeings
+    return cur
 
 
-def add_second_sheet(wb: Workbook, tree):
-    ws = wb.create_sheet(title=SHEET2_NAME)
+def write_group(ws, table, top, r, poeings, widths):
+    cur = drain(iter_group_rows(ws, table, top, r, poeings, widths))
+    return cur, poeings
+
 
+def write_header(ws, widths):
     headers = [
         "Bezeichnung strukturierte Ablage",
         "Beschreibung",
@@ -212,6 +224,7 @@ def add_second_sheet(wb: Workbook, tree):
         "Ablageadministration",
     ]
     for col_idx, h in enumerate(headers, start=1):
+        widths.see(col_idx, h)
         c = ws.cell(row=1, column=col_idx, value=h)
         c.font = BLACKB
         c.alignment = LEFT
@@ -220,19 +233,34 @@ def add_second_sheet(wb: Workbook, tree):
     for col_idx in range(7, 12):
         ws.cell(row=1, column=col_idx).fill = PALEGR
 
-    working_nodes = strip_prefix_levels(tree, SKIP_PARENTS)
+
+@lru_cache(maxsize=1)
+def header_template():
+    tpl = SheetTemplate()
+    write_header(tpl, tpl.widths)
+    return tpl
+
+
+def iter_sheet_rows(ws, table, widths):
+    yield 1
+    header_template().write(ws, widths)
+
+    working_nodes = strip_prefix_levels(table, SKIP_PARENTS)
 
     r = 2
     all_poeings = []
 
     for top in working_nodes:
-        r, poe = write_group_recursive(ws, top, r, [], [], [])
+        poe = []
+        r = yield from iter_group_rows(ws, table, top, r, poe, widths)
         all_poeings.extend(poe)
         r += 1
 
     first_pokorb_row = None
 
     for pe in all_poeings:
+        yield r
+
         parent_app = pe["path"][-2] if len(pe["path"]) >= 2 else ""
         label = f"PoKorb_Pe_{parent_app}" if parent_app else "PoKorb"
         parent = f"Pe_{parent_app}" if parent_app else "Pe"
@@ -247,6 +275,7 @@ def add_second_sheet(wb: Workbook, tree):
         ]
 
         for j, v in enumerate(values, start=1):
+            widths.see(j, v)
             c = ws.cell(row=r, column=j, value=v)
             c.alignment = LEFT
             c.border = BOX2
@@ -280,6 +309,26 @@ def add_second_sheet(wb: Workbook, tree):
 
         r += 1
 
+
+def add_second_sheet(wb: Workbook, table, progress=None):
+    ws = wb.create_sheet(title=SHEET2_NAME)
+    widths = ColumnWidths()
+    drain(track_rows(iter_sheet_rows(ws, table, widths), progress, "Ablage"))
     ws.freeze_panes = "A2"
-    autosize_columns(ws, min_w=10, max_w=120)
+    widths.apply(ws, 11, min_w=10, max_w=120)
+    return ws
+
+
+def stream_second_sheet(wb: Workbook, table, progress=None):
+    """Ablage sheet for a write-only workbook, appended row by row."""
+    widths = ColumnWidths()
+    drain(iter_sheet_rows(NullSheet(), table, widths))
+
+    ws = wb.create_sheet(title=SHEET2_NAME)
+    ws.freeze_panes = "A2"
+    widths.apply(ws, 11, min_w=10, max_w=120)
+
+    buf = RowBuffer()
+    rows = track_rows(iter_sheet_rows(buf, table, widths), progress, "Ablage")
+    stream_rows(ws, compose_rows(rows, buf))
     return ws
@@ -1,10 +1,12 @@
+from functools import lru_cache
+
 from openpyxl import Workbook
+from openpyxl.formatting.rule import FormulaRule
 from openpyxl.utils import get_column_letter
 
 from config import (
     SHEET_NAME,
     GROUPS_FROM_LEVEL,
-    PREFIX,
     PERM_HEADERS,
     PERM_SUFFIX,
     LEFT_HEADERS,
@@ -14,15 +16,29 @@ from config import (
     ROW_TITLE,
     ROW_CAPTION,
     ROW_HEADERS,
+    DATA_START_ROW,
+    TEMPLATE_CACHE_SIZE,
 )
+from groups import ge_key
 from styles import (
     ORANGE, CYAN, PALEGR, BLUE, LIME, TITLE_GRAY,
     WHITEB, BLACKB, GRAY, LEFT, CENTER, BOX,
 )
-from utils import norm_token, gray_out_row
+from utils import (
+    gray_out_row,
+    merge_cells,
+    drain,
+    ColumnWidths,
+    NullSheet,
+    RowBuffer,
+    SheetTemplate,
+    compose_rows,
+    stream_rows,
+    track_rows,
+)
 
 
-def create_sheet(last_name_col: int, perm1_cols: int, perm2_cols: int, max_depth: int):
+def sheet_columns(last_name_col: int, perm1_cols: int, perm2_cols: int, max_depth: int):
     spacer1 = last_name_col + 1
     perm1_s = spacer1 + 1
     perm1_e = perm1_s + perm1_cols - 1
@@ -35,106 +51,119 @@ def create_sheet(last_name_col: int, perm1_cols: int, perm2_cols: int, max_depth
     tree_base = spacer4 + 1
     tree_end  = tree_base + max_depth
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = SHEET_NAME
+    return {
+        "last_name_col": last_name_col,
+        "spacer1": spacer1, "perm1_s": perm1_s, "perm1_e": perm1_e,
+        "spacer2": spacer2, "perm2_s": perm2_s, "perm2_e": perm2_e,
+        "spacer3": spacer3, "flat_col": flat_col, "spacer4": spacer4,
+        "tree_base": tree_base, "tree_end": tree_end, "max_depth": max_depth
+    }
+
+
+def format_sheet(ws, cols):
+    last_name_col = cols["last_name_col"]
 
     for c in range(1, last_name_col):
         ws.column_dimensions[get_column_letter(c)].width = 4
     ws.column_dimensions[get_column_letter(last_name_col)].width = 26
-    for c in [spacer1, spacer2, spacer3, spacer4]:
+    for c in [cols["spacer1"], cols["spacer2"], cols["spacer3"], cols["spacer4"]]:
         ws.column_dimensions[get_column_letter(c)].width = 2
-    for c in list(range(perm1_s, perm1_e+1)) + list(range(perm2_s, perm2_e+1)):
+    for c in list(range(cols["perm1_s"], cols["perm1_e"]+1)) + list(range(cols["perm2_s"], cols["perm2_e"]+1)):
         ws.column_dimensions[get_column_letter(c)].width = 22
-    ws.column_dimensions[get_column_letter(flat_col)].width = 26
-    for c in range(tree_base, tree_end+1):
+    ws.column_dimensions[get_column_letter(cols["flat_col"])].width = 26
+    for c in range(cols["tree_base"], cols["tree_end"]+1):
         ws.column_dimensions[get_column_letter(c)].width = 6
 
     for r,h in [(ROW_BAND,24),(ROW_TITLE,20),(ROW_HEADERS-1,18)]:
         ws.row_dimensions[r].height = h
 
-    ws.merge_cells(start_row=ROW_BAND, start_column=perm1_s, end_row=ROW_BAND, end_column=perm1_e)
-    c1 = ws.cell(row=ROW_BAND, column=perm1_s, value="eDir")
+    merge_cells(ws, ROW_BAND, cols["perm1_s"], ROW_BAND, cols["perm1_e"])
+    merge_cells(ws, ROW_BAND, cols["perm2_s"]+1, ROW_BAND, cols["perm2_e"])
+    merge_cells(ws, ROW_CAPTION, cols["perm1_s"], ROW_CAPTION, cols["perm1_e"])
+    merge_cells(ws, ROW_BAND, cols["flat_col"], ROW_BAND, cols["tree_end"])
+    merge_cells(ws, ROW_HEADERS-1, cols["tree_base"], ROW_HEADERS-1, cols["tree_end"])
+
+
+def write_header(ws, cols, widths):
+    def put(row, col, value):
+        widths.see(col, value)
+        return ws.cell(row=row, column=col, value=value)
+
+    perm1_s, perm2_s = cols["perm1_s"], cols["perm2_s"]
+    flat_col, tree_base = cols["flat_col"], cols["tree_base"]
+
+    c1 = put(ROW_BAND, perm1_s, "eDir")
     c1.fill = ORANGE; c1.font = WHITEB; c1.alignment = CENTER; c1.border = BOX
 
-    chip = ws.cell(row=ROW_BAND, column=perm2_s, value="eDir")
+    chip = put(ROW_BAND, perm2_s, "eDir")
     chip.fill = ORANGE; chip.font = WHITEB; chip.alignment = CENTER; chip.border = BOX
 
-    ws.merge_cells(start_row=ROW_BAND, start_column=perm2_s+1, end_row=ROW_BAND, end_column=perm2_e)
-    c2 = ws.cell(row=ROW_BAND, column=perm2_s+1, value="AD(DFSW)")
+    c2 = put(ROW_BAND, perm2_s+1, "AD(DFSW)")
     c2.fill = CYAN; c2.font = BLACKB; c2.alignment = CENTER; c2.border = BOX
 
-    ws.cell(row=ROW_TITLE, column=1, value="Struktur Gruppen mit Schreibzugriff").font = BLACKB
-    ws.merge_cells(start_row=ROW_CAPTION, start_column=perm1_s, end_row=ROW_CAPTION, end_column=perm1_e)
-    ws.cell(row=ROW_CAPTION, column=perm1_s, value="auf Knoten zusätzlich anzulegende Gruppen").font = BLACKB
+    put(ROW_TITLE, 1, "Struktur Gruppen mit Schreibzugriff").font = BLACKB
+    put(ROW_CAPTION, perm1_s, "auf Knoten zusätzlich anzulegende Gruppen").font = BLACKB
 
     for j,hdr in enumerate(LEFT_HEADERS, start=perm1_s):
-        hc = ws.cell(row=ROW_HEADERS, column=j, value=hdr)
+        hc = put(ROW_HEADERS, j, hdr)
         hc.font = BLACKB; hc.alignment = CENTER; hc.border = BOX
     for j,hdr in enumerate(PERM_HEADERS, start=perm2_s):
-        hc = ws.cell(row=ROW_HEADERS, column=j, value=hdr)
+        hc = put(ROW_HEADERS, j, hdr)
         hc.font = BLACKB; hc.alignment = CENTER; hc.border = BOX
 
-    ws.merge_cells(start_row=ROW_BAND, start_column=flat_col, end_row=ROW_BAND, end_column=tree_end)
-    ab = ws.cell(row=ROW_BAND, column=flat_col, value="nscale strukturierte Ablage")
+    ab = put(ROW_BAND, flat_col, "nscale strukturierte Ablage")
     ab.fill = PALEGR; ab.font = BLACKB; ab.alignment = LEFT; ab.border = BOX
 
-    ws.cell(row=ROW_HEADERS-1, column=flat_col, value="Liste").font = BLACKB
-    ws.merge_cells(start_row=ROW_HEADERS-1, start_column=tree_base, end_row=ROW_HEADERS-1, end_column=tree_end)
-    bh = ws.cell(row=ROW_HEADERS-1, column=tree_base, value="Baum")
+    put(ROW_HEADERS-1, flat_col, "Liste").font = BLACKB
+    bh = put(ROW_HEADERS-1, tree_base, "Baum")
     bh.font = BLACKB; bh.alignment = LEFT
 
-    cols = {
-        "spacer1": spacer1, "perm1_s": perm1_s, "perm1_e": perm1_e,
-        "spacer2": spacer2, "perm2_s": perm2_s, "perm2_e": perm2_e,
-        "spacer3": spacer3, "flat_col": flat_col, "spacer4": spacer4,
-        "tree_base": tree_base, "tree_end": tree_end, "max_depth": max_depth
-    }
-    return wb, ws, cols
 
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def header_template(last_name_col: int, perm1_cols: int, perm2_cols: int, max_depth: int):
+    """Layout and header of the GE sheet; in practice only max_depth varies."""
+    cols = sheet_columns(last_name_col, perm1_cols, perm2_cols, max_depth)
+    tpl = SheetTemplate()
+    format_sheet(tpl, cols)
+    write_header(tpl, cols, tpl.widths)
+    return tpl
 
-# ASCII-tree helpers
 
-def draw_verticals_before_elbow(ws, row: int, level: int, last_stack, base_col: int = 1):
-    if level <= 1:
-        return
-    for d in range(0, level - 1):
-        idx = d + 1
-        if idx < len(last_stack) and not last_stack[idx]:
-            c = ws.cell(row=row, column=base_col + d, value="│")
-            c.alignment = CENTER
-            c.font = GRAY
+def create_sheet(last_name_col: int, perm1_cols: int, perm2_cols: int, max_depth: int, widths):
+    cols = sheet_columns(last_name_col, perm1_cols, perm2_cols, max_depth)
 
+    wb = Workbook()
+    ws = wb.active
+    ws.title = SHEET_NAME
 
-def draw_verticals_through_subtree(ws, row: int, level: int, last_stack, base_col: int = 1):
-    if level <= 0:
-        return
-    for d in range(0, level):
-        idx = d + 1
-        if idx < len(last_stack) and not last_stack[idx]:
-            c = ws.cell(row=row, column=base_col + d, value="│")
+    tpl = header_template(last_name_col, perm1_cols, perm2_cols, max_depth)
+    tpl.layout(ws)
+    tpl.write(ws, widths)
+    return wb, ws, cols
+
+
+# ASCII-tree helpers
+
+def draw_verticals_before_elbow(ws, row: int, level: int, lasts, base_col: int = 1):
+    for d in range(1, level):
+        if not lasts[d]:
+            c = ws.cell(row=row, column=base_col + d - 1, value="│")
             c.alignment = CENTER
             c.font = GRAY
 
 
-def draw_connectors(ws, row: int, level: int, last_stack, base_col: int = 1):
+def draw_connectors(ws, row: int, level: int, lasts, base_col: int = 1):
+    """lasts[d] tells whether the ancestor at depth d (the node itself at d == level) is a last child."""
     if level <= 0:
         return
-    draw_verticals_before_elbow(ws, row, level, last_stack, base_col=base_col)
+    draw_verticals_before_elbow(ws, row, level, lasts, base_col=base_col)
     elbow_col = base_col + (level - 1)
-    elbow = "└" if last_stack[-1] else "├"
+    elbow = "└" if lasts[level] else "├"
     c = ws.cell(row=row, column=elbow_col, value=elbow)
     c.alignment = CENTER
     c.font = GRAY
 
 
-def extend_connectors(ws, start_row: int, end_row: int, level: int, last_stack, base_col: int = 1):
-    if end_row < start_row or level < 0:
-        return
-    for r in range(start_row, end_row + 1):
-        draw_verticals_through_subtree(ws, r, level, last_stack, base_col=base_col)
-
-
 def style_cell_like_node(cell, label: str, is_container: bool):
     cell.alignment = LEFT
     cell.border = BOX
@@ -165,71 +194,150 @@ def is_poeing(s: str) -> bool:
     return (s or "").strip().lower() == "poeing"
 
 
-def write_rows(ws, nodes, row, level, last_stack, cols, lineage_names, lineage_apps):
-    name_col = level + 1
-    for i, node in enumerate(nodes):
-        name = (node.get("name") or "").strip()
-        appn = (node.get("appName") or name).strip()
-        children = node.get("children") or []
-        if not name and not children:
+def iter_rows(ws, table, row, cols, widths, sparse=False):
+    """
+    Writes one row per node through ws.cell(), walking the table in preorder.
+    Before starting a row it yields the row number, so everything above it is
+    final; the connectors of a subtree are drawn by its own rows and never
+    revisited. The is_last flags and name tokens of the current ancestors sit
+    in two buffers that are cut back to the node's depth, so nothing is copied
+    per node and depth is not limited by recursion. Texts are reported to
+    widths (single-character connectors and fillers never exceed the minimum
+    width). Returns the next free row.
+
+    With sparse=True the "-" fillers and the empty spacer cells are left out;
+    add_filler_rule() then boxes the filler region instead, without the
+    dashes. A disabled row then greys only the cells it writes, not the
+    filler, spacer and empty tree view columns.
+    """
+    lasts = []
+    tokens = []
+    spacers = [cols["spacer1"], cols["spacer2"], cols["spacer3"], cols["spacer4"]]
+    for i in range(len(table)):
+        level = table.depth[i]
+        del lasts[level:]
+        del tokens[level:]
+        lasts.append(table.is_last[i])
+        tokens.append(table.token[i])
+
+        name = table.name[i]
+        appn = table.app[i]
+        has_children = table.has_children[i]
+        if not name and not has_children:
             continue
 
-        is_last = (i == len(nodes) - 1)
-        disabled = (node.get("enabled") is False)
+        disabled = not table.enabled[i]
+        name_col = level + 1
 
-        draw_connectors(ws, row, level, last_stack + [is_last], base_col=1)
+        yield row
+        draw_connectors(ws, row, level, lasts, base_col=1)
 
-        nc = ws.cell(row=row, column=name_col, value=name if name else "(unnamed)")
-        style_name_cell(nc, name, bool(children))
+        name_label = name if name else "(unnamed)"
+        nc = ws.cell(row=row, column=name_col, value=name_label)
+        widths.see(name_col, name_label)
+        style_name_cell(nc, name, has_children)
 
-        for dc in range(name_col + 1, cols["spacer1"]):
-            d = ws.cell(row=row, column=dc, value="-")
-            d.alignment = CENTER
-            d.border = BOX
+        if not sparse:
+            for dc in range(name_col + 1, cols["spacer1"]):
+                d = ws.cell(row=row, column=dc, value="-")
+                d.alignment = CENTER
+                d.border = BOX
 
-        for sc in [cols["spacer1"], cols["spacer2"], cols["spacer3"], cols["spacer4"]]:
-            ws.cell(row=row, column=sc, value="")
+            for sc in spacers:
+                ws.cell(row=row, column=sc, value="")
 
         if level >= GROUPS_FROM_LEVEL and name:
             for j, suf in enumerate(LEFT_SUFFIX, start=cols["perm1_s"]):
                 val = f"{name}-{suf}" if suf else name
+                widths.see(j, val)
                 g = ws.cell(row=row, column=j, value=val)
                 g.alignment = LEFT
                 g.border = BOX
 
         if level >= GROUPS_FROM_LEVEL and name:
-            tokens = lineage_names + [norm_token(name)]
-            start = min(GROUPS_FROM_LEVEL, len(tokens) - 1)
-            key = PREFIX + "_".join(tokens[start:])
+            key = ge_key(tokens)
             for j, suf in enumerate(PERM_SUFFIX, start=cols["perm2_s"]):
                 val = f"{key}-{suf}" if suf else key
+                widths.see(j, val)
                 g = ws.cell(row=row, column=j, value=val)
                 g.alignment = LEFT
                 g.border = BOX
 
         flat_label = appn if appn else (name if name else "(unnamed)")
         fc = ws.cell(row=row, column=cols["flat_col"], value=flat_label)
-        style_cell_like_node(fc, flat_label, bool(children))
+        widths.see(cols["flat_col"], flat_label)
+        style_cell_like_node(fc, flat_label, has_children)
 
         r_name_col = cols["tree_base"] + level
         tv_label = appn if appn else (name if name else "(unnamed)")
         tv = ws.cell(row=row, column=r_name_col, value=tv_label)
-        style_cell_like_node(tv, tv_label, bool(children))
+        widths.see(r_name_col, tv_label)
+        style_cell_like_node(tv, tv_label, has_children)
 
-        if disabled:
+        if disabled and not sparse:
             gray_out_row(ws, row, 1, cols["tree_end"])
+        elif disabled:
+            gray_out_row(ws, row, 1, name_col)
+            if level >= GROUPS_FROM_LEVEL and name:
+                gray_out_row(ws, row, cols["perm1_s"], cols["perm1_e"])
+                gray_out_row(ws, row, cols["perm2_s"], cols["perm2_e"])
+            gray_out_row(ws, row, cols["flat_col"], cols["flat_col"])
+            gray_out_row(ws, row, r_name_col, r_name_col)
 
-        subtree_start_row = row
         row += 1
 
-        if children:
-            row = write_rows(
-                ws, children, row, level + 1, last_stack + [is_last], cols,
-                lineage_names + [norm_token(name)],
-                lineage_apps + [appn]
-            )
+    return row
 
-        subtree_end_row = row - 1
-        extend_connectors(ws, subtree_start_row + 1, subtree_end_row, level, last_stack + [is_last], base_col=1)
 
-    return row
+def add_filler_rule(ws, cols, end_row: int):
+    """
+    Conditional format for sparse rows (see iter_rows): a blank cell of the
+    tree columns gets the filler's box when a cell left of it in the same row
+    holds something other than a connector, i.e. it lies right of the name.
+    Formats cannot show text, and a number format does nothing for a blank
+    cell, so the "-" itself is dropped in sparse mode; so is the grey fill of
+    disabled rows in that region.
+    """
+    last = cols["spacer1"] - 1
+    if end_row <= DATA_START_ROW or last < 2:
+        return
+    r = DATA_START_ROW
+    left = f"$A{r}:A{r}"
+    connectors = "+".join(f'COUNTIF({left},"{ch}")' for ch in ("│", "├", "└"))
+    ws.conditional_formatting.add(
+        f"B{r}:{get_column_letter(last)}{end_row - 1}",
+        FormulaRule(formula=[f'AND(B{r}="",COUNTA({left})>{connectors})'], border=BOX),
+    )
+
+
+def write_rows(ws, table, row, cols, widths, progress=None, sparse=False):
+    end = drain(track_rows(iter_rows(ws, table, row, cols, widths, sparse), progress, "GE"))
+    if sparse:
+        add_filler_rule(ws, cols, end)
+    return end
+
+
+def stream_sheet(wb, table, max_depth: int, progress=None, sparse=False):
+    """
+    GE sheet for a write-only workbook: rows are composed and appended one at a
+    time. Widths come from a first run against a NullSheet, since they have
+    to be written before the first row.
+    """
+    cols = sheet_columns(max_depth + 1, len(LEFT_HEADERS), len(PERM_HEADERS), max_depth)
+    tpl = header_template(max_depth + 1, len(LEFT_HEADERS), len(PERM_HEADERS), max_depth)
+
+    widths = ColumnWidths()
+    tpl.see(widths)
+    end = drain(iter_rows(NullSheet(), table, DATA_START_ROW, cols, widths, sparse))
+
+    ws = wb.create_sheet(title=SHEET_NAME)
+    tpl.layout(ws)
+    widths.apply(ws, cols["tree_end"], min_w=8, max_w=60)
+
+    buf = RowBuffer()
+    tpl.write(buf, widths)
+    rows = track_rows(iter_rows(buf, table, DATA_START_ROW, cols, widths, sparse), progress, "GE")
+    stream_rows(ws, compose_rows(rows, buf))
+    if sparse:
+        add_filler_rule(ws, cols, end)
+    return ws
@@ -1,48 +1,36 @@
+from functools import lru_cache
+
 from openpyxl import Workbook
 from openpyxl.styles import Border, PatternFill
-from config import SHEET3_NAME, SKIP_PARENTS, ROLE_HEADER_TEXT
-from styles import BLUE, PALEGR, GRID_GRAY, THICK, THICK_BOTTOM, BOX, LEFT, BLACKB, GRAYB, WHITEB
-from utils import strip_prefix_levels, autosize_columns, gray_out_row_full
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.utils import get_column_letter
+from config import SHEET3_NAME, SKIP_PARENTS, ROLE_HEADER_TEXT, TEMPLATE_CACHE_SIZE
+from styles import (
+    BLUE, PALEGR, DISABLED_FILL, GRID_GRAY, THICK, THICK_BOTTOM, BOX, LEFT, BLACKB, GRAY, GRAYB, WHITEB,
+)
+from utils import (
+    strip_prefix_levels, merge_cells, ColumnWidths, CellRun, RowCell, SheetTemplate, StyleCache,
+    write_row, stream_rows, track_rows,
+)
 
 DISABLED_BLUE = PatternFill("solid", fgColor="9FB7D9")
 
+USER_ROWS = 15
+USER_BLOCK_TEXT = (
+    "Benutzer\n\n"
+    "Pro Zelle genau EIN Benutzer.\n"
+    "Benutzer nur in diesem Bereich eintragen – je Rolle in den zugehörigen Feldern.\n"
+    "Eintragung spaltenweise oder zeilenweise möglich."
+)
 
-def fill_row(ws, row, start_col, end_col, fill):
-    for c in range(start_col, end_col + 1):
-        ws.cell(row=row, column=c).fill = fill
-
-
-def roles_sheet_header(ws, roles_count: int):
-    ws.cell(row=2, column=1).value = "Ablagen / Hierarchieelemente"
-    ws.cell(row=2, column=1).font = BLACKB
-    ws.cell(row=2, column=1).alignment = LEFT
-
-    ws.cell(row=2, column=3).value = "Beschreibung"
-    ws.cell(row=2, column=3).font = BLACKB
-    ws.cell(row=2, column=3).alignment = LEFT
 
+def roles_sheet_format(ws, roles_count: int, end_row: int):
     col = 4
     for k in range(roles_count):
-        ws.merge_cells(start_row=1, start_column=col, end_row=1, end_column=col + 2)
-        ws.cell(row=1, column=col).value = f"{ROLE_HEADER_TEXT} {k+1}"
-        ws.cell(row=1, column=col).font = BLACKB
-        ws.cell(row=1, column=col).alignment = LEFT
-
-        ws.cell(row=2, column=col).value = "Lesen"
-        ws.cell(row=2, column=col).font = BLACKB
-        ws.cell(row=2, column=col).alignment = LEFT
-
-        ws.cell(row=2, column=col + 1).value = "Schreiben"
-        ws.cell(row=2, column=col + 1).font = BLACKB
-        ws.cell(row=2, column=col + 1).alignment = LEFT
-
-        ws.cell(row=2, column=col + 2).value = "LA"
-        ws.cell(row=2, column=col + 2).font = BLACKB
-        ws.cell(row=2, column=col + 2).alignment = LEFT
-
+        merge_cells(ws, 1, col, 1, col + 2)
         col += 3
+    merge_cells(ws, end_row + 1, 1, end_row + USER_ROWS, 3)
 
-    from openpyxl.utils import get_column_letter
     ws.column_dimensions[get_column_letter(1)].width = 38
     ws.column_dimensions[get_column_letter(2)].width = 2
     ws.column_dimensions[get_column_letter(3)].width = 56
@@ -50,231 +38,289 @@ def roles_sheet_header(ws, roles_count: int):
         ws.column_dimensions[get_column_letter(c)].width = 10
 
 
-def apply_role_vertical_borders(ws, roles_count: int, end_row: int):
-    total_cols = 3 + roles_count * 3
-
-    for k in range(roles_count):
-        base = 4 + k * 3
-        mid = base + 1
-        last = base + 2
-
-        for r in range(1, end_row + 1):
-            ws.cell(row=r, column=base).border = Border(
-                left=ws.cell(row=r, column=base).border.left,
-                right=GRID_GRAY,
-                top=ws.cell(row=r, column=base).border.top,
-                bottom=ws.cell(row=r, column=base).border.bottom,
-            )
-            ws.cell(row=r, column=mid).border = Border(
-                left=ws.cell(row=r, column=mid).border.left,
-                right=GRID_GRAY,
-                top=ws.cell(row=r, column=mid).border.top,
-                bottom=ws.cell(row=r, column=mid).border.bottom,
-            )
-            ws.cell(row=r, column=last).border = Border(
-                left=ws.cell(row=r, column=last).border.left,
-                right=THICK,
-                top=ws.cell(row=r, column=last).border.top,
-                bottom=ws.cell(row=r, column=last).border.bottom,
+class RoleGrid:
+    """
+    Final border of every cell of the roles sheet. Left/right depend only on
+    the column (description columns, role groups, outer edge), top/bottom only
+    on the kind of row (headers, body, last body row, user block). Each
+    distinct combination is built once as a Border and shared by all cells.
+    """
+
+    def __init__(self, roles_count: int, end_row: int):
+        total_cols = 3 + roles_count * 3
+        self.total_cols = total_cols
+        self.end_row = end_row
+        self.bottom_end = end_row + USER_ROWS
+
+        left = [None] * (max(total_cols, 4) + 1)
+        right = [None] * (max(total_cols, 4) + 1)
+        for k in range(roles_count):
+            base = 4 + k * 3
+            right[base] = GRID_GRAY
+            right[base + 1] = GRID_GRAY
+            right[base + 2] = THICK
+        left[4] = THICK
+        left[2] = GRID_GRAY
+        left[3] = GRID_GRAY
+        right[total_cols] = THICK
+        self.left = left
+        self.right = right
+
+        self._borders = {}
+        self._rows = {}
+
+    def border(self, base, col: int, top, bottom):
+        left, right = self.left[col], self.right[col]
+        key = (id(base), id(left), id(right), id(top), id(bottom))
+        b = self._borders.get(key)
+        if b is None:
+            b = self._borders[key] = Border(
+                left=left or base.left,
+                right=right or base.right,
+                top=top or base.top,
+                bottom=bottom or base.bottom,
             )
+        return b
+
+    def edges(self, row: int):
+        top = GRID_GRAY if row >= 3 else None
+        if row == 2:
+            bottom = GRID_GRAY
+        elif row == self.end_row or row == self.bottom_end:
+            bottom = THICK_BOTTOM
+        else:
+            bottom = None
+        return top, bottom
+
+    def row(self, row: int):
+        """Borders of one row, indexed by column (1..total_cols)."""
+        top, bottom = self.edges(row)
+        key = (id(top), id(bottom))
+        borders = self._rows.get(key)
+        if borders is None:
+            borders = [None] + [
+                self.border(DEFAULT_BORDER, c, top, bottom)
+                for c in range(1, self.total_cols + 1)
+            ]
+            self._rows[key] = borders
+        return borders
+
+    def cells(self, row: int, run: bool = False):
+        """
+        Fresh {column: RowCell} for one row, borders already resolved. With
+        run=True the role columns, which never hold a text of their own, are a
+        single CellRun, so the row costs the same whatever the roles_count.
+        """
+        borders = self.row(row)
+        cells = {}
+        last = 3 if run and self.total_cols > 3 else self.total_cols
+        for c in range(1, last + 1):
+            cell = cells[c] = RowCell()
+            cell.border = borders[c]
+        if last < self.total_cols:
+            cells[4] = CellRun(4, self.total_cols, borders)
+        return cells
+
+
+def get_label(table, i):
+    return table.app[i]
+
+
+def get_desc(table, i):
+    return table.desc[i]
 
-    for r in range(1, end_row + 1):
-        ws.cell(row=r, column=4).border = Border(
-            left=THICK,
-            right=ws.cell(row=r, column=4).border.right,
-            top=ws.cell(row=r, column=4).border.top,
-            bottom=ws.cell(row=r, column=4).border.bottom,
-        )
-
-    for r in range(1, end_row + 1):
-        ws.cell(row=r, column=2).border = Border(
-            left=GRID_GRAY,
-            right=ws.cell(row=r, column=2).border.right,
-            top=ws.cell(row=r, column=2).border.top,
-            bottom=ws.cell(row=r, column=2).border.bottom,
-        )
-
-    for r in range(1, end_row + 1):
-        ws.cell(row=r, column=3).border = Border(
-            left=GRID_GRAY,
-            right=ws.cell(row=r, column=3).border.right,
-            top=ws.cell(row=r, column=3).border.top,
-            bottom=ws.cell(row=r, column=3).border.bottom,
-        )
-
-    for r in range(1, end_row + 1):
-        ws.cell(row=r, column=total_cols).border = Border(
-            left=ws.cell(row=r, column=total_cols).border.left,
-            right=THICK,
-            top=ws.cell(row=r, column=total_cols).border.top,
-            bottom=ws.cell(row=r, column=total_cols).border.bottom,
-        )
-
-
-def apply_gray_horizontal_grid(ws, start_row: int, end_row: int, total_cols: int):
-    for c in range(1, total_cols + 1):
-        ws.cell(row=2, column=c).border = Border(
-            left=ws.cell(row=2, column=c).border.left,
-            right=ws.cell(row=2, column=c).border.right,
-            top=ws.cell(row=2, column=c).border.top,
-            bottom=GRID_GRAY,
-        )
-    for r in range(start_row, end_row + 1):
-        for c in range(1, total_cols + 1):
-            ws.cell(row=r, column=c).border = Border(
-                left=ws.cell(row=r, column=c).border.left,
-                right=ws.cell(row=r, column=c).border.right,
-                top=GRID_GRAY,
-                bottom=ws.cell(row=r, column=c).border.bottom,
-            )
 
+def is_ab_block(label: str):
+    return label.startswith("Ab_")
 
-def apply_thick_bottom(ws, total_cols: int, end_row: int):
-    for c in range(1, total_cols + 1):
-        ws.cell(row=end_row, column=c).border = Border(
-            left=ws.cell(row=end_row, column=c).border.left,
-            right=ws.cell(row=end_row, column=c).border.right,
-            top=ws.cell(row=end_row, column=c).border.top,
-            bottom=THICK_BOTTOM,
-        )
 
+BLANK = None
 
-def write_role_row(ws, row_idx, label, desc, total_cols, fill):
-    ws.cell(row=row_idx, column=1).value = label
-    ws.cell(row=row_idx, column=1).alignment = LEFT
-    ws.cell(row=row_idx, column=3).value = desc
-    ws.cell(row=row_idx, column=3).alignment = LEFT
-    fill_row(ws, row_idx, 1, total_cols, fill)
 
+def add_blank(plan):
+    # consecutive separators collapse into one
+    if not plan or plan[-1] is not BLANK:
+        plan.append(BLANK)
 
-def get_label(node):
-    return (node.get("appName") or node.get("name") or "").strip()
 
+def plan_roles_for_subtree(table, top, plan):
+    """
+    Preorder walk over the table range of `top`. Nodes without a label are
+    skipped together with their subtree; a parent gets its closing separator
+    once the walk leaves its subtree. The stack holds the open parents with
+    the Ab_ flag their children inherit.
+    """
+    base = table.depth[top]
+    open_parents = []  # (level, children are inside an Ab_ block)
+    i, stop = top, table.end[top]
+    while i < stop:
+        level = table.depth[i] - base
+        while open_parents and open_parents[-1][0] >= level:
+            open_parents.pop()
+            add_blank(plan)
 
-def get_desc(node):
-    return (node.get("description") or "").strip()
+        label = get_label(table, i)
+        if not label:
+            i = table.end[i]
+            continue
 
+        is_parent = table.has_children[i]
+        in_ab_tree = open_parents[-1][1] if open_parents else False
 
-def is_ab_block(label: str):
-    return label.startswith("Ab_")
+        if is_ab_block(label) or (in_ab_tree and is_parent):
+            add_blank(plan)
 
+        plan.append(i)
 
-def write_roles_for_node(ws, node, row_idx, roles_count, in_ab_tree=False):
-    total_cols = 3 + roles_count * 3
-    label = get_label(node)
-    if not label:
-        return row_idx
+        if is_parent:
+            open_parents.append((level, in_ab_tree or is_ab_block(label)))
+        i += 1
 
-    children = node.get("children") or []
-    is_parent = bool(children)
-    disabled = node.get("enabled") is False
+    for _ in open_parents:
+        add_blank(plan)
 
-    if is_ab_block(label) or (in_ab_tree and is_parent):
-        ws.cell(row=row_idx, column=1).value = ""
-        row_idx += 1
 
-    current_row = row_idx
+def roles_row_plan(table):
+    """
+    Final row layout below the header: one node index per row, BLANK for a
+    separator row. Separators are already collapsed and a trailing one is
+    dropped, so row 3 + k holds plan[k].
+    """
+    plan = []
+    for top in strip_prefix_levels(table, SKIP_PARENTS):
+        plan_roles_for_subtree(table, top, plan)
+    if plan and plan[-1] is BLANK:
+        plan.pop()
+    return plan
 
-    if is_parent:
-        fill = DISABLED_BLUE if disabled else BLUE
-    else:
-        fill = PALEGR
 
-    write_role_row(ws, current_row, label, get_desc(node), total_cols, fill)
+def fill_role_row(cells, table, i, widths):
+    label = get_label(table, i)
+    is_parent = table.has_children[i]
+    disabled = not table.enabled[i]
 
     if is_parent:
-        for c in range(1, total_cols + 1):
-            ws.cell(row=current_row, column=c).font = WHITEB if not disabled else GRAYB
+        fill = DISABLED_BLUE if disabled else BLUE
+        font = GRAYB if disabled else WHITEB
+    elif disabled:
+        fill = DISABLED_FILL
+        font = GRAY
     else:
-        if disabled:
-            gray_out_row_full(ws, current_row, total_cols)
+        fill = PALEGR
+        font = None
 
-    row_idx = current_row + 1
+    for cell in cells.values():
+        cell.fill = fill
+        cell.font = font
 
-    next_in_ab_tree = in_ab_tree or is_ab_block(label)
-    for ch in children:
-        row_idx = write_roles_for_node(ws, ch, row_idx, roles_count, next_in_ab_tree)
+    desc = get_desc(table, i)
+    cells[1].value = label
+    cells[1].alignment = LEFT
+    cells[3].value = desc
+    cells[3].alignment = LEFT
+    widths.see(1, label)
+    widths.see(3, desc)
 
-    if is_parent:
-        ws.cell(row=row_idx, column=1).value = ""
-        row_idx += 1
 
-    return row_idx
+def set_label(cells, col, value, widths):
+    cell = cells[col]
+    cell.value = value
+    cell.font = BLACKB
+    cell.alignment = LEFT
+    widths.see(col, value)
 
 
-def is_blank_row(ws, row, total_cols: int):
-    for c in range(1, total_cols + 1):
-        v = ws.cell(row=row, column=c).value
-        if v not in (None, ""):
-            return False
-    return True
-
+def roles_sheet_header(grid: RoleGrid, roles_count: int, widths):
+    row1 = grid.cells(1)
+    for k in range(roles_count):
+        set_label(row1, 4 + k * 3, f"{ROLE_HEADER_TEXT} {k+1}", widths)
 
-def compress_blank_rows(ws, start_row: int, total_cols: int):
-    r = ws.max_row
-    prev_blank = False
-    while r >= start_row:
-        if is_blank_row(ws, r, total_cols):
-            if prev_blank:
-                ws.delete_rows(r, 1)
-            else:
-                prev_blank = True
+    row2 = grid.cells(2)
+    set_label(row2, 1, "Ablagen / Hierarchieelemente", widths)
+    set_label(row2, 3, "Beschreibung", widths)
+    for k in range(roles_count):
+        col = 4 + k * 3
+        set_label(row2, col, "Lesen", widths)
+        set_label(row2, col + 1, "Schreiben", widths)
+        set_label(row2, col + 2, "LA", widths)
+
+    return [row1, row2]
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def header_template(roles_count: int):
+    """The two header rows; their borders do not depend on how many rows follow."""
+    tpl = SheetTemplate()
+    grid = RoleGrid(roles_count, 2)
+    for r, cells in enumerate(roles_sheet_header(grid, roles_count, tpl.widths), start=1):
+        tpl.rows[r] = cells
+    return tpl
+
+
+def iter_role_sheet_rows(table, roles_count: int, plan, widths):
+    """
+    Yields every row of the sheet as {column: RowCell}, from the header down
+    to the end of the user block, each cell with its final style. Below the
+    header the role columns come as one CellRun per row.
+    """
+    total_cols = 3 + roles_count * 3
+    end_row = 2 + len(plan)
+    grid = RoleGrid(roles_count, end_row)
+
+    header = header_template(roles_count)
+    header.see(widths)
+    yield header.row(1)
+    yield header.row(2)
+
+    for r, i in enumerate(plan, start=3):
+        cells = grid.cells(r, run=True)
+        if i is BLANK:
+            cells[1].value = ""
         else:
-            prev_blank = False
-        r -= 1
+            fill_role_row(cells, table, i, widths)
+        yield cells
 
+    for r in range(end_row + 1, grid.bottom_end + 1):
+        cells = grid.cells(r, run=True)
+        if total_cols > 3:
+            cells[4].value = ""
+        if r == end_row + 1:
+            top, bottom = grid.edges(r)
+            set_label(cells, 1, USER_BLOCK_TEXT, widths)
+            cells[1].border = grid.border(BOX, 1, top, bottom)
+        yield cells
 
-def find_last_populated_row(ws, total_cols: int):
-    max_row = ws.max_row
-    for r in range(max_row, 2, -1):
-        if ws.cell(row=r, column=1).value not in (None, "") or ws.cell(row=r, column=3).value not in (None, ""):
-            return r
-    return 2
 
+def add_third_sheet(wb: Workbook, table, roles_count: int, progress=None):
+    plan = roles_row_plan(table)
 
-def add_third_sheet(wb: Workbook, tree, roles_count: int):
     ws = wb.create_sheet(title=SHEET3_NAME)
-    roles_sheet_header(ws, roles_count)
+    roles_sheet_format(ws, roles_count, 2 + len(plan))
 
-    working_nodes = strip_prefix_levels(tree, SKIP_PARENTS)
+    styles = StyleCache(ws)
+    widths = ColumnWidths()
+    rows = track_rows(iter_role_sheet_rows(table, roles_count, plan, widths), progress, "Roles")
+    for r, cells in enumerate(rows, start=1):
+        write_row(ws, r, cells, styles)
 
-    r = 3
-    for top in working_nodes:
-        r = write_roles_for_node(ws, top, r, roles_count, False)
+    ws.freeze_panes = "D3"
+    widths.apply(ws, 3 + roles_count * 3, 8, 60)
+    return ws
 
-    total_cols = 3 + roles_count * 3
-    compress_blank_rows(ws, 3, total_cols)
-
-    end_row = find_last_populated_row(ws, total_cols)
-
-    apply_role_vertical_borders(ws, roles_count, end_row)
-    apply_gray_horizontal_grid(ws, 3, end_row, total_cols)
-    apply_thick_bottom(ws, total_cols, end_row)
-
-    USER_ROWS = 15
-    bottom_start = end_row + 1
-    bottom_end = end_row + USER_ROWS
-
-    ws.merge_cells(start_row=bottom_start, start_column=1, end_row=bottom_end, end_column=3)
-    label_cell = ws.cell(row=bottom_start, column=1)
-    label_cell.value = (
-        "Benutzer\n\n"
-        "Pro Zelle genau EIN Benutzer.\n"
-        "Benutzer nur in diesem Bereich eintragen – je Rolle in den zugehörigen Feldern.\n"
-        "Eintragung spaltenweise oder zeilenweise möglich."
-    )
-    label_cell.font = BLACKB
-    label_cell.alignment = LEFT
-    label_cell.border = BOX
-
-    for rr in range(bottom_start, bottom_end + 1):
-        for cc in range(4, total_cols + 1):
-            ws.cell(row=rr, column=cc).value = ""
-
-    apply_role_vertical_borders(ws, roles_count, bottom_end)
-    apply_gray_horizontal_grid(ws, bottom_start, bottom_end, total_cols)
-    apply_thick_bottom(ws, total_cols, bottom_end)
 
+def stream_third_sheet(wb: Workbook, table, roles_count: int, progress=None):
+    """Roles sheet for a write-only workbook, appended row by row."""
+    plan = roles_row_plan(table)
+
+    widths = ColumnWidths()
+    for _ in iter_role_sheet_rows(table, roles_count, plan, widths):
+        pass
+
+    ws = wb.create_sheet(title=SHEET3_NAME)
+    roles_sheet_format(ws, roles_count, 2 + len(plan))
     ws.freeze_panes = "D3"
-    autosize_columns(ws, 8, 60)
+    widths.apply(ws, 3 + roles_count * 3, 8, 60)
+
+    rows = track_rows(iter_role_sheet_rows(table, roles_count, plan, widths), progress, "Roles")
+    stream_rows(ws, rows)
     return ws